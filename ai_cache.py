@@ -0,0 +1,165 @@
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_key(text: str) -> str:
+    """Normalize free text so trivially different inputs share a cache entry.
+
+    Case, punctuation and repeated whitespace are ignored: "Кофе с молоком!"
+    and "кофе с  молоком" produce the same key. Word order is kept, since it
+    ties each amount to its food ("2 яйца 3 тоста" is not "3 яйца 2 тоста").
+    """
+    text = text.lower().replace("ё", "е")
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+def weight_bucket(weight: Optional[float]) -> int:
+    """Quantize body weight so nearby weights share workout estimates."""
+    if not weight:
+        return 0
+    step = config.AI_CACHE_WEIGHT_BUCKET
+    return int(round(weight / step) * step)
+
+@dataclass
+class AICacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    writes: int = 0
+
+class AICache:
+    """Two-level cache for AI estimates: an in-memory LRU over SQLite.
+
+    Entries are JSON values stored per (namespace, key) with an expiry time,
+    so cached estimates survive restarts but are eventually re-asked.
+    """
+
+    def __init__(self, path: str, memory_size: int, ttl_seconds: float):
+        self.path = path
+        self.memory_size = memory_size
+        self.ttl_seconds = ttl_seconds
+        self.stats = AICacheStats()
+        self._memory: "OrderedDict[tuple[str, str], tuple[float, Any]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ai_cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            self._db.commit()
+        return self._db
+
+    def _db_get(self, namespace: str, key: str) -> Optional[tuple[float, Any]]:
+        with self._db_lock:
+            row = self._connect().execute(
+                "SELECT value, expires_at FROM ai_cache WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[1], json.loads(row[0])
+
+    def _db_set(self, namespace: str, key: str, value: Any, expires_at: float):
+        with self._db_lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO ai_cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value, ensure_ascii=False), expires_at)
+            )
+            db.commit()
+
+    def _remember(self, cache_key: tuple[str, str], entry: tuple[float, Any]):
+        self._memory[cache_key] = entry
+        self._memory.move_to_end(cache_key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def export_memory(self) -> list[tuple[tuple[str, str], tuple[float, Any]]]:
+        """Unexpired in-memory entries, least recently used first."""
+        now = time.time()
+        return [(cache_key, entry) for cache_key, entry in self._memory.items() if entry[0] > now]
+
+    def seed(self, cache_key: tuple[str, str], entry: tuple[float, Any]):
+        if entry[0] > time.time() and cache_key not in self._memory:
+            self._remember(cache_key, entry)
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        cache_key = (namespace, key)
+        now = time.time()
+        entry = self._memory.get(cache_key)
+        if entry is not None and entry[0] > now:
+            self._memory.move_to_end(cache_key)
+            self.stats.memory_hits += 1
+            return entry[1]
+
+        try:
+            entry = await asyncio.to_thread(self._db_get, namespace, key)
+        except sqlite3.Error as e:
+            logger.error(f"AI cache read failed: {str(e)}")
+            entry = None
+        if entry is not None and entry[0] > now:
+            self._remember(cache_key, entry)
+            self.stats.disk_hits += 1
+            return entry[1]
+
+        self.stats.misses += 1
+        return None
+
+    async def set(self, namespace: str, key: str, value: Any):
+        expires_at = time.time() + self.ttl_seconds
+        self._remember((namespace, key), (expires_at, value))
+        self.stats.writes += 1
+        try:
+            await asyncio.to_thread(self._db_set, namespace, key, value, expires_at)
+        except sqlite3.Error as e:
+            logger.error(f"AI cache write failed: {str(e)}")
+
+    def purge_expired(self) -> int:
+        with self._db_lock:
+            db = self._connect()
+            deleted = db.execute("DELETE FROM ai_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+            db.commit()
+        return deleted
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get_stats(self) -> dict:
+        lookups = self.stats.memory_hits + self.stats.disk_hits + self.stats.misses
+        return {
+            "memory_size": len(self._memory),
+            "memory_hits": self.stats.memory_hits,
+            "disk_hits": self.stats.disk_hits,
+            "misses": self.stats.misses,
+            "writes": self.stats.writes,
+            "hit_rate": (self.stats.memory_hits + self.stats.disk_hits) / lookups if lookups else 0.0
+        }
+
+ai_cache = AICache(
+    config.AI_CACHE_PATH,
+    config.AI_CACHE_MEMORY_SIZE,
+    config.AI_CACHE_TTL_DAYS * 86400
+)
@@ -1,15 +1,36 @@
+import asyncio
+import contextvars
 import json
 import aiohttp
 import logging
 import re
-from typing import Tuple, Optional
+import sqlite3
+from dataclasses import dataclass
+from typing import Optional
 from config import config
+from ai_cache import ai_cache, normalize_key, weight_bucket
+from food_database import get_food_database, split_meal
+from workout_energy import get_workout_engine, detect_intensity
+from workout_parser import parse_workout
+from metrics import timed, AI_REQUEST_SECONDS, AI_REQUEST_ERRORS, AI_RETRIES
+from log_setup import current_user_id
+from scheduler import FairQueue
 
 logger = logging.getLogger(__name__)
 
 class AIServiceError(Exception):
     pass
 
+@dataclass
+class WorkoutAnalysis:
+    workout_type: str
+    minutes: float
+    calories: float
+    explanation: str
+    parse_explanation: str
+
+_retries = AI_RETRIES.labels()
+
 class AIService:
     BASE_URL = "https://api.deepseek.com/v1/chat/completions"
     
@@ -18,25 +39,92 @@ class AIService:
             "Authorization": f"Bearer {config.DEEPSEEK_API_KEY}",
             "Content-Type": "application/json"
         }
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.scheduler = FairQueue(config.AI_MAX_CONCURRENCY, config.AI_GLOBAL_RATE_PER_SECOND, config.AI_GLOBAL_BURST)
+        self.in_flight = 0
+        self.food_batcher = AIBatcher(self, config.AI_BATCH_WINDOW, config.AI_BATCH_MAX_SIZE)
+        self._purge_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Create the shared HTTP session and start purging expired cache entries. Called once on bot startup."""
+        if self._purge_task is None or self._purge_task.done():
+            self._purge_task = asyncio.create_task(self._purge_cache())
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=config.AI_MAX_CONNECTIONS,
+            keepalive_timeout=config.AI_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=300
+        )
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=config.AI_CONNECT_TIMEOUT,
+            sock_read=config.AI_READ_TIMEOUT
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            headers=self.headers
+        )
+        logger.info("AI HTTP session started")
+
+    async def close(self):
+        """Close the shared HTTP session. Called once on bot shutdown."""
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            await asyncio.gather(self._purge_task, return_exceptions=True)
+            self._purge_task = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("AI HTTP session closed")
+        self._session = None
+        ai_cache.close()
+
+    async def _purge_cache(self):
+        while True:
+            try:
+                deleted = await asyncio.to_thread(ai_cache.purge_expired)
+                if deleted:
+                    logger.info(f"Purged {deleted} expired AI cache entries")
+            except sqlite3.Error as e:
+                logger.error(f"AI cache purge failed: {str(e)}")
+            await asyncio.sleep(config.AI_CACHE_PURGE_HOURS * 3600)
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
     
-    async def _make_request(self, messages):
+    @timed(AI_REQUEST_SECONDS.labels(), AI_REQUEST_ERRORS.labels(), (AIServiceError,))
+    async def _make_request(self, messages, max_tokens: int = 150):
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.BASE_URL,
-                    headers=self.headers,
-                    json={
-                        "model": "deepseek-chat",
-                        "messages": messages,
-                        "temperature": 0.7,
-                        "max_tokens": 150
-                    }
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"AI API error: {response.status} - {error_text}")
-                        raise AIServiceError(f"API returned status {response.status}")
-                    return await response.json()
+            session = await self._get_session()
+            # Cap concurrent completions so bursts queue here instead of
+            # piling up against the API rate limit; the queue is fair per
+            # user so one user's burst cannot starve the others
+            async with self.scheduler.slot(current_user_id.get()):
+                self.in_flight += 1
+                try:
+                    async with session.post(
+                        self.BASE_URL,
+                        json={
+                            "model": "deepseek-chat",
+                            "messages": messages,
+                            "temperature": 0.7,
+                            "max_tokens": max_tokens
+                        }
+                    ) as response:
+                        if response.status != 200:
+                            error_text = await response.text()
+                            logger.error(f"AI API error: {response.status} - {error_text[:200]}")
+                            raise AIServiceError(f"API returned status {response.status}")
+                        return await response.json()
+                finally:
+                    self.in_flight -= 1
+        except AIServiceError:
+            raise
+        except asyncio.TimeoutError:
+            logger.error("Timeout in AI request")
+            raise AIServiceError("Request timed out")
         except aiohttp.ClientError as e:
             logger.error(f"Network error in AI request: {str(e)}")
             raise AIServiceError(f"Network error: {str(e)}")
@@ -72,66 +160,36 @@ class AIService:
             
             raise json.JSONDecodeError("Could not extract valid JSON", text, 0)
 
-    def _extract_duration_from_text(self, text: str) -> Optional[float]:
-        """Extract duration in minutes from text description."""
-        patterns = [
-            r'(\d+(?:\.\d+)?)\s*(?:минут|мин|min)',
-            r'(\d+(?:\.\d+)?)\s*(?:час|часа|часов|ч|h)',
-            r'(\d+(?:\.\d+)?)\s*(?:сек|секунд|с|s)',
-        ]
-        
-        minutes = 0
-        for pattern in patterns:
-            matches = re.finditer(pattern, text.lower())
-            for match in matches:
-                value = float(match.group(1))
-                if 'час' in match.group() or 'h' in match.group():
-                    minutes += value * 60
-                elif 'мин' in match.group() or 'min' in match.group():
-                    minutes += value
-                elif 'сек' in match.group() or 's' in match.group():
-                    minutes += value / 60
-        
-        return minutes if minutes > 0 else None
-    
-    async def parse_workout_description(self, description: str) -> Tuple[str, float, str]:
-        """Parse workout type and duration from natural language description."""
-        try:
-            messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a fitness expert. Parse workout descriptions and return ONLY a JSON object with this exact format:\n"
-                        '{"workout_type": "string", "minutes": number, "explanation": "string"}\n'
-                        "If duration is not specified, estimate it based on context. Be conservative in estimates."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": f"Parse this workout description: {description}"
-                }
-            ]
-            
-            response = await self._make_request(messages)
-            content = response["choices"][0]["message"]["content"]
-            result = self._extract_json_from_text(content)
+    async def estimate_food_calories(self, food_description: str) -> tuple[float, str]:
+        local = get_food_database().estimate(food_description)
+        if local is not None and local.confidence >= config.FOOD_DB_MIN_CONFIDENCE:
+            logger.debug(f"Estimated calories locally for: {food_description} ({local.item.name}, confidence {local.confidence:.2f})")
+            return local.calories, local.explanation
 
-            text_duration = self._extract_duration_from_text(description)
-            
-            workout_type = str(result["workout_type"])
-            minutes = float(result.get("minutes", text_duration or 30))
-            explanation = str(result.get("explanation", "Оценка на основе описания"))
-            
-            logger.info(f"Successfully parsed workout: {workout_type} for {minutes} minutes")
-            return workout_type, minutes, explanation
-            
-        except (AIServiceError, json.JSONDecodeError, KeyError, IndexError, ValueError) as e:
-            logger.error(f"Failed to parse workout description: {str(e)}")
+        cache_key = normalize_key(food_description)
+        cached = await ai_cache.get("food", cache_key)
+        if cached is not None:
+            return cached["calories"], cached["explanation"]
 
-            minutes = self._extract_duration_from_text(description) or 30
-            return description, minutes, "Примерная оценка длительности"
-    
-    async def estimate_food_calories(self, food_description: str) -> tuple[float, str]:
+        if config.AI_BATCH_ENABLED:
+            return await self.food_batcher.estimate(cache_key, food_description)
+        return await self._estimate_food_with_ai(cache_key, food_description)
+
+    async def estimate_meal(self, description: str) -> list[tuple[str, float, str]]:
+        """Estimate each item of a meal concurrently.
+
+        Returns (item, calories, explanation) per item. Every item goes
+        through estimate_food_calories, so the local database and the
+        cache apply per item and AI misses share one batch; the meal takes
+        as long as its slowest item.
+        """
+        items = split_meal(description)
+        if len(items) <= 1 or len(items) > config.MEAL_MAX_ITEMS:
+            items = [description]
+        estimates = await asyncio.gather(*(self.estimate_food_calories(item) for item in items))
+        return [(item, calories, explanation) for item, (calories, explanation) in zip(items, estimates)]
+
+    async def _estimate_food_with_ai(self, cache_key: str, food_description: str) -> tuple[float, str]:
         try:
             messages = [
                 {
@@ -153,10 +211,13 @@ class AIService:
             try:
                 content = response["choices"][0]["message"]["content"]
                 result = self._extract_json_from_text(content)
-                logger.info(f"Successfully estimated calories for: {food_description}")
-                return float(result["calories"]), str(result["explanation"])
+                logger.debug(f"Successfully estimated calories for: {food_description}")
+                calories, explanation = float(result["calories"]), str(result["explanation"])
+                await ai_cache.set("food", cache_key, {"calories": calories, "explanation": explanation})
+                return calories, explanation
             except (json.JSONDecodeError, KeyError, IndexError, ValueError) as e:
-                logger.error(f"Failed to parse AI response for food '{food_description}': {str(e)}\nResponse: {content}")
+                logger.error(f"Failed to parse AI response for food '{food_description}': {str(e)} (response: {content[:200]!r})")
+                _retries.inc()
                 messages.append({"role": "assistant", "content": "I'll help estimate calories, but please remind me to respond with valid JSON only."})
                 messages.append({"role": "user", "content": f"Please provide calorie estimate for '{food_description}' in EXACT JSON format: {{\"calories\": number, \"explanation\": \"string\"}}"})
                 
@@ -164,64 +225,247 @@ class AIService:
                     response = await self._make_request(messages)
                     content = response["choices"][0]["message"]["content"]
                     result = self._extract_json_from_text(content)
-                    return float(result["calories"]), str(result["explanation"])
+                    calories, explanation = float(result["calories"]), str(result["explanation"])
+                    await ai_cache.set("food", cache_key, {"calories": calories, "explanation": explanation})
+                    return calories, explanation
                 except:
                     logger.error(f"Second attempt also failed for food '{food_description}'")
                     return 250, f"Примерная оценка для '{food_description}' (ошибка AI)"
         except AIServiceError as e:
             logger.error(f"AI service error for food '{food_description}': {str(e)}")
-            return 250, f"Примерная оценка для '{food_description}' (ошибка сервиса)"
+            return self._service_error_estimate(food_description)
+
+    @staticmethod
+    def _service_error_estimate(food_description: str) -> tuple[float, str]:
+        return 250, f"Примерная оценка для '{food_description}' (ошибка сервиса)"
     
-    async def estimate_workout_calories(self, workout_type: str, minutes: float, weight: float) -> tuple[float, str]:
+    async def _estimate_food_batch_with_ai(self, food_descriptions: list[str]) -> Optional[list[tuple[float, str]]]:
+        """Estimate several foods in one completion.
+
+        Returns results in input order, or None if the answer is not a JSON
+        array with one valid object per item. Raises AIServiceError if the
+        request itself failed.
+        """
+        items = "\n".join(f"{i}. {description}" for i, description in enumerate(food_descriptions, 1))
+        messages = [
+            {
+                "role": "system",
+                "content": (
+                    "You are a nutrition expert. Estimate calories for each numbered food item and return ONLY a JSON array "
+                    "with one object per item, in the same order, in this exact format:\n"
+                    '[{"calories": number, "explanation": "string"}]\n'
+                    "The calories should be per serving/piece for common items, or per 100g for ingredients.\n"
+                    "Be conservative in estimates. Include serving size in explanation."
+                )
+            },
+            {
+                "role": "user",
+                "content": f"Estimate calories for these foods:\n{items}"
+            }
+        ]
+        response = await self._make_request(messages, max_tokens=150 * len(food_descriptions))
+        try:
+            content = response["choices"][0]["message"]["content"]
+            start, end = content.find("["), content.rfind("]") + 1
+            if start < 0 or end <= start:
+                raise ValueError("No JSON array in response")
+            result = json.loads(content[start:end])
+            if not isinstance(result, list) or len(result) != len(food_descriptions):
+                raise ValueError(f"Expected {len(food_descriptions)} items, got {len(result) if isinstance(result, list) else 'non-list'}")
+            estimates = [(float(item["calories"]), str(item["explanation"])) for item in result]
+        except (json.JSONDecodeError, KeyError, IndexError, TypeError, ValueError) as e:
+            logger.error(f"Failed to parse the answer for a food batch of {len(food_descriptions)}: {str(e)}")
+            return None
+        logger.debug(f"Successfully estimated calories for a batch of {len(food_descriptions)} foods")
+        return estimates
+
+    def _estimate_workout_locally(self, workout_type: str, minutes: float, weight: float,
+                                  height: Optional[float], age: Optional[int]) -> tuple[float, str]:
+        """MET-table estimate used when the AI is unavailable or unparseable."""
+        estimate = get_workout_engine().estimate(workout_type, minutes, weight, height, age)
+        if estimate is not None and estimate.confidence >= 0.3:
+            return estimate.calories, estimate.explanation
+        calories_per_minute = get_workout_engine().calories_per_minute(4.0, weight, height, age)
+        return (calories_per_minute * minutes,
+                "Оценка на основе MET (metabolic equivalent of task) для 'средней активности'")
+
+    async def analyze_workout(
+        self,
+        description: str,
+        weight: float,
+        height: Optional[float] = None,
+        age: Optional[int] = None
+    ) -> WorkoutAnalysis:
+        """Parse a workout and estimate its calories with at most one AI completion.
+
+        Descriptions the local parser reads with enough confidence (a known
+        activity and a duration) are handled without the AI. Otherwise a
+        single request returns type, duration and calories per minute
+        together; any missing part falls back to the parsed duration and
+        the MET table.
+        """
+        parsed = parse_workout(description)
+        text_duration = parsed.minutes
+        if parsed.activity is not None and parsed.confidence >= config.WORKOUT_PARSER_MIN_CONFIDENCE:
+            # The raw text: the parser's rest is index-normalised, which breaks phrases like "не спеша"
+            intensity, intensity_label = detect_intensity(description)
+            estimate = get_workout_engine().estimate_activity(
+                parsed.activity, text_duration, weight, height, age, intensity, intensity_label
+            )
+            logger.debug(f"Analyzed workout locally: {estimate.activity.name} for {text_duration} minutes")
+            return WorkoutAnalysis(
+                estimate.activity.name, text_duration, estimate.calories,
+                estimate.explanation, parsed.explanation
+            )
+
+        cache_key = f"{normalize_key(description)}|{weight_bucket(weight)}"
+        cached = await ai_cache.get("workout", cache_key)
+        if cached is None:
+            cached = await self._request_workout_analysis(description, weight)
+            if cached is not None and "calories_per_minute" in cached and "minutes" in cached:
+                await ai_cache.set("workout", cache_key, cached)
+
+        if cached is None:
+            minutes = text_duration or 30
+            calories, explanation = self._estimate_workout_locally(description, minutes, weight, height, age)
+            return WorkoutAnalysis(description, minutes, calories, explanation, "Примерная оценка длительности")
+
+        workout_type = cached["workout_type"]
+        minutes = cached.get("minutes") or text_duration or 30
+        parse_explanation = cached["explanation"] if "minutes" in cached else "Примерная оценка длительности"
+        if "calories_per_minute" in cached:
+            calories, explanation = cached["calories_per_minute"] * minutes, cached["explanation"]
+        else:
+            calories, explanation = self._estimate_workout_locally(workout_type, minutes, weight, height, age)
+        return WorkoutAnalysis(workout_type, minutes, calories, explanation, parse_explanation)
+
+    async def _request_workout_analysis(self, description: str, weight: float) -> Optional[dict]:
+        """Ask for type, minutes and calories per minute in one completion.
+
+        Returns whatever fields could be parsed (at least workout_type),
+        or None when the request or the response failed entirely.
+        """
+        messages = [
+            {
+                "role": "system",
+                "content": (
+                    "You are a fitness expert. Parse the workout description and estimate calories burned. "
+                    "Return ONLY a JSON object with this exact format:\n"
+                    '{"workout_type": "string", "minutes": number, "calories_per_minute": number, "explanation": "string"}\n'
+                    "If duration is not specified, estimate it based on context. "
+                    "Consider the person's weight. Be conservative in estimates."
+                )
+            },
+            {
+                "role": "user",
+                "content": f"Workout: {description}\nPerson weight: {weight}kg"
+            }
+        ]
         try:
-            messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a fitness expert. Estimate calories burned during workouts and return ONLY a JSON object with this exact format:\n"
-                        '{"calories_per_minute": number, "explanation": "string"}\n'
-                        "Consider the person's weight and workout type. Be conservative in estimates."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": f"Estimate calories burned per minute for a {workout_type} workout for a person weighing {weight}kg"
-                }
-            ]
-            
             response = await self._make_request(messages)
+            content = response["choices"][0]["message"]["content"]
+            result = self._extract_json_from_text(content)
+            analysis = {
+                "workout_type": str(result["workout_type"]),
+                "explanation": str(result.get("explanation", "Оценка на основе описания"))
+            }
+        except (AIServiceError, json.JSONDecodeError, KeyError, IndexError, TypeError) as e:
+            logger.error(f"Failed to analyze workout '{description}': {str(e)}")
+            return None
+
+        for field in ("minutes", "calories_per_minute"):
             try:
-                content = response["choices"][0]["message"]["content"]
-                result = self._extract_json_from_text(content)
-                logger.info(f"Successfully estimated calories for workout: {workout_type}")
-                return float(result["calories_per_minute"]) * minutes, str(result["explanation"])
-            except (json.JSONDecodeError, KeyError, IndexError, ValueError) as e:
-                logger.error(f"Failed to parse AI response for workout '{workout_type}': {str(e)}\nResponse: {content}")
-                met_values = {
-                    "ходьба": 3.5,
-                    "бег": 8.0,
-                    "плавание": 6.0,
-                    "велосипед": 7.0,
-                    "йога": 2.5,
-                    "силовая": 5.0,
-                    "бегать": 8.0,
-                    "плавать": 6.0,
-                    "бегал": 8.0,
-                    "плавал": 6.0,
-                    "побегал": 8.0,
-                    "поплавал": 6.0
-                }
-                
-                # Find closest matching activity
-                import difflib
-                closest = difflib.get_close_matches(workout_type.lower(), met_values.keys(), n=1, cutoff=0.3)
-                met = met_values[closest[0]] if closest else 4.0
-                
-                calories_per_minute = (met * 3.5 * weight) / 200
-                return (calories_per_minute * minutes,
-                        f"Оценка на основе MET (metabolic equivalent of task) для '{closest[0] if closest else 'средней активности'}'")
-        except AIServiceError as e:
-            logger.error(f"AI service error for workout '{workout_type}': {str(e)}")
-            return minutes * 7, f"Стандартная оценка расхода калорий (ошибка сервиса)"
+                value = float(result[field])
+                if value > 0:
+                    analysis[field] = value
+            except (KeyError, TypeError, ValueError):
+                logger.warning(f"AI workout analysis for '{description}' is missing {field}")
+        logger.debug(f"Successfully analyzed workout: {analysis['workout_type']}")
+        return analysis
+
+class AIBatcher:
+    """Micro-batches food estimates from concurrent users into one completion.
+
+    Requests are collected for up to `window` seconds or until `max_size`
+    distinct foods are pending, then sent as a single prompt asking for a JSON
+    array. Identical foods in a batch share one slot. If the batch answer
+    cannot be parsed, every item is retried as an individual request; if the
+    request itself fails, every item gets the service-error estimate, as
+    retrying would only multiply the load on a failing API.
+    """
+
+    def __init__(self, service: "AIService", window: float, max_size: int):
+        self.service = service
+        self.window = window
+        self.max_size = max_size
+        self._pending: dict[str, tuple[str, list[asyncio.Future]]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def estimate(self, cache_key: str, food_description: str) -> tuple[float, str]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if cache_key in self._pending:
+            self._pending[cache_key][1].append(future)
+        else:
+            self._pending[cache_key] = (food_description, [future])
+
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        # A batch serves several users: run it outside the context of the one
+        # whose request happened to flush it, so the fair queue does not bill them
+        task = asyncio.create_task(self._run_batch(batch), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    def _resolve(futures: list[asyncio.Future], result: tuple[float, str]):
+        for future in futures:
+            if not future.done():
+                future.set_result(result)
+
+    async def _run_batch(self, batch: dict[str, tuple[str, list[asyncio.Future]]]):
+        keys = list(batch)
+        try:
+            if len(keys) == 1:
+                key = keys[0]
+                description, futures = batch[key]
+                self._resolve(futures, await self.service._estimate_food_with_ai(key, description))
+                return
+
+            try:
+                estimates = await self.service._estimate_food_batch_with_ai([batch[key][0] for key in keys])
+            except AIServiceError as e:
+                logger.error(f"AI service error for a food batch of {len(keys)}: {str(e)}")
+                for key in keys:
+                    self._resolve(batch[key][1], self.service._service_error_estimate(batch[key][0]))
+                return
+            if estimates is None:
+                results = await asyncio.gather(*(
+                    self.service._estimate_food_with_ai(key, batch[key][0]) for key in keys
+                ))
+            else:
+                results = estimates
+                for key, (calories, explanation) in zip(keys, estimates):
+                    await ai_cache.set("food", key, {"calories": calories, "explanation": explanation})
+            for key, result in zip(keys, results):
+                self._resolve(batch[key][1], result)
+        except Exception as e:
+            logger.error(f"Food batch failed: {str(e)}")
+            for _, futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(AIServiceError(f"Batch error: {str(e)}"))
 
 ai_service = AIService() 
\ No newline at end of file
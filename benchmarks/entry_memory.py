@@ -0,0 +1,91 @@
+"""Resident memory of logged food/workout entries per user.
+
+Compares the compact FoodLog/WorkoutLog columns with the previous
+representation (Python lists of pydantic entry models). Every simulated
+user logs a few meals and a workout drawn from a small vocabulary, as real
+users do; strings are rebuilt per entry, like text parsed from messages.
+
+    python benchmarks/entry_memory.py [--users 10000 100000 1000000] [--skip-legacy]
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from entry_log import FoodLog, WorkoutLog
+from models import FoodEntry, WorkoutEntry
+
+FOODS = [f"блюдо {i}" for i in range(300)]
+WORKOUTS = [f"тренировка {i}" for i in range(60)]
+EXPLANATIONS = [f"Оценка по базе продуктов, вариант {i}: {'подробности ' * 4}" for i in range(500)]
+
+def fresh(text: str) -> str:
+    # A new string object with the same contents, as a parsed message would produce
+    return (text + " ")[:-1]
+
+def entries_for(rng: random.Random, now: datetime):
+    foods = [
+        (fresh(rng.choice(FOODS)), rng.uniform(50, 800), now - timedelta(minutes=rng.randint(0, 900)),
+         fresh(rng.choice(EXPLANATIONS)))
+        for _ in range(rng.randint(1, 5))
+    ]
+    workouts = [
+        (fresh(rng.choice(WORKOUTS)), rng.randint(10, 90), rng.uniform(50, 700),
+         now - timedelta(minutes=rng.randint(0, 900)), fresh(rng.choice(EXPLANATIONS)))
+        for _ in range(rng.randint(0, 2))
+    ]
+    return foods, workouts
+
+def build_legacy(foods, workouts):
+    return (
+        [FoodEntry(food_name=n, calories=c, timestamp=t, explanation=e) for n, c, t, e in foods],
+        [WorkoutEntry(workout_type=n, minutes=m, calories=c, timestamp=t, explanation=e) for n, m, c, t, e in workouts],
+    )
+
+def build_compact(foods, workouts):
+    food_log, workout_log = FoodLog(), WorkoutLog()
+    for n, c, t, e in foods:
+        food_log.add(food_name=n, calories=c, timestamp=t, explanation=e)
+    for n, m, c, t, e in workouts:
+        workout_log.add(workout_type=n, minutes=m, calories=c, timestamp=t, explanation=e)
+    return food_log, workout_log
+
+def measure(builder, users: int) -> tuple[float, float]:
+    rng = random.Random(42)
+    now = datetime.now()
+    gc.collect()
+    tracemalloc.start()
+    held = []
+    entries = 0
+    for _ in range(users):
+        foods, workouts = entries_for(rng, now)
+        entries += len(foods) + len(workouts)
+        held.append(builder(foods, workouts))
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return current / users, entries / users
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--skip-legacy", action="store_true", help="only measure the compact representation")
+    args = parser.parse_args()
+
+    print(f"{'users':>10} {'entries/user':>13} {'legacy B/user':>14} {'compact B/user':>15} {'ratio':>6}")
+    for users in args.users:
+        compact, per_user = measure(build_compact, users)
+        if args.skip_legacy:
+            print(f"{users:>10} {per_user:>13.2f} {'-':>14} {compact:>15.0f} {'-':>6}")
+            continue
+        legacy, _ = measure(build_legacy, users)
+        print(f"{users:>10} {per_user:>13.2f} {legacy:>14.0f} {compact:>15.0f} {legacy / compact:>5.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Load test for the scheduling layer: spammers against ordinary users.
+
+A few spammers flood /log_food with distinct meals (every one a cache miss)
+while ordinary users send /status, /log_water and the occasional /log_food
+at a human pace. Updates go through the webhook-mode UpdateQueue, so the
+fast lane, the per-user rate limit and the fair AI queue are all on the
+path. Latency is measured from enqueue to handler completion.
+
+    python benchmarks/fairness.py                    # scheduling as configured
+    python benchmarks/fairness.py --mode baseline    # no limits, FIFO AI queue, single lane
+
+Compare the ordinary users' /status and /log_food percentiles between the
+two runs.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["scheduled", "baseline"], default="scheduled")
+    parser.add_argument("--users", type=int, default=50, help="ordinary users")
+    parser.add_argument("--spammers", type=int, default=3)
+    parser.add_argument("--spam-interval", type=float, default=0.02, help="seconds between a spammer's messages")
+    parser.add_argument("--user-interval", type=float, default=1.0, help="mean seconds between an ordinary user's messages")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--ai-latency", type=float, default=0.3)
+    parser.add_argument("--ai-concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    # Read by load.Simulation, which Run reuses for update construction and onboarding
+    parser.set_defaults(mix={}, think_time=0.0)
+    parser.add_argument("--output", default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "results", f"fairness-{datetime.now():%Y%m%d-%H%M%S}.json"))
+    return parser.parse_args()
+
+ARGS = parse_args()
+# Config is read at import time, so the mode has to be applied before
+# anything from the bot (pulled in by load.py) is imported
+os.environ["AI_MAX_CONCURRENCY"] = str(ARGS.ai_concurrency)
+os.environ["AI_BATCH_ENABLED"] = "0"
+os.environ["METRICS_ENABLED"] = "0"
+if ARGS.mode == "baseline":
+    os.environ["RATE_LIMIT_ENABLED"] = "0"
+    os.environ["WEBHOOK_FAST_WORKERS"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load import FakeDeepSeek, FakeOpenWeather, CapturingSession, Simulation, percentiles
+
+from aiogram import Bot
+
+import bot as bot_module
+from ai_service import AIService, ai_service
+from config import config
+from scheduler import FairQueue, command_of
+from update_queue import UpdateQueue
+from weather_service import WeatherService
+
+class FifoQueue(FairQueue):
+    """Baseline: every request in one flow, i.e. plain first come, first served."""
+
+    async def acquire(self, key, cost: float = 1.0):
+        await super().acquire(None, cost)
+
+class Run(Simulation):
+    def __init__(self, args, dp, bot):
+        super().__init__(args, dp, bot)
+        self.enqueued: dict[int, tuple[str, str, float]] = {}
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.rejected: Counter = Counter()
+        self.queue = UpdateQueue(dp, bot, config.WEBHOOK_WORKERS, config.WEBHOOK_QUEUE_SIZE,
+                                 on_done=self.done, fast_workers=config.WEBHOOK_FAST_WORKERS)
+
+    async def done(self, update):
+        who, command, started = self.enqueued.pop(update.update_id)
+        self.latencies[f"{who} {command}"].append(time.perf_counter() - started)
+
+    def offer(self, who: str, user_id: int, text: str):
+        update = self.make_update(user_id, text)
+        self.enqueued[update.update_id] = (who, command_of(text), time.perf_counter())
+        if not self.queue.offer(update):
+            self.enqueued.pop(update.update_id)
+            self.rejected[who] += 1
+
+    async def onboard(self, user_id: int):
+        for text in ["/set_profile", "70", "175", "30", "30", "Moscow"]:
+            await self.send("onboarding", user_id, text)
+
+    async def spammer(self, user_id: int, deadline: float):
+        n = 0
+        while time.perf_counter() < deadline:
+            n += 1
+            self.offer("spammer", user_id, f"/log_food блюдо номер {user_id}-{n}")
+            await asyncio.sleep(self.args.spam_interval)
+
+    async def ordinary(self, user_id: int, deadline: float):
+        n = 0
+        while True:
+            await asyncio.sleep(self.rng.expovariate(1 / self.args.user_interval))
+            if time.perf_counter() >= deadline:
+                return
+            n += 1
+            text = self.rng.choices(
+                ["/status", "/log_water 250", f"/log_food обед {user_id}-{n}"], weights=[45, 35, 20])[0]
+            self.offer("user", user_id, text)
+
+async def main(args):
+    deepseek = FakeDeepSeek(args.ai_latency, 0.0, random.Random(args.seed + 1))
+    weather = FakeOpenWeather(0.02, 0.0, random.Random(args.seed + 2))
+    await deepseek.start()
+    await weather.start()
+    AIService.BASE_URL = f"http://127.0.0.1:{deepseek.port}/v1/chat/completions"
+    WeatherService.BASE_URL = f"http://127.0.0.1:{weather.port}/data/2.5/weather"
+    WeatherService.GROUP_URL = f"http://127.0.0.1:{weather.port}/data/2.5/group"
+    if args.mode == "baseline":
+        ai_service.scheduler = FifoQueue(config.AI_MAX_CONCURRENCY)
+
+    session = CapturingSession()
+    replies = Counter()
+    make_request = session.make_request
+
+    async def capture(bot, method, timeout=None):
+        text = getattr(method, "text", "") or ""
+        if text.startswith("⏳"):
+            replies["rate_limited" if "Попробуйте снова" in text else "queued_notice"] += 1
+        return await make_request(bot, method, timeout)
+
+    session.make_request = capture
+    bot = Bot(token=config.BOT_TOKEN, session=session)
+    dp = bot_module.dp
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=(bot,), **dp.workflow_data)
+
+    run = Run(args, dp, bot)
+    ordinary_ids = [2_000_000 + i for i in range(args.users)]
+    spammer_ids = [3_000_000 + i for i in range(args.spammers)]
+    await asyncio.gather(*(run.onboard(user_id) for user_id in ordinary_ids + spammer_ids))
+
+    run.queue.start()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(
+        *(run.spammer(user_id, deadline) for user_id in spammer_ids),
+        *(run.ordinary(user_id, deadline) for user_id in ordinary_ids),
+    )
+    await run.queue.stop(drain_timeout=120)
+    elapsed = time.perf_counter() - started
+    await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=(bot,), **dp.workflow_data)
+    await deepseek.stop()
+    await weather.stop()
+
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "params": {k: v for k, v in vars(args).items() if k != "output"},
+        "elapsed_s": elapsed,
+        "latency": {kind: percentiles(samples) for kind, samples in sorted(run.latencies.items())},
+        "replies": dict(replies),
+        "rejected_by_queue": dict(run.rejected),
+        "unfinished": len(run.enqueued),
+        "deepseek_calls": deepseek.calls,
+        "ai_queue": vars(ai_service.scheduler.stats),
+    }
+
+    print(f"mode {args.mode}: {elapsed:.1f}s, {deepseek.calls} DeepSeek calls, replies {dict(replies)}, "
+          f"queue rejections {dict(run.rejected) or 0}, unfinished {len(run.enqueued)}")
+    print(f"{'sender command':<22} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for kind, stats in result["latency"].items():
+        print(f"{kind:<22} {stats['count']:>7} {stats['p50_ms']:>9.1f} {stats['p90_ms']:>9.1f} "
+              f"{stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"results written to {args.output}")
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(main(ARGS))
@@ -0,0 +1,81 @@
+"""Accuracy of the local food database on quantities and meal splitting.
+
+Runs every description in food_corpus.tsv through FoodDatabase.estimate
+and checks the recognised food and the amount: grams when the description
+gives a weight or volume, otherwise the number of servings. Then splits
+every meal in meal_corpus.tsv into items with split_meal. Prints the
+mistakes and exits with status 1 if there are any.
+
+    python benchmarks/food_database.py [--verbose]
+"""
+import argparse
+import csv
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from food_database import get_food_database, split_meal
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "food_corpus.tsv")
+MEAL_CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "meal_corpus.tsv")
+
+def load_corpus(path: str) -> list[tuple[str, str, float | None, float]]:
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for row in csv.reader((line for line in f if not line.startswith("#")), delimiter="\t"):
+            if row:
+                text, food, grams, servings = (row + ["", "", ""])[:4]
+                rows.append((text, food, float(grams) if grams else None, float(servings or 1)))
+    return rows
+
+def load_meals(path: str) -> list[tuple[str, list[str]]]:
+    with open(path, encoding="utf-8") as f:
+        rows = csv.reader((line for line in f if not line.startswith("#")), delimiter="\t")
+        return [(row[0], row[1].split(" | ")) for row in rows if row]
+
+def check_meals(meals, verbose: bool) -> int:
+    mistakes = 0
+    for text, expected in meals:
+        items = split_meal(text)
+        ok = items == expected
+        mistakes += not ok
+        if verbose or not ok:
+            mark = "  " if ok else "✗ "
+            print(f"{mark}{text!r}: {items}{'' if ok else f' (expected {expected})'}")
+    return mistakes
+
+def check_estimates(corpus, verbose: bool) -> int:
+    database = get_food_database()
+    mistakes = 0
+    for text, food, grams, servings in corpus:
+        estimate = database.estimate(text)
+        name = estimate.item.name if estimate else "-"
+        actual_grams = estimate.quantity.grams if estimate else None
+        actual_servings = estimate.quantity.servings if estimate else None
+        ok = name == food and actual_grams == grams and (grams is not None or actual_servings == servings)
+        mistakes += not ok
+        if verbose or not ok:
+            mark = "  " if ok else "✗ "
+            print(f"{mark}{text!r}: {name}, {actual_grams} g, {actual_servings} servings"
+                  f"{'' if ok else f' (expected {food}, {grams} g, {servings} servings)'}")
+    return mistakes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--meals", default=MEAL_CORPUS_PATH)
+    parser.add_argument("--verbose", action="store_true", help="print every row, not only the mistakes")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    mistakes = check_estimates(corpus, args.verbose)
+    print(f"\n{len(corpus)} descriptions, {mistakes} mistakes")
+    meals = load_meals(args.meals)
+    meal_mistakes = check_meals(meals, args.verbose)
+    print(f"\n{len(meals)} meals split, {meal_mistakes} mistakes")
+    sys.exit(1 if mistakes or meal_mistakes else 0)
+
+if __name__ == "__main__":
+    main()
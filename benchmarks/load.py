@@ -0,0 +1,393 @@
+"""End-to-end load benchmark for the bot.
+
+Builds the real Dispatcher from bot.py (handlers router, SQLite storage,
+startup/shutdown hooks) and feeds synthetic updates through dp.feed_update.
+Outgoing messages go to an in-memory Bot session; DeepSeek and
+OpenWeatherMap are replaced by local HTTP servers with configurable latency
+and error injection. Each simulated user onboards (/start, /set_profile
+wizard) and then sends a random mix of /log_food, /log_water, /log_workout
+and /status, one update at a time like a real chat.
+
+Reports throughput, per-command latency percentiles, event-loop lag and
+memory, and writes everything to a JSON file; pass --compare with an
+earlier result to see regressions.
+
+    python benchmarks/load.py --users 200 --updates-per-user 20 --ai-latency 0.3
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Config reads the environment at import time, so point it at throwaway
+# databases and dummy keys before importing anything from the bot
+WORKDIR = tempfile.mkdtemp(prefix="fitness-bot-bench-")
+os.environ.setdefault("TELEGRAM_API_KEY", "123456:benchmark-token")
+os.environ.setdefault("OPENWEATHERMAP_API_KEY", "benchmark")
+os.environ.setdefault("DEEPSEEK_API_KEY", "benchmark")
+os.environ["DB_PATH"] = os.path.join(WORKDIR, "bot.sqlite3")
+os.environ["AI_CACHE_PATH"] = os.path.join(WORKDIR, "ai_cache.sqlite3")
+os.environ["WEATHER_PREFETCH_ENABLED"] = "0"
+os.environ.setdefault("METRICS_PORT", "0")
+os.chdir(WORKDIR)
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message, Update, User
+from aiohttp import web
+
+import bot as bot_module
+from ai_service import AIService
+from config import config
+from weather_service import WeatherService
+
+FOODS = [
+    "яблоко", "2 банана", "овсянка", "гречка с курицей", "борщ", "200г творога", "кофе с молоком",
+    "шаурма", "пицца пепперони 2 куска", "салат цезарь", "бутерброд с сыром", "бабушкины сырники со сметаной",
+    "протеиновый батончик", "смузи из манго", "рис", "3 яйца", "стакан кефира", "чизкейк",
+]
+WORKOUTS = [
+    "бег 30 минут", "бегал 45 минут", "плавание час", "велосипед 40 минут", "йога 30 минут",
+    "силовая тренировка 50 минут", "ходьба 60 минут", "побегал от собак минут 10",
+    "танцевал на свадьбе полтора часа", "играл в футбол с друзьями", "кроссфит 20 минут",
+]
+CITIES = ["Moscow", "London", "Paris", "Berlin", "Kazan", "Sochi", "Tokyo", "Madrid"]
+DEFAULT_MIX = {"log_food": 35, "log_water": 25, "log_workout": 20, "status": 20}
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "mean_ms": 1000 * sum(ordered) / len(ordered),
+        "p50_ms": 1000 * pick(0.50),
+        "p90_ms": 1000 * pick(0.90),
+        "p99_ms": 1000 * pick(0.99),
+        "max_ms": 1000 * ordered[-1],
+    }
+
+class FaultyServer:
+    """Base for the stand-in HTTP servers: fixed latency plus random 500s."""
+
+    def __init__(self, latency: float, error_rate: float, rng: random.Random):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = rng
+        self.calls = 0
+        self.errors = 0
+        self.runner = None
+        self.port = None
+
+    async def _delay_or_fail(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"error": "injected failure"}, status=500)
+        return None
+
+    def routes(self, app):
+        raise NotImplementedError
+
+    async def start(self):
+        app = web.Application()
+        self.routes(app)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+class FakeDeepSeek(FaultyServer):
+    def routes(self, app):
+        app.router.add_post("/v1/chat/completions", self.complete)
+
+    async def complete(self, request):
+        body = await request.json()
+        failure = await self._delay_or_fail()
+        if failure is not None:
+            return failure
+        prompt = body["messages"][-1]["content"]
+        if prompt.startswith("Estimate calories for these foods:"):
+            items = prompt.splitlines()[1:]
+            content = json.dumps([
+                {"calories": self.rng.randint(80, 600), "explanation": "порция ~250г"} for _ in items
+            ])
+        else:
+            content = json.dumps({
+                "calories": self.rng.randint(80, 600),
+                "workout_type": "тренировка",
+                "minutes": self.rng.randint(10, 90),
+                "calories_per_minute": round(self.rng.uniform(4, 12), 1),
+                "explanation": "оценка по описанию",
+            })
+        return web.json_response({"choices": [{"message": {"content": content}}]})
+
+class FakeOpenWeather(FaultyServer):
+    def routes(self, app):
+        app.router.add_get("/data/2.5/weather", self.weather)
+        app.router.add_get("/data/2.5/group", self.group)
+
+    def _city(self, city_id: int, name: str) -> dict:
+        return {
+            "id": city_id, "name": name, "timezone": 10800, "coord": {"lat": 55.75, "lon": 37.62},
+            "main": {"temp": self.rng.uniform(-5, 32), "humidity": 50},
+            "weather": [{"id": 800, "description": "ясно"}],
+        }
+
+    async def weather(self, request):
+        failure = await self._delay_or_fail()
+        if failure is not None:
+            return failure
+        query = request.query
+        name = query.get("q") or query.get("id") or f"{query.get('lat')},{query.get('lon')}"
+        return web.json_response(self._city(zlib.crc32(name.encode()) % 10**6, name))
+
+    async def group(self, request):
+        failure = await self._delay_or_fail()
+        if failure is not None:
+            return failure
+        ids = request.query["id"].split(",")
+        return web.json_response({"cnt": len(ids), "list": [self._city(int(i), i) for i in ids]})
+
+class CapturingSession(BaseSession):
+    """Bot session that records outgoing messages instead of calling Telegram."""
+
+    def __init__(self):
+        super().__init__()
+        self.sent = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage):
+            self.sent += 1
+            return Message(
+                message_id=self.sent, date=datetime.now(),
+                chat=Chat(id=method.chat_id, type="private"), text=method.text,
+            )
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+class LoopLagMonitor:
+    """Measure how late a periodic timer fires: a proxy for event-loop blocking."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: list[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+class Simulation:
+    def __init__(self, args, dp, bot):
+        self.args = args
+        self.dp = dp
+        self.bot = bot
+        self.rng = random.Random(args.seed)
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.update_id = 0
+        self.mix = list(args.mix.items())
+
+    def make_update(self, user_id: int, text: str) -> Update:
+        self.update_id += 1
+        return Update(update_id=self.update_id, message=Message(
+            message_id=self.update_id, date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name="bench"),
+            text=text,
+        ))
+
+    async def send(self, kind: str, user_id: int, text: str):
+        update = self.make_update(user_id, text)
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            self.errors[kind] += 1
+        self.latencies[kind].append(time.perf_counter() - started)
+
+    def command(self) -> tuple[str, str]:
+        kind = self.rng.choices([k for k, _ in self.mix], weights=[w for _, w in self.mix])[0]
+        if kind == "log_food":
+            return kind, f"/log_food {self.rng.choice(FOODS)}"
+        if kind == "log_water":
+            return kind, f"/log_water {self.rng.choice([150, 200, 250, 330, 500])}"
+        if kind == "log_workout":
+            return kind, f"/log_workout {self.rng.choice(WORKOUTS)}"
+        return kind, "/status"
+
+    async def user_session(self, user_id: int):
+        if self.args.think_time:
+            await asyncio.sleep(self.rng.uniform(0, self.args.think_time))
+        onboarding = [
+            "/start", "/set_profile", str(self.rng.randint(50, 110)), str(self.rng.randint(150, 200)),
+            str(self.rng.randint(18, 70)), str(self.rng.choice([0, 20, 30, 60, 90])), self.rng.choice(CITIES),
+        ]
+        for text in onboarding:
+            await self.send("onboarding", user_id, text)
+        for _ in range(self.args.updates_per_user):
+            if self.args.think_time:
+                await asyncio.sleep(self.rng.uniform(0, self.args.think_time))
+            kind, text = self.command()
+            await self.send(kind, user_id, text)
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def limited(user_id: int):
+            async with semaphore:
+                await self.user_session(user_id)
+
+        await asyncio.gather(*(limited(1_000_000 + i) for i in range(self.args.users)))
+
+def compare(current: dict, previous_path: str):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nCompared with {previous_path}:")
+    rows = [("throughput_ups", current["throughput_ups"], previous.get("throughput_ups"))]
+    for kind, stats in current["latency"].items():
+        rows.append((f"{kind} p99_ms", stats.get("p99_ms"), previous.get("latency", {}).get(kind, {}).get("p99_ms")))
+    rows.append(("loop_lag p99_ms", current["loop_lag"].get("p99_ms"), previous.get("loop_lag", {}).get("p99_ms")))
+    rows.append(("rss_peak_mb", current["memory"]["rss_peak_mb"], previous.get("memory", {}).get("rss_peak_mb")))
+    for name, now, before in rows:
+        if now is None or not before:
+            continue
+        print(f"  {name:<24} {before:>10.1f} -> {now:>10.1f} ({(now - before) / before * 100:+.1f}%)")
+
+async def main(args):
+    deepseek = FakeDeepSeek(args.ai_latency, args.ai_error_rate, random.Random(args.seed + 1))
+    weather = FakeOpenWeather(args.weather_latency, args.weather_error_rate, random.Random(args.seed + 2))
+    await deepseek.start()
+    await weather.start()
+    AIService.BASE_URL = f"http://127.0.0.1:{deepseek.port}/v1/chat/completions"
+    WeatherService.BASE_URL = f"http://127.0.0.1:{weather.port}/data/2.5/weather"
+    WeatherService.GROUP_URL = f"http://127.0.0.1:{weather.port}/data/2.5/group"
+
+    session = CapturingSession()
+    bot = Bot(token=config.BOT_TOKEN, session=session)
+    dp = bot_module.dp
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=(bot,), **dp.workflow_data)
+
+    simulation = Simulation(args, dp, bot)
+    monitor = LoopLagMonitor()
+    rss_start = rss_bytes()
+    monitor.start()
+    started = time.perf_counter()
+    await simulation.run()
+    elapsed = time.perf_counter() - started
+    await monitor.stop()
+    rss_end = rss_bytes()
+    await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=(bot,), **dp.workflow_data)
+    await deepseek.stop()
+    await weather.stop()
+
+    total = sum(len(samples) for samples in simulation.latencies.values())
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "elapsed_s": elapsed,
+        "updates": total,
+        "throughput_ups": total / elapsed,
+        "messages_sent": session.sent,
+        "errors": dict(simulation.errors),
+        "latency": {
+            "all": percentiles([s for samples in simulation.latencies.values() for s in samples]),
+            **{kind: percentiles(samples) for kind, samples in sorted(simulation.latencies.items())},
+        },
+        "loop_lag": percentiles(monitor.samples),
+        "memory": {
+            "rss_start_mb": rss_start / 2**20,
+            "rss_end_mb": rss_end / 2**20,
+            "rss_peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        },
+        "upstream": {
+            "deepseek_calls": deepseek.calls, "deepseek_errors": deepseek.errors,
+            "weather_calls": weather.calls, "weather_errors": weather.errors,
+        },
+    }
+
+    print(f"{total} updates in {elapsed:.2f}s: {result['throughput_ups']:.1f} updates/s, "
+          f"{session.sent} messages sent, errors {dict(simulation.errors) or 0}")
+    print(f"{'command':<12} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for kind, stats in result["latency"].items():
+        print(f"{kind:<12} {stats['count']:>7} {stats['p50_ms']:>9.1f} {stats['p90_ms']:>9.1f} "
+              f"{stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}")
+    lag = result["loop_lag"]
+    print(f"loop lag: p50 {lag['p50_ms']:.2f}ms, p99 {lag['p99_ms']:.2f}ms, max {lag['max_ms']:.2f}ms")
+    print(f"rss: {result['memory']['rss_start_mb']:.1f} -> {result['memory']['rss_end_mb']:.1f} MB "
+          f"(peak {result['memory']['rss_peak_mb']:.1f} MB)")
+    print(f"upstream: {result['upstream']}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"results written to {args.output}")
+    if args.compare:
+        compare(result, args.compare)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--updates-per-user", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=100, help="users active at the same time")
+    parser.add_argument("--think-time", type=float, default=0.0, help="max random pause between a user's updates, s")
+    parser.add_argument("--mix", type=json.loads, default=DEFAULT_MIX, help='command weights as JSON, e.g. \'{"status": 1}\'')
+    parser.add_argument("--ai-latency", type=float, default=0.2)
+    parser.add_argument("--ai-error-rate", type=float, default=0.0)
+    parser.add_argument("--weather-latency", type=float, default=0.05)
+    parser.add_argument("--weather-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", default=os.path.join(
+        ROOT, "benchmarks", "results", f"load-{datetime.now():%Y%m%d-%H%M%S}.json"))
+    parser.add_argument("--compare", help="earlier result JSON to compare against")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    asyncio.run(main(args))
@@ -0,0 +1,147 @@
+"""Cost of the reminder schedule at scale.
+
+Schedules --reminders entries on the timing wheel the reminder service
+uses, times scheduling, cancelling and a full simulated day of ticks, and
+measures the memory the schedule takes. The same work is repeated with a
+heap (with lazy deletion for cancels) for comparison. Finally a batch of
+due reminders is evaluated against synthetic profiles and logs, the way
+one tick of ReminderService.process does it.
+
+    python benchmarks/reminders.py [--reminders 1000000] [--tick 60] [--batch 20000]
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from models import UserProfile, DailyLog
+from reminders import Checkpoint, Subscription, TimingWheel, reminder_service
+
+DAY = 86400
+
+def measure(label: str, fn, count: int):
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28}{elapsed:8.2f} s  {elapsed / count * 1e6:6.2f} µs/op")
+    return result
+
+def memory(label: str, build, count: int):
+    """Memory held by what build() returns; measured apart from the timings, tracing slows everything down."""
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    print(f"{label:<28}{size / 2**20:8.1f} MiB  {size / count:6.0f} B/reminder")
+
+def bench_wheel(times: list[float], tick: float, origin: float) -> int:
+    def build():
+        wheel = TimingWheel(tick, int(DAY // tick), origin)
+        for key, when in enumerate(times):
+            wheel.schedule(key, when)
+        return wheel
+
+    wheel = measure("wheel schedule", build, len(times))
+    memory("wheel memory", build, len(times))
+
+    cancelled = range(0, len(times), 10)
+    measure("wheel cancel (10%)", lambda: [wheel.cancel(key) for key in cancelled], len(cancelled))
+    measure("wheel reschedule (10%)", lambda: [wheel.schedule(key, times[key]) for key in cancelled],
+            len(cancelled))
+
+    def run_day():
+        fired = 0
+        for n in range(1, int(DAY // tick) + 1):
+            fired += len(wheel.advance(origin + n * tick))
+        return fired
+
+    fired = measure("wheel day of ticks", run_day, len(times))
+    assert fired == len(times), fired
+    return fired
+
+def bench_heap(times: list[float], origin: float, tick: float):
+    def build():
+        heap: list[tuple[float, int]] = []
+        due: dict[int, float] = {}
+        for key, when in enumerate(times):
+            due[key] = when
+            heapq.heappush(heap, (when, key))
+        return heap, due
+
+    heap, due = measure("heap schedule", build, len(times))
+    memory("heap memory", build, len(times))
+
+    cancelled = range(0, len(times), 10)
+    # Cancelling in a heap is lazy: the entry stays and is skipped when popped
+    measure("heap cancel (10%)", lambda: [due.pop(key) for key in cancelled], len(cancelled))
+
+    def reschedule():
+        for key in cancelled:
+            due[key] = times[key]
+            heapq.heappush(heap, (times[key], key))
+
+    measure("heap reschedule (10%)", reschedule, len(cancelled))
+
+    def run_day():
+        fired = 0
+        for n in range(1, int(DAY // tick) + 1):
+            now = origin + n * tick
+            while heap and heap[0][0] <= now:
+                when, key = heapq.heappop(heap)
+                if due.get(key) == when:
+                    del due[key]
+                    fired += 1
+        return fired
+
+    measure("heap day of ticks", run_day, len(times))
+
+def bench_evaluate(batch: int):
+    checkpoints = reminder_service.checkpoints or [Checkpoint("water", 15 * 60), Checkpoint("meal", 14 * 60)]
+    subscription = Subscription(True, 3 * 3600, 23 * 60, 8 * 60)
+    rng = random.Random(1)
+    users = []
+    for user_id in range(batch):
+        profile = UserProfile(user_id=user_id, weight=rng.uniform(50, 110), height=rng.uniform(150, 200),
+                              age=rng.randint(18, 70), activity_minutes=rng.choice([0, 30, 60]),
+                              city="Москва", utc_offset=3 * 3600)
+        log = DailyLog(date=profile.local_now(), water_intake=rng.choice([0, 500, 1500, 2500]))
+        users.append((profile, log if user_id % 3 else None))
+    now = time.time()
+
+    def evaluate():
+        sent = 0
+        for i, (profile, log) in enumerate(users):
+            checkpoint = checkpoints[i % len(checkpoints)]
+            sent += reminder_service.evaluate(checkpoint, subscription, profile, log, now) is not None
+        return sent
+
+    sent = measure("evaluate one tick", evaluate, batch)
+    print(f"{'':<28}{sent} of {batch} reminders would be sent")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reminders", type=int, default=1_000_000)
+    parser.add_argument("--tick", type=float, default=60.0)
+    parser.add_argument("--batch", type=int, default=20000, help="reminders evaluated in one tick")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    origin = time.time()
+    times = [origin + rng.uniform(0, DAY) for _ in range(args.reminders)]
+    print(f"{args.reminders} reminders over one day, {args.tick:.0f}s ticks\n")
+    bench_wheel(times, args.tick, origin)
+    print()
+    bench_heap(times, origin, args.tick)
+    print()
+    bench_evaluate(args.batch)
+
+if __name__ == "__main__":
+    main()
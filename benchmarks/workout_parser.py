@@ -0,0 +1,126 @@
+"""Accuracy and speed of the local workout parser.
+
+Runs every description in workout_corpus.tsv through parse_workout and
+checks the recognised activity and duration against the expected ones.
+A row with no expected activity should not be resolved locally (it is
+ambiguous and belongs to the AI). Reports how many rows the parser would
+answer without the AI and how many of those answers are right, then times
+the parser against the regex duration helper it replaced.
+
+    python benchmarks/workout_parser.py [--verbose] [--repeat 200]
+"""
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import config
+from workout_energy import get_workout_engine
+from workout_parser import parse_duration, parse_workout
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workout_corpus.tsv")
+
+def legacy_duration(text: str):
+    """The duration helper parse_workout replaced, kept verbatim for comparison."""
+    patterns = [
+        r'(\d+(?:\.\d+)?)\s*(?:минут|мин|min)',
+        r'(\d+(?:\.\d+)?)\s*(?:час|часа|часов|ч|h)',
+        r'(\d+(?:\.\d+)?)\s*(?:сек|секунд|с|s)',
+    ]
+    minutes = 0
+    for pattern in patterns:
+        matches = re.finditer(pattern, text.lower())
+        for match in matches:
+            value = float(match.group(1))
+            if 'час' in match.group() or 'h' in match.group():
+                minutes += value * 60
+            elif 'мин' in match.group() or 'min' in match.group():
+                minutes += value
+            elif 'сек' in match.group() or 's' in match.group():
+                minutes += value / 60
+    return minutes if minutes > 0 else None
+
+def load_corpus(path: str) -> list[tuple[str, str, float | None]]:
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for row in csv.reader((line for line in f if not line.startswith("#")), delimiter="\t"):
+            if row:
+                text, activity, minutes = (row + ["", ""])[:3]
+                rows.append((text, activity, float(minutes) if minutes else None))
+    return rows
+
+def same_minutes(actual, expected) -> bool:
+    if expected is None or actual is None:
+        return actual is expected
+    return abs(actual - expected) < 0.5
+
+def evaluate(corpus, threshold: float, verbose: bool) -> dict:
+    durations_right = legacy_right = 0
+    local = local_right = should_be_local = wrongly_local = 0
+    for text, activity, minutes in corpus:
+        parsed = parse_workout(text)
+        duration_ok = same_minutes(parsed.minutes, minutes)
+        durations_right += duration_ok
+        legacy_right += same_minutes(legacy_duration(text), minutes)
+        name = parsed.activity.name if parsed.activity else ""
+        is_local = parsed.activity is not None and parsed.confidence >= threshold
+        expected_local = bool(activity) and minutes is not None
+        should_be_local += expected_local
+        if is_local:
+            local += 1
+            right = duration_ok and name == activity
+            local_right += right
+            wrongly_local += not expected_local
+        ok = duration_ok and (is_local == expected_local) and (not is_local or name == activity)
+        if verbose or not ok:
+            mark = "  " if ok else "✗ "
+            print(f"{mark}{text!r}: {name or '-'} {parsed.minutes} min, confidence {parsed.confidence:.2f}"
+                  f"{'' if ok else f' (expected {activity or chr(45)} {minutes} min)'}")
+    n = len(corpus)
+    return {
+        "rows": n,
+        "duration_accuracy": durations_right / n,
+        "legacy_duration_accuracy": legacy_right / n,
+        "answered_locally": local,
+        "local_coverage": local / should_be_local if should_be_local else 0.0,
+        "local_precision": local_right / local if local else 0.0,
+        "wrongly_local": wrongly_local,
+    }
+
+def time_per_call(fn, texts: list[str], repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            fn(text)
+    return (time.perf_counter() - started) / (repeat * len(texts)) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--threshold", type=float, default=config.WORKOUT_PARSER_MIN_CONFIDENCE)
+    parser.add_argument("--verbose", action="store_true", help="print every row, not only the mistakes")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    get_workout_engine()
+    result = evaluate(corpus, args.threshold, args.verbose)
+    print(f"\n{result['rows']} descriptions, confidence threshold {args.threshold}")
+    print(f"duration accuracy: {result['duration_accuracy']:.1%} (regex helper: {result['legacy_duration_accuracy']:.1%})")
+    print(f"answered without the AI: {result['answered_locally']} "
+          f"({result['local_coverage']:.1%} of the rows that should be), "
+          f"{result['local_precision']:.1%} of them right, {result['wrongly_local']} that should have gone to the AI")
+
+    texts = [text for text, _, _ in corpus]
+    print(f"\nparse_duration:  {time_per_call(parse_duration, texts, args.repeat):.1f} µs/description")
+    print(f"regex helper:    {time_per_call(legacy_duration, texts, args.repeat):.1f} µs/description")
+    print(f"parse_workout:   {time_per_call(parse_workout, texts, max(1, args.repeat // 10)):.1f} µs/description "
+          f"(duration and activity lookup)")
+
+if __name__ == "__main__":
+    main()
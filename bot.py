@@ -1,20 +1,242 @@
 import asyncio
 import logging
+import os
+import signal
+import sys
+from contextlib import suppress
+from typing import Callable
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.exceptions import TelegramNetworkError
 
 from config import config
 from handlers import router
+from storage import repository
+from fsm_storage import SQLiteStorage
+from weather_service import weather_service
+from ai_service import ai_service
+from weather_prefetcher import WeatherPrefetcher
+from webhook_server import WebhookServer
+from update_queue import UpdateQueue
+from sharding import ShardRouter, ShardWorker
+from metrics import LoopLagMonitor, MetricsServer
+from instrumentation import HandlerMetricsMiddleware, register_collectors
+from scheduler import RateLimiter, SchedulingMiddleware
+from log_setup import setup_logging, log_path_for_shard
+from snapshot import Snapshotter, snapshot_path_for_shard
+from reminders import reminder_service
 
-logging.basicConfig(level=logging.INFO)
+SHARD = int(sys.argv[2]) if len(sys.argv) >= 3 and sys.argv[1] == "--shard-worker" else None
+SHARD_COUNT = int(sys.argv[3]) if SHARD is not None and len(sys.argv) >= 4 else config.SHARD_WORKERS
+setup_logging(log_path_for_shard(SHARD))
+logger = logging.getLogger(__name__)
 
 bot = Bot(token=config.BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+fsm_storage = SQLiteStorage(
+    config.DB_PATH,
+    config.FSM_TTL_MINUTES * 60,
+    config.FSM_CACHE_SIZE,
+    config.STORAGE_FLUSH_INTERVAL
+)
+dp = Dispatcher(storage=fsm_storage)
 dp.include_router(router)
+dp.message.outer_middleware(HandlerMetricsMiddleware())
+rate_limiter = RateLimiter(
+    config.USER_RATE_PER_MINUTE,
+    config.USER_RATE_BURST,
+    config.RATE_LIMIT_MAX_USERS
+) if config.RATE_LIMIT_ENABLED else None
+dp.message.outer_middleware(SchedulingMiddleware(rate_limiter, ai_service.scheduler))
+weather_prefetcher = WeatherPrefetcher(repository.cached_users)
+loop_lag_monitor = LoopLagMonitor(config.LOOP_LAG_INTERVAL)
+metrics_server = MetricsServer(config.METRICS_HOST, config.METRICS_PORT)
+snapshotter = Snapshotter(
+    snapshot_path_for_shard(SHARD),
+    config.SNAPSHOT_INTERVAL,
+    config.SNAPSHOT_CHUNK,
+    SHARD,
+    SHARD_COUNT
+)
+if SHARD is not None:
+    repository.generation_key = f"generation:shard{SHARD}"
 
-async def main():
+async def on_startup():
+    await repository.start()
+    if config.SNAPSHOT_ENABLED:
+        # Before any update is handled, so the first requests already hit warm caches
+        await snapshotter.load()
+        snapshotter.start()
+    await weather_service.start()
+    await ai_service.start()
+    if config.REMINDERS_ENABLED:
+        # Every process keeps subscriptions in sync, one of them sends the reminders
+        await reminder_service.start(bot if SHARD in (None, config.REMINDER_SHARD) else None)
+    if config.WEATHER_PREFETCH_ENABLED:
+        weather_prefetcher.start()
+    if config.METRICS_ENABLED:
+        register_collectors(rate_limiter)
+        loop_lag_monitor.start()
+        await metrics_server.start()
+
+async def on_shutdown():
+    await metrics_server.stop()
+    await loop_lag_monitor.stop()
+    await weather_prefetcher.stop()
+    if config.SNAPSHOT_ENABLED:
+        await snapshotter.stop()
+        try:
+            await snapshotter.save()
+        except Exception as e:
+            logger.error(f"Final snapshot failed: {str(e)}")
+    await reminder_service.stop()
+    await ai_service.close()
+    await weather_service.close()
+    await fsm_storage.close()
+    await repository.close()
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+async def wait_for_signals(handlers: dict[int, Callable[[], None]]):
+    """Run until SIGINT/SIGTERM, dispatching any other given signals meanwhile."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig, handler in {**handlers, signal.SIGINT: stop.set, signal.SIGTERM: stop.set}.items():
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, handler)
+    await stop.wait()
+
+async def register_webhook():
+    if config.WEBHOOK_URL:
+        await bot.set_webhook(
+            config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+            secret_token=config.WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            drop_pending_updates=True
+        )
+    else:
+        logger.warning("WEBHOOK_URL is not set, serving updates without registering the webhook")
+
+async def run_polling():
     await bot.delete_webhook(drop_pending_updates=True)
     await dp.start_polling(bot)
 
+async def run_webhook():
+    queue = UpdateQueue(dp, bot, config.WEBHOOK_WORKERS, config.WEBHOOK_QUEUE_SIZE,
+                        fast_workers=config.WEBHOOK_FAST_WORKERS)
+    server = WebhookServer(queue, bot, config.WEBHOOK_PATH, config.WEBHOOK_SECRET)
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=(bot,), **dp.workflow_data)
+    queue.start()
+    await server.start(config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+    await register_webhook()
+    try:
+        await wait_for_signals({})
+    finally:
+        server.stop_accepting()
+        await queue.stop(config.WEBHOOK_DRAIN_TIMEOUT)
+        await server.stop()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=(bot,), **dp.workflow_data)
+        await bot.session.close()
+
+async def poll_into(shard_router: ShardRouter):
+    """Long-poll Telegram and hand updates to the shard router, waiting when it is saturated."""
+    offset = None
+    allowed_updates = dp.resolve_used_update_types()
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except TelegramNetworkError as e:
+            logger.error(f"Polling failed: {str(e)}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await shard_router.put(update)
+            offset = update.update_id + 1
+
+def shard_worker_command(shard: int, shards: int) -> list[str]:
+    return [sys.executable, os.path.abspath(__file__), "--shard-worker", str(shard), str(shards)]
+
+async def run_sharded():
+    """Front process: receive updates and route them to SHARD_WORKERS worker processes."""
+    shard_router = ShardRouter(
+        config.SHARD_WORKERS,
+        config.SHARD_SOCKET_PATH,
+        config.SHARD_WINDOW,
+        config.SHARD_RESTART_DELAY,
+        shard_worker_command
+    )
+    await shard_router.start()
+    server = None
+    poller = None
+    if config.BOT_MODE == "webhook":
+        server = WebhookServer(shard_router, bot, config.WEBHOOK_PATH, config.WEBHOOK_SECRET)
+        await server.start(config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+        await register_webhook()
+    else:
+        await bot.delete_webhook()
+        poller = asyncio.create_task(poll_into(shard_router))
+
+    def resize(delta: int):
+        asyncio.create_task(shard_router.resize(shard_router.shards + delta, config.WEBHOOK_DRAIN_TIMEOUT))
+
+    try:
+        await wait_for_signals({
+            signal.SIGHUP: shard_router.restart_all,
+            signal.SIGUSR1: lambda: resize(1),
+            signal.SIGUSR2: lambda: resize(-1),
+        })
+    finally:
+        if poller is not None:
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+        if server is not None:
+            server.stop_accepting()
+        await shard_router.stop(config.WEBHOOK_DRAIN_TIMEOUT)
+        if server is not None:
+            await server.stop()
+        await bot.session.close()
+
+async def run_shard_worker(shard: int):
+    metrics_server.port = config.METRICS_PORT + 1 + shard
+    # Each worker talks to DeepSeek on its own, so the global cap is split between them
+    shards = max(1, SHARD_COUNT)
+    ai_service.scheduler.set_rate(config.AI_GLOBAL_RATE_PER_SECOND / shards, config.AI_GLOBAL_BURST / shards)
+    worker = ShardWorker(
+        shard,
+        config.SHARD_SOCKET_PATH,
+        dp, bot,
+        workers=config.WEBHOOK_WORKERS,
+        queue_size=config.SHARD_WINDOW,
+        drain_timeout=config.WEBHOOK_DRAIN_TIMEOUT,
+        fast_workers=config.WEBHOOK_FAST_WORKERS
+    )
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=(bot,), **dp.workflow_data)
+    try:
+        await worker.run()
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=(bot,), **dp.workflow_data)
+        await bot.session.close()
+
+def check_webhook_secret():
+    """Refuse to expose a public webhook that anyone could post forged updates to."""
+    if config.WEBHOOK_SECRET:
+        return
+    if config.WEBHOOK_URL:
+        logger.critical("WEBHOOK_SECRET is not set, refusing to register a public webhook")
+        raise SystemExit("WEBHOOK_SECRET must be set when BOT_MODE=webhook and WEBHOOK_URL is set")
+    logger.warning(f"WEBHOOK_SECRET is not set, requests to {config.WEBHOOK_PATH} are not verified")
+
+async def main():
+    if SHARD is None and config.BOT_MODE == "webhook":
+        check_webhook_secret()
+    if SHARD is not None:
+        await run_shard_worker(SHARD)
+    elif config.SHARD_WORKERS > 0:
+        await run_sharded()
+    elif config.BOT_MODE == "webhook":
+        await run_webhook()
+    else:
+        await run_polling()
+
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+import bisect
+import csv
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from config import config
+from text_index import TrigramIndex, index_key
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CITIES_PATH = Path(__file__).parent / "data" / "cities.csv"
+
+# Words people put in front of the name: "г. Москва", "город Казань", "в Москве"
+_PREFIX_WORDS = {"г", "гор", "город", "в", "во", "city", "in"}
+
+# A prefix of a single city's name is a strong hint, a prefix shared by
+# several is not
+UNIQUE_PREFIX = 0.9
+AMBIGUOUS_PREFIX = 0.6
+MIN_PREFIX_LENGTH = 3
+
+@dataclass(slots=True)
+class City:
+    id: int  # OpenWeatherMap (GeoNames) city id
+    name: str
+    country: str
+    lat: float
+    lon: float
+    population: int = 0
+
+@dataclass(slots=True)
+class CityMatch:
+    city: City
+    confidence: float
+
+class CityIndex:
+    """Offline city lookup over the bundled city list.
+
+    Names and aliases (Russian, English, transliterations, old names,
+    abbreviations like "спб") are normalized the same way as foods and
+    activities. A query is tried as an exact name, then as a prefix of the
+    names in a sorted key list, then fuzzily with the trigram index.
+    Cities resolved elsewhere (by the weather API) can be added at run time,
+    with the query that found them as an extra exact name.
+    """
+
+    def __init__(self, cities: list[City], aliases: list[tuple[str, int]]):
+        self._cities: dict[int, City] = {city.id: city for city in cities}
+        self.index = TrigramIndex(aliases)
+        keyed = sorted({(index_key(alias), city_id) for alias, city_id in aliases})
+        self._keys = [key for key, _ in keyed]
+        self._key_ids = [city_id for _, city_id in keyed]
+        # Normalized queries answered by add(), looked up before the index
+        self._learned: dict[str, int] = {}
+
+    @classmethod
+    def from_csv(cls, path: Path = DEFAULT_CITIES_PATH) -> "CityIndex":
+        cities: list[City] = []
+        aliases: list[tuple[str, int]] = []
+        with open(path, encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                city = City(
+                    id=int(row["id"]),
+                    name=row["name"],
+                    country=row["country"],
+                    lat=float(row["lat"]),
+                    lon=float(row["lon"]),
+                    population=int(row["population"] or 0)
+                )
+                cities.append(city)
+                names = [row["name"]] + [s for s in row["synonyms"].split("|") if s]
+                aliases.extend((name, city.id) for name in names)
+        logger.info(f"Loaded {len(cities)} cities with {len(aliases)} names from {path}")
+        return cls(cities, aliases)
+
+    def __len__(self) -> int:
+        return len(self._cities)
+
+    def get(self, city_id: int) -> Optional[City]:
+        return self._cities.get(city_id)
+
+    def add(self, city: City, query: Optional[str] = None):
+        """Remember a city resolved elsewhere so its coordinates are known by id.
+
+        With the query that found it, the same query resolves to the city
+        from then on without asking again.
+        """
+        self._cities.setdefault(city.id, city)
+        key = self._query_key(query) if query else ""
+        if key:
+            self._learned[key] = city.id
+
+    @staticmethod
+    def _query_key(text: str) -> str:
+        words = index_key(text).split()
+        while len(words) > 1 and words[0] in _PREFIX_WORDS:
+            words.pop(0)
+        return " ".join(words)
+
+    def _by_prefix(self, key: str) -> Optional[CityMatch]:
+        start = bisect.bisect_left(self._keys, key)
+        end = bisect.bisect_left(self._keys, key + "\uffff", start)
+        candidates = {self._key_ids[i] for i in range(start, end)}
+        if not candidates:
+            return None
+        city = max((self._cities[city_id] for city_id in candidates), key=lambda c: c.population)
+        return CityMatch(city, UNIQUE_PREFIX if len(candidates) == 1 else AMBIGUOUS_PREFIX)
+
+    def resolve(self, text: str) -> Optional[CityMatch]:
+        key = self._query_key(text)
+        if not key:
+            return None
+        city_id = self._learned.get(key)
+        if city_id is None:
+            city_id = self.index.exact(key)
+        if city_id is not None:
+            return CityMatch(self._cities[city_id], 1.0)
+
+        best = self._by_prefix(key) if len(key) >= MIN_PREFIX_LENGTH else None
+        match = self.index.search(key)
+        if match is not None and (best is None or match[1] > best.confidence):
+            best = CityMatch(self._cities[match[0]], match[1])
+        return best
+
+_city_index: Optional[CityIndex] = None
+
+def get_city_index() -> CityIndex:
+    global _city_index
+    if _city_index is None:
+        _city_index = CityIndex.from_csv(Path(config.CITIES_PATH) if config.CITIES_PATH else DEFAULT_CITIES_PATH)
+    return _city_index
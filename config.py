@@ -10,4 +10,124 @@ class Config:
     WEATHER_API_KEY: str = getenv("OPENWEATHERMAP_API_KEY")
     DEEPSEEK_API_KEY: str = getenv("DEEPSEEK_API_KEY")
 
-config = Config() 
\ No newline at end of file
+    # Update delivery: "polling" or "webhook"
+    BOT_MODE: str = getenv("BOT_MODE", "polling")
+    WEBHOOK_URL: str = getenv("WEBHOOK_URL", "")  # public base URL; empty skips setWebhook (local testing)
+    WEBHOOK_PATH: str = getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_SECRET: str = getenv("WEBHOOK_SECRET", "")  # required when WEBHOOK_URL is set
+    WEBHOOK_HOST: str = getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT: int = int(getenv("WEBHOOK_PORT", "8080"))
+    WEBHOOK_WORKERS: int = int(getenv("WEBHOOK_WORKERS", "16"))
+    WEBHOOK_FAST_WORKERS: int = int(getenv("WEBHOOK_FAST_WORKERS", "8"))  # separate lane for commands that never call the AI
+    WEBHOOK_QUEUE_SIZE: int = int(getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+    WEBHOOK_MAX_CONNECTIONS: int = int(getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    WEBHOOK_DRAIN_TIMEOUT: float = float(getenv("WEBHOOK_DRAIN_TIMEOUT", "10"))
+
+    # Scale-out: number of worker processes (0 runs everything in one process)
+    SHARD_WORKERS: int = int(getenv("SHARD_WORKERS", "0"))
+    SHARD_SOCKET_PATH: str = getenv("SHARD_SOCKET_PATH", "fitness_bot.sock")
+    SHARD_WINDOW: int = int(getenv("SHARD_WINDOW", "256"))
+    SHARD_RESTART_DELAY: float = float(getenv("SHARD_RESTART_DELAY", "1"))
+
+    # Scheduling of AI-backed commands (/log_food, /log_workout)
+    RATE_LIMIT_ENABLED: bool = getenv("RATE_LIMIT_ENABLED", "1") == "1"
+    USER_RATE_PER_MINUTE: float = float(getenv("USER_RATE_PER_MINUTE", "10"))
+    USER_RATE_BURST: float = float(getenv("USER_RATE_BURST", "5"))
+    RATE_LIMIT_MAX_USERS: int = int(getenv("RATE_LIMIT_MAX_USERS", "100000"))
+    AI_GLOBAL_RATE_PER_SECOND: float = float(getenv("AI_GLOBAL_RATE_PER_SECOND", "0"))  # 0 disables the global cap; split between shard workers
+    AI_GLOBAL_BURST: float = float(getenv("AI_GLOBAL_BURST", "20"))
+
+    # Water and meal reminders
+    REMINDERS_ENABLED: bool = getenv("REMINDERS_ENABLED", "1") == "1"
+    REMINDER_WATER_TIMES: str = getenv("REMINDER_WATER_TIMES", "11:00,15:00,19:00")  # user's local time
+    REMINDER_MEAL_TIMES: str = getenv("REMINDER_MEAL_TIMES", "14:00,20:00")
+    REMINDER_QUIET_HOURS: str = getenv("REMINDER_QUIET_HOURS", "23:00-08:00")  # default, users can change theirs
+    REMINDER_WATER_SHARE: float = float(getenv("REMINDER_WATER_SHARE", "0.8"))  # remind below this share of the pro-rated norm
+    REMINDER_MEAL_GAP_HOURS: float = float(getenv("REMINDER_MEAL_GAP_HOURS", "4"))
+    REMINDER_TICK: float = float(getenv("REMINDER_TICK", "60"))
+    REMINDER_SEND_RATE: float = float(getenv("REMINDER_SEND_RATE", "25"))  # messages per second, below Telegram's limit
+    REMINDER_SHARD: int = int(getenv("REMINDER_SHARD", "0"))  # the shard worker that sends reminders
+
+    # Logging
+    LOG_PATH: str = getenv("LOG_PATH", "bot.log")
+    LOG_LEVEL: str = getenv("LOG_LEVEL", "INFO")
+    LOG_CONSOLE: bool = getenv("LOG_CONSOLE", "1") == "1"
+    LOG_MAX_BYTES: int = int(getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+    LOG_ROTATE_HOURS: float = float(getenv("LOG_ROTATE_HOURS", "24"))
+    LOG_BACKUP_COUNT: int = int(getenv("LOG_BACKUP_COUNT", "7"))
+    LOG_QUEUE_SIZE: int = int(getenv("LOG_QUEUE_SIZE", "10000"))
+    LOG_DEBUG_SAMPLE_RATE: float = float(getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+    LOG_SLOW_HANDLER_SECONDS: float = float(getenv("LOG_SLOW_HANDLER_SECONDS", "2"))
+
+    # Metrics
+    METRICS_ENABLED: bool = getenv("METRICS_ENABLED", "1") == "1"
+    METRICS_HOST: str = getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT: int = int(getenv("METRICS_PORT", "9100"))  # shard workers use METRICS_PORT + 1 + shard
+    LOOP_LAG_INTERVAL: float = float(getenv("LOOP_LAG_INTERVAL", "0.5"))
+    ACTIVE_USER_MINUTES: float = float(getenv("ACTIVE_USER_MINUTES", "15"))
+    LAST_ACTIVE_RESOLUTION_MINUTES: float = float(getenv("LAST_ACTIVE_RESOLUTION_MINUTES", "5"))
+
+    # Storage
+    DB_PATH: str = getenv("DB_PATH", "fitness_bot.sqlite3")
+    STORAGE_CACHE_SIZE: int = int(getenv("STORAGE_CACHE_SIZE", "10000"))
+    STORAGE_FLUSH_INTERVAL: float = float(getenv("STORAGE_FLUSH_INTERVAL", "2"))
+    STORAGE_FLUSH_MAX_DIRTY: int = int(getenv("STORAGE_FLUSH_MAX_DIRTY", "500"))
+    FSM_TTL_MINUTES: float = float(getenv("FSM_TTL_MINUTES", "1440"))
+    FSM_CACHE_SIZE: int = int(getenv("FSM_CACHE_SIZE", "10000"))
+
+    # Snapshots of in-memory state for a warm restart
+    SNAPSHOT_ENABLED: bool = getenv("SNAPSHOT_ENABLED", "1") == "1"
+    SNAPSHOT_PATH: str = getenv("SNAPSHOT_PATH", "fitness_bot.snapshot")  # shard workers use <name>.shardN<ext>
+    SNAPSHOT_INTERVAL: float = float(getenv("SNAPSHOT_INTERVAL", "300"))
+    SNAPSHOT_CHUNK: int = int(getenv("SNAPSHOT_CHUNK", "500"))  # entries handled between yields to the event loop
+
+    # AI HTTP client
+    AI_CONNECT_TIMEOUT: float = float(getenv("AI_CONNECT_TIMEOUT", "5"))
+    AI_READ_TIMEOUT: float = float(getenv("AI_READ_TIMEOUT", "30"))
+    AI_MAX_CONNECTIONS: int = int(getenv("AI_MAX_CONNECTIONS", "16"))
+    AI_MAX_CONCURRENCY: int = int(getenv("AI_MAX_CONCURRENCY", "8"))
+    AI_KEEPALIVE_TIMEOUT: float = float(getenv("AI_KEEPALIVE_TIMEOUT", "60"))
+    AI_BATCH_ENABLED: bool = getenv("AI_BATCH_ENABLED", "1") == "1"
+    AI_BATCH_WINDOW: float = float(getenv("AI_BATCH_WINDOW", "0.05"))
+    AI_BATCH_MAX_SIZE: int = int(getenv("AI_BATCH_MAX_SIZE", "10"))
+
+    # AI estimate cache
+    AI_CACHE_PATH: str = getenv("AI_CACHE_PATH", "ai_cache.sqlite3")
+    AI_CACHE_MEMORY_SIZE: int = int(getenv("AI_CACHE_MEMORY_SIZE", "5000"))
+    AI_CACHE_TTL_DAYS: float = float(getenv("AI_CACHE_TTL_DAYS", "30"))
+    AI_CACHE_PURGE_HOURS: float = float(getenv("AI_CACHE_PURGE_HOURS", "6"))  # expired entries are deleted from disk
+    AI_CACHE_WEIGHT_BUCKET: float = float(getenv("AI_CACHE_WEIGHT_BUCKET", "5"))
+
+    # Local food database
+    FOOD_DB_PATH: str = getenv("FOOD_DB_PATH", "")
+    FOOD_DB_MIN_CONFIDENCE: float = float(getenv("FOOD_DB_MIN_CONFIDENCE", "0.8"))
+    MEAL_MAX_ITEMS: int = int(getenv("MEAL_MAX_ITEMS", "10"))  # longer lists are estimated as one item
+
+    # Local workout energy engine
+    ACTIVITIES_PATH: str = getenv("ACTIVITIES_PATH", "")
+    WORKOUT_ENGINE_MIN_CONFIDENCE: float = float(getenv("WORKOUT_ENGINE_MIN_CONFIDENCE", "0.75"))
+    WORKOUT_PARSER_MIN_CONFIDENCE: float = float(getenv("WORKOUT_PARSER_MIN_CONFIDENCE", "0.8"))
+
+    # Offline city list
+    CITIES_PATH: str = getenv("CITIES_PATH", "")
+    CITY_MIN_CONFIDENCE: float = float(getenv("CITY_MIN_CONFIDENCE", "0.85"))  # below it the weather API is asked
+
+    # Weather HTTP client
+    WEATHER_CONNECT_TIMEOUT: float = float(getenv("WEATHER_CONNECT_TIMEOUT", "3"))
+    WEATHER_READ_TIMEOUT: float = float(getenv("WEATHER_READ_TIMEOUT", "5"))
+    WEATHER_MAX_CONNECTIONS: int = int(getenv("WEATHER_MAX_CONNECTIONS", "20"))
+    WEATHER_KEEPALIVE_TIMEOUT: float = float(getenv("WEATHER_KEEPALIVE_TIMEOUT", "60"))
+
+    # Weather cache
+    WEATHER_CACHE_TTL_MINUTES: float = float(getenv("WEATHER_CACHE_TTL_MINUTES", "30"))
+    WEATHER_CACHE_STALE_MINUTES: float = float(getenv("WEATHER_CACHE_STALE_MINUTES", "180"))
+    WEATHER_CACHE_MAX_SIZE: int = int(getenv("WEATHER_CACHE_MAX_SIZE", "1000"))
+
+    # Weather prefetch
+    WEATHER_PREFETCH_ENABLED: bool = getenv("WEATHER_PREFETCH_ENABLED", "1") == "1"
+    WEATHER_PREFETCH_INTERVAL: float = float(getenv("WEATHER_PREFETCH_INTERVAL", "60"))
+    WEATHER_PREFETCH_LEAD_MINUTES: float = float(getenv("WEATHER_PREFETCH_LEAD_MINUTES", "5"))
+    WEATHER_PREFETCH_ACTIVE_MINUTES: float = float(getenv("WEATHER_PREFETCH_ACTIVE_MINUTES", "180"))
+    WEATHER_PREFETCH_CALLS_PER_MINUTE: int = int(getenv("WEATHER_PREFETCH_CALLS_PER_MINUTE", "30"))
+
+config = Config() 
@@ -0,0 +1,163 @@
+import sys
+from array import array
+from datetime import datetime
+from typing import Any, Iterator, Optional
+
+from pydantic import BaseModel
+from pydantic_core import core_schema
+
+class EntryLog:
+    """Compact, append-only list of logged entries.
+
+    Numbers and timestamps live in typed arrays, names and explanations are
+    interned so identical strings are shared across entries and users.
+    Columns are allocated on the first append, so an empty log costs only
+    the object itself. Pydantic entry models are built only when iterated.
+    """
+
+    __slots__ = ("_names", "_explanations", "_calories", "_timestamps")
+
+    model: type[BaseModel]
+    name_field: str
+
+    def __init__(self):
+        self._names: Optional[list[str]] = None
+        self._explanations: Optional[list[str]] = None
+        self._calories: Optional[array] = None
+        self._timestamps: Optional[array] = None
+
+    def _allocate(self):
+        self._names = []
+        self._explanations = []
+        self._calories = array("d")
+        self._timestamps = array("d")
+
+    def _append(self, name: str, calories: float, timestamp: datetime, explanation: str):
+        if self._names is None:
+            self._allocate()
+        self._names.append(sys.intern(name))
+        self._explanations.append(sys.intern(explanation))
+        self._calories.append(calories)
+        self._timestamps.append(timestamp.timestamp())
+
+    def __len__(self) -> int:
+        return len(self._names) if self._names is not None else 0
+
+    def __bool__(self) -> bool:
+        return self._names is not None and len(self._names) > 0
+
+    def last_timestamp(self) -> Optional[float]:
+        """Unix time of the latest entry, without building a model."""
+        return self._timestamps[-1] if self else None
+
+    def _fields(self, index: int) -> dict[str, Any]:
+        return {
+            self.name_field: self._names[index],
+            "calories": self._calories[index],
+            "timestamp": datetime.fromtimestamp(self._timestamps[index]),
+            "explanation": self._explanations[index],
+        }
+
+    def __iter__(self) -> Iterator[BaseModel]:
+        for index in range(len(self)):
+            yield self.model(**self._fields(index))
+
+    def __getitem__(self, index: int) -> BaseModel:
+        return self.model(**self._fields(range(len(self))[index]))
+
+    def append(self, entry: BaseModel):
+        self.add(**entry.model_dump())
+
+    def to_list(self) -> list[dict[str, Any]]:
+        return [
+            {**self._fields(index), "timestamp": datetime.fromtimestamp(self._timestamps[index]).isoformat()}
+            for index in range(len(self))
+        ]
+
+    @classmethod
+    def _validate(cls, value: Any) -> "EntryLog":
+        if isinstance(value, cls):
+            return value
+        if not isinstance(value, (list, tuple)):
+            raise ValueError(f"{cls.__name__} expects a list of entries")
+        log = cls()
+        for item in value:
+            entry = item if isinstance(item, cls.model) else cls.model.model_validate(item)
+            log.append(entry)
+        return log
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: Any, handler: Any) -> core_schema.CoreSchema:
+        return core_schema.no_info_plain_validator_function(
+            cls._validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(lambda log: log.to_list()),
+        )
+
+class FoodLog(EntryLog):
+    """Food entries; the items of one multi-item meal share a meal number.
+
+    The meal number is the index of the meal's first entry, so a
+    single-item meal is numbered by its own index and entries stored
+    before meals existed need no migration.
+    """
+
+    __slots__ = ("_meals",)
+
+    name_field = "food_name"
+
+    def __init__(self):
+        super().__init__()
+        self._meals: Optional[array] = None
+
+    def _allocate(self):
+        super()._allocate()
+        self._meals = array("l")
+
+    def add(self, food_name: str, calories: float, timestamp: datetime, explanation: str,
+            meal: Optional[int] = None):
+        index = len(self)
+        self._append(food_name, calories, timestamp, explanation)
+        self._meals.append(index if meal is None else meal)
+
+    def add_meal(self, items: list[tuple[str, float, str]], timestamp: datetime) -> int:
+        """Append (food name, calories, explanation) items as one meal and return its number."""
+        meal = len(self)
+        for food_name, calories, explanation in items:
+            self.add(food_name, calories, timestamp, explanation, meal)
+        return meal
+
+    def _fields(self, index: int) -> dict[str, Any]:
+        fields = super()._fields(index)
+        fields["meal"] = self._meals[index]
+        return fields
+
+    def rows(self) -> Iterator[tuple[str, float, None, datetime]]:
+        for index in range(len(self)):
+            yield self._names[index], self._calories[index], None, datetime.fromtimestamp(self._timestamps[index])
+
+class WorkoutLog(EntryLog):
+    __slots__ = ("_minutes",)
+
+    name_field = "workout_type"
+
+    def __init__(self):
+        super().__init__()
+        self._minutes: Optional[array] = None
+
+    def _allocate(self):
+        super()._allocate()
+        self._minutes = array("d")
+
+    def add(self, workout_type: str, minutes: float, calories: float, timestamp: datetime, explanation: str):
+        self._append(workout_type, calories, timestamp, explanation)
+        self._minutes.append(minutes)
+
+    def _fields(self, index: int) -> dict[str, Any]:
+        fields = super()._fields(index)
+        fields["minutes"] = self._minutes[index]
+        return fields
+
+    def rows(self) -> Iterator[tuple[str, float, float, datetime]]:
+        for index in range(len(self)):
+            yield (self._names[index], self._calories[index], self._minutes[index],
+                   datetime.fromtimestamp(self._timestamps[index]))
@@ -0,0 +1,173 @@
+import csv
+import logging
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from config import config
+from text_index import TrigramIndex, normalize_text, strip_separators
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FOODS_PATH = Path(__file__).parent / "data" / "foods.csv"
+
+_QUANTITY = re.compile(
+    r"(?<![\w.,])(?P<amount>\d+(?:[.,]\d+)?)\s*"
+    r"(?P<unit>кг|kg|гр|грамм(?:а|ов)?|г|gr|g|мл|ml|л|l|шт(?:ук[иа]?)?|pcs|pc)?(?!\w)"
+)
+# Fat content ("творог 5%", "молоко 3,2%") is part of the name, not an amount
+_PERCENT = re.compile(r"\d+(?:[.,]\d+)?\s*%")
+_SERVING_WORDS = re.compile(
+    r"^(?:стакан\w*|чаш\w*|круж\w*|порци\w*|тарел\w*|кус(?:о|ок|ка|ков)\w*|"
+    r"glass(?:es)?|cups?|bowls?|servings?|pieces?|slices?)\s+"
+)
+_NUMBER_WORDS = {
+    "один": 1, "одна": 1, "одно": 1, "одну": 1,
+    "два": 2, "две": 2, "три": 3, "четыре": 4, "пять": 5,
+    "половина": 0.5, "половинка": 0.5, "пол": 0.5,
+    "one": 1, "two": 2, "three": 3, "half": 0.5,
+}
+_GRAMS_PER_UNIT = {"кг": 1000, "kg": 1000, "л": 1000, "l": 1000}
+# Commas between digits are decimal separators ("0,5 л молока")
+_ITEM_SEPARATORS = re.compile(r"\s*(?:(?<!\d),|,(?!\d)|;|\+|\n)\s*")
+_CONJUNCTION = re.compile(r"\s+(?:и|а также|плюс|and)\s+")
+_WITH = re.compile(r"(?:^|\s)(?:с|со)\s")
+_INSTRUMENTAL = ("ом", "ем", "ой", "ей", "ами", "ями")
+
+@dataclass(slots=True)
+class FoodItem:
+    name: str
+    serving_g: float
+    kcal_per_100g: float
+
+    @property
+    def kcal_per_serving(self) -> float:
+        return self.kcal_per_100g * self.serving_g / 100
+
+@dataclass(slots=True)
+class Quantity:
+    grams: Optional[float] = None
+    servings: float = 1
+
+@dataclass(slots=True)
+class FoodEstimate:
+    item: FoodItem
+    quantity: Quantity
+    calories: float
+    confidence: float
+
+    @property
+    def explanation(self) -> str:
+        if self.quantity.grams is not None:
+            portion = f"{self.quantity.grams:g} г"
+        else:
+            servings = f"{self.quantity.servings:g} × " if self.quantity.servings != 1 else ""
+            portion = f"{servings}порция {self.item.serving_g:g} г"
+        return f"{self.item.name}, {portion}, {self.item.kcal_per_100g:g} ккал/100 г (локальная база)"
+
+def parse_quantity(text: str) -> tuple[Quantity, str]:
+    """Split a food description into its quantity and the remaining name.
+
+    Understands "200 г", "0.5 кг", "250мл", "2 шт", a bare leading number
+    ("2 яйца") and small number words ("два банана", "половина пиццы").
+    """
+    quantity = Quantity()
+    match = _QUANTITY.search(text)
+    if match:
+        amount = float(match.group("amount").replace(",", "."))
+        unit = match.group("unit")
+        if unit is None or unit.startswith(("шт", "pc")):
+            quantity.servings = amount
+        else:
+            quantity.grams = amount * _GRAMS_PER_UNIT.get(unit, 1)
+        text = text[:match.start()] + " " + text[match.end():]
+    else:
+        words = text.split(" ", 1)
+        if words[0] in _NUMBER_WORDS:
+            quantity.servings = _NUMBER_WORDS[words[0]]
+            text = words[1] if len(words) > 1 else ""
+    return quantity, _SERVING_WORDS.sub("", strip_separators(text))
+
+def split_meal(description: str) -> list[str]:
+    """Split a meal into its items, each keeping its own quantity.
+
+    "2 яйца, тост с маслом и кофе" gives ["2 яйца", "тост с маслом", "кофе"].
+    An "и" continuing a "с ..." phrase ("хлеб с маслом и сыром", "картофель
+    с мясом и с луком") joins the item instead of starting a new one, and so
+    does a chunk that is only an amount ("гречка, 150г").
+    """
+    items = []
+    for chunk in _ITEM_SEPARATORS.split(description.strip()):
+        parts = _CONJUNCTION.split(chunk)
+        current = parts[0]
+        # "гречка, 150г" and "чай, с сахаром" describe the item before the comma
+        if items and items[-1] and (_is_quantity(current) or _WITH.match(current.lower())):
+            current = f"{items.pop()} {current}"
+        for part in parts[1:]:
+            first_word = part.split(" ", 1)[0].lower()
+            if _is_quantity(part):
+                current = f"{current} {part}"
+            elif _WITH.match(part.lower()) or _WITH.search(current) and first_word.endswith(_INSTRUMENTAL):
+                current = f"{current} и {part}"
+            else:
+                items.append(current)
+                current = part
+        items.append(current)
+    return [item for item in (item.strip() for item in items) if item]
+
+def _is_quantity(text: str) -> bool:
+    """A chunk that is only an amount ("150г", "2 шт") and names no food."""
+    return _QUANTITY.fullmatch(text.strip().lower()) is not None
+
+class FoodDatabase:
+    """Bundled nutrition table with a trigram index over names and synonyms."""
+
+    def __init__(self, items: list[FoodItem], aliases: list[tuple[str, int]]):
+        self.items = items
+        self.index = TrigramIndex(aliases)
+
+    @classmethod
+    def from_csv(cls, path: Path = DEFAULT_FOODS_PATH) -> "FoodDatabase":
+        items: list[FoodItem] = []
+        aliases: list[tuple[str, int]] = []
+        with open(path, encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                item = FoodItem(
+                    name=row["name"],
+                    serving_g=float(row["serving_g"]),
+                    kcal_per_100g=float(row["kcal_per_100g"])
+                )
+                items.append(item)
+                names = [row["name"]] + [s for s in row["synonyms"].split("|") if s]
+                aliases.extend((name, len(items) - 1) for name in names)
+        logger.info(f"Loaded {len(items)} foods with {len(aliases)} names from {path}")
+        return cls(items, aliases)
+
+    def search(self, name: str) -> Optional[tuple[FoodItem, float]]:
+        """Return the best matching food and its similarity in [0, 1]."""
+        match = self.index.search(name)
+        if match is None:
+            return None
+        item_index, score = match
+        return self.items[item_index], score
+
+    def estimate(self, description: str) -> Optional[FoodEstimate]:
+        quantity, name = parse_quantity(normalize_text(_PERCENT.sub(" ", description)))
+        match = self.search(name)
+        if match is None:
+            return None
+        item, confidence = match
+        if quantity.grams is not None:
+            calories = item.kcal_per_100g * quantity.grams / 100
+        else:
+            calories = item.kcal_per_serving * quantity.servings
+        return FoodEstimate(item, quantity, round(calories, 1), confidence)
+
+_food_database: Optional[FoodDatabase] = None
+
+def get_food_database() -> FoodDatabase:
+    global _food_database
+    if _food_database is None:
+        _food_database = FoodDatabase.from_csv(Path(config.FOOD_DB_PATH) if config.FOOD_DB_PATH else DEFAULT_FOODS_PATH)
+    return _food_database
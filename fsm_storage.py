@@ -0,0 +1,201 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+@dataclass(slots=True)
+class _Record:
+    state: Optional[str] = None
+    data: dict[str, Any] = field(default_factory=dict)
+    expires_at: float = 0
+
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+class SQLiteStorage(BaseStorage):
+    """aiogram FSM storage persisted to SQLite, replacing MemoryStorage.
+
+    State and data live in a bounded LRU in memory and are written behind in
+    batches, like the profile repository. Every write pushes the record's
+    expiry FSM_TTL_MINUTES into the future; expired records read as empty
+    and are purged from disk periodically, so abandoned profile wizards do
+    not accumulate in memory or in the database.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, cache_size: int, flush_interval: float):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self._records: "OrderedDict[str, _Record]" = OrderedDict()
+        self._dirty: set[str] = set()
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        ))
+
+    def _open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS fsm_expires_at ON fsm (expires_at)")
+        self._db.commit()
+
+    async def _run(self, fn: Callable, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-storage")
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._open)
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def _flush_loop(self):
+        purge_every = max(1, int(60 / self.flush_interval))
+        ticks = 0
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            ticks += 1
+            try:
+                await self.flush()
+                if ticks % purge_every == 0:
+                    purged = await self._run(self._purge_expired, time.time())
+                    if purged:
+                        logger.info(f"Purged {purged} expired FSM records")
+            except Exception as e:
+                logger.error(f"FSM storage flush failed: {str(e)}")
+
+    def _load(self, key: str) -> Optional[tuple[Optional[str], str, float]]:
+        return self._db.execute("SELECT state, data, expires_at FROM fsm WHERE key = ?", (key,)).fetchone()
+
+    def _write(self, upserts: list[tuple[str, Optional[str], str, float]], deletes: list[tuple[str]]):
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO fsm (key, state, data, expires_at) VALUES (?, ?, ?, ?)", upserts
+            )
+            self._db.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+
+    def _purge_expired(self, now: float) -> int:
+        with self._db:
+            return self._db.execute("DELETE FROM fsm WHERE expires_at <= ?", (now,)).rowcount
+
+    def _evict(self):
+        excess = len(self._records) - self.cache_size
+        if excess <= 0:
+            return
+        now = time.time()
+        # Stop at the first clean entries from the least recently used end
+        # instead of copying every key
+        victims = []
+        for key, record in self._records.items():
+            if key in self._dirty and record.expires_at > now:
+                continue
+            victims.append(key)
+            if len(victims) == excess:
+                break
+        for key in victims:
+            del self._records[key]
+            self._dirty.discard(key)
+
+    async def _get_record(self, key: StorageKey) -> _Record:
+        str_key = self._key(key)
+        record = self._records.get(str_key)
+        if record is None:
+            row = await self._run(self._load, str_key)
+            record = self._records.get(str_key)
+            if record is None:
+                record = _Record()
+                if row is not None:
+                    record.state, record.data, record.expires_at = row[0], json.loads(row[1]), row[2]
+                self._evict()
+                self._records[str_key] = record
+        self._records.move_to_end(str_key)
+        if record.expires_at and record.expires_at <= time.time():
+            record.state, record.data, record.expires_at = None, {}, 0
+        return record
+
+    def _touch(self, key: StorageKey, record: _Record):
+        record.expires_at = time.time() + self.ttl_seconds
+        str_key = self._key(key)
+        self._dirty.add(str_key)
+        if len(self._records) > self.cache_size:
+            self._evict()
+            if len(self._records) > self.cache_size and not self._flush_lock.locked():
+                asyncio.get_running_loop().create_task(self.flush())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get_record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get_record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        record = await self._get_record(key)
+        record.data = dict(data)
+        self._touch(key, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return dict((await self._get_record(key)).data)
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            dirty, self._dirty = self._dirty, set()
+            upserts, deletes = [], []
+            for str_key in dirty:
+                record = self._records.get(str_key)
+                if record is None or record.is_empty():
+                    deletes.append((str_key,))
+                else:
+                    upserts.append((str_key, record.state, json.dumps(record.data, ensure_ascii=False), record.expires_at))
+            try:
+                await self._run(self._write, upserts, deletes)
+            except sqlite3.Error as e:
+                self._dirty |= dirty
+                logger.error(f"Failed to flush {len(dirty)} FSM records: {str(e)}")
+                raise
+            # Cleared wizards need no memory once their deletion is on disk
+            for (str_key,) in deletes:
+                record = self._records.get(str_key)
+                if record is not None and record.is_empty() and str_key not in self._dirty:
+                    del self._records[str_key]
+            return len(dirty)
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self._executor is None:
+            return
+        await self.flush()
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        self._db = None
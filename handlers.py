@@ -3,28 +3,30 @@ from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+import asyncio
 import logging
-from datetime import datetime
+from datetime import datetime, time, timedelta
+from typing import Optional
 
-from models import UserProfile, DailyLog, FoodEntry, WorkoutEntry
+from models import UserProfile, DailyLog
 from config import config
 from ai_service import ai_service, AIServiceError
-from weather_service import weather_service, WeatherServiceError
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
+from weather_service import weather_service, WeatherInfo, WeatherServiceError
+from city_index import City
+from storage import repository
+from reminders import reminder_service, parse_quiet_hours, format_clock
 
 logger = logging.getLogger(__name__)
 
 router = Router()
-users: dict[int, UserProfile] = {}
-daily_logs: dict[int, DailyLog] = {}
+
+@router.message.outer_middleware()
+async def pin_user(handler, event: Message, data: dict):
+    """Handlers hold the user's profile and log across awaits; keep them cached until done."""
+    if event.from_user is None:
+        return await handler(event, data)
+    with repository.pinned(event.from_user.id):
+        return await handler(event, data)
 
 def get_main_keyboard(has_profile: bool = False) -> ReplyKeyboardMarkup:
     """Get the main keyboard based on whether user has a profile."""
@@ -47,6 +49,7 @@ AVAILABLE_COMMANDS = {
     "log_water": "💧 Записать выпитую воду",
     "log_food": "🍎 Записать съеденную еду",
     "log_workout": "🏃‍♂️ Записать тренировку",
+    "reminders": "⏰ Напоминания о воде и еде",
     "help": "❓ Показать справку по командам"
 }
 
@@ -57,17 +60,38 @@ class ProfileStates(StatesGroup):
     waiting_for_activity = State()
     waiting_for_city = State()
 
-async def verify_city(city: str) -> bool:
+async def resolve_city(text: str) -> Optional[City]:
     try:
-        await weather_service.get_weather(city)
-        return True
+        return await weather_service.resolve_city(text)
     except WeatherServiceError:
-        return False
+        return None
+
+def touch_user(user: UserProfile):
+    """Record that the user is active.
+
+    last_active only feeds the active-user count and the weather prefetch,
+    so it is moved (and the profile rewritten) at most once per
+    LAST_ACTIVE_RESOLUTION_MINUTES rather than on every command.
+    """
+    now = datetime.now()
+    if now - user.last_active >= timedelta(minutes=config.LAST_ACTIVE_RESOLUTION_MINUTES):
+        user.last_active = now
+        repository.mark_user_dirty(user.user_id)
+
+async def get_user_weather(user: UserProfile) -> WeatherInfo:
+    """Weather in the user's city; profiles saved before city ids get theirs on first use."""
+    if user.city_id is None:
+        city = await weather_service.resolve_city(user.city or "")
+        if city is None:
+            raise WeatherServiceError(f"Unknown city {user.city!r}")
+        user.city, user.city_id = city.name, city.id
+        repository.mark_user_dirty(user.user_id)
+    return await weather_service.get_weather(user.city_id)
 
 @router.message(CommandStart())
 async def cmd_start(message: Message):
     logger.info(f"New user started bot: {message.from_user.id}")
-    has_profile = message.from_user.id in users
+    has_profile = await repository.has_user(message.from_user.id)
     
     await message.answer(
         "👋 Привет! Я бот для отслеживания воды, калорий и активности.\n"
@@ -77,8 +101,8 @@ async def cmd_start(message: Message):
 
 @router.message(Command("help"))
 async def cmd_help(message: Message):
-    logger.info(f"User {message.from_user.id} requested help")
-    has_profile = message.from_user.id in users
+    logger.debug(f"User {message.from_user.id} requested help")
+    has_profile = await repository.has_user(message.from_user.id)
     
     commands_text = "Доступные команды:\n\n" + "\n".join(
         f"/{cmd} - {desc}" for cmd, desc in AVAILABLE_COMMANDS.items()
@@ -107,7 +131,7 @@ async def process_weight(message: Message, state: FSMContext):
         weight = float(message.text)
         if weight <= 0 or weight > 300:
             raise ValueError("Weight out of reasonable range")
-        logger.info(f"User {message.from_user.id} set weight: {weight}kg")
+        logger.debug(f"User {message.from_user.id} set weight: {weight}kg")
         await state.update_data(weight=weight)
         await state.set_state(ProfileStates.waiting_for_height)
         await message.answer("Введите ваш рост (в см):")
@@ -121,7 +145,7 @@ async def process_height(message: Message, state: FSMContext):
         height = float(message.text)
         if height <= 0 or height > 250:
             raise ValueError("Height out of reasonable range")
-        logger.info(f"User {message.from_user.id} set height: {height}cm")
+        logger.debug(f"User {message.from_user.id} set height: {height}cm")
         await state.update_data(height=height)
         await state.set_state(ProfileStates.waiting_for_age)
         await message.answer("Введите ваш возраст:")
@@ -135,7 +159,7 @@ async def process_age(message: Message, state: FSMContext):
         age = int(message.text)
         if age <= 0 or age > 120:
             raise ValueError("Age out of reasonable range")
-        logger.info(f"User {message.from_user.id} set age: {age}")
+        logger.debug(f"User {message.from_user.id} set age: {age}")
         await state.update_data(age=age)
         await state.set_state(ProfileStates.waiting_for_activity)
         await message.answer("Сколько минут активности у вас в день?")
@@ -149,7 +173,7 @@ async def process_activity(message: Message, state: FSMContext):
         activity = int(message.text)
         if activity < 0 or activity > 1440:
             raise ValueError("Activity minutes out of reasonable range")
-        logger.info(f"User {message.from_user.id} set activity: {activity}min/day")
+        logger.debug(f"User {message.from_user.id} set activity: {activity}min/day")
         await state.update_data(activity_minutes=activity)
         await state.set_state(ProfileStates.waiting_for_city)
         await message.answer("В каком городе вы находитесь?")
@@ -159,23 +183,42 @@ async def process_activity(message: Message, state: FSMContext):
 
 @router.message(ProfileStates.waiting_for_city)
 async def process_city(message: Message, state: FSMContext):
-    city = message.text.strip()
-    if not await verify_city(city):
-        logger.warning(f"Invalid city input from user {message.from_user.id}: {city}")
+    city = await resolve_city(message.text)
+    if city is None:
+        logger.warning(f"Invalid city input from user {message.from_user.id}: {message.text.strip()}")
         await message.answer("Не удалось найти такой город. Пожалуйста, проверьте написание и попробуйте еще раз.")
         return
+    try:
+        weather = await weather_service.get_weather(city.id)
+    except WeatherServiceError as e:
+        logger.error(f"Weather service error for user {message.from_user.id}: {str(e)}")
+        weather = None
 
     data = await state.get_data()
-    data["city"] = city
+    data["city"] = city.name
+    data["city_id"] = city.id
     data["user_id"] = message.from_user.id
+    data["utc_offset"] = weather.utc_offset if weather is not None else None
     
-    users[message.from_user.id] = UserProfile(**data)
-    daily_logs[message.from_user.id] = DailyLog(date=datetime.now())
+    user = UserProfile(**data)
+    today = user.local_now().date()
+    repository.save_user(user)
+    reminder_service.ensure(user)
+    repository.save_daily_log(
+        message.from_user.id,
+        DailyLog(date=datetime.combine(today, time()), last_update=user.day_start(today))
+    )
     
-    logger.info(f"User {message.from_user.id} completed profile setup with city: {city}")
+    logger.info(f"User {message.from_user.id} completed profile setup with city: {city.name} ({city.id})")
     
     try:
-        weather = await weather_service.get_weather(city)
+        if weather is None:
+            await message.answer(
+                "✅ Профиль создан, но возникла проблема с получением погоды.\n"
+                "Используйте кнопки меню или команду /help для справки.",
+                reply_markup=get_main_keyboard(True)
+            )
+            return
         await message.answer(
             "✅ Профиль успешно создан!\n\n"
             f"🌡 Текущая погода: {weather.temperature}°C, {weather.description}\n"
@@ -187,30 +230,65 @@ async def process_city(message: Message, state: FSMContext):
             "/log_workout <описание> - записать тренировку\n"
             "/status - посмотреть текущий прогресс\n"
             "/weather - проверить погоду и рекомендации\n"
+            "/reminders on - включить напоминания о воде и еде\n"
             "/help - показать справку по командам",
             reply_markup=get_main_keyboard(True)
         )
-    except WeatherServiceError as e:
-        logger.error(f"Weather service error for user {message.from_user.id}: {str(e)}")
-        await message.answer(
-            "✅ Профиль создан, но возникла проблема с получением погоды.\n"
-            "Используйте кнопки меню или команду /help для справки.",
-            reply_markup=get_main_keyboard(True)
-        )
     finally:
         await state.clear()
 
+@router.message(Command("reminders"))
+async def cmd_reminders(message: Message):
+    user = await handle_protected_command(message)
+    if not user:
+        return
+
+    parts = message.text.split(maxsplit=1)
+    argument = parts[1].strip().lower() if len(parts) > 1 else ""
+    if argument in ("off", "выкл", "выключить"):
+        reminder_service.set_enabled(user, False)
+    elif argument in ("on", "вкл", "включить"):
+        reminder_service.set_enabled(user, True)
+    elif argument:
+        try:
+            start, end = parse_quiet_hours(argument.removeprefix("тихо").strip())
+        except ValueError:
+            await message.answer(
+                "Не понял настройку. Например:\n"
+                "/reminders off - выключить напоминания\n"
+                "/reminders on - включить напоминания\n"
+                "/reminders 23:00-08:00 - тихие часы, когда напоминаний не будет",
+                reply_markup=get_main_keyboard(True)
+            )
+            return
+        reminder_service.set_quiet_hours(user, start, end)
+    logger.debug(f"User {user.user_id} changed reminders: {argument or 'status'}")
+
+    subscription = reminder_service.get(user)
+    water = ", ".join(format_clock(c.minute) for c in reminder_service.checkpoints if c.kind == "water")
+    meals = ", ".join(format_clock(c.minute) for c in reminder_service.checkpoints if c.kind == "meal")
+    await message.answer(
+        f"⏰ Напоминания {'включены' if subscription.enabled else 'выключены'}.\n"
+        f"💧 Вода: {water or '—'}\n"
+        f"🍽 Еда: {meals or '—'}\n"
+        f"🌙 Тихие часы: {format_clock(subscription.quiet_start)}–{format_clock(subscription.quiet_end)}\n\n"
+        "/reminders off - выключить, /reminders on - включить\n"
+        "/reminders 23:00-08:00 - изменить тихие часы",
+        reply_markup=get_main_keyboard(True)
+    )
+
 @router.message(Command("weather"))
 async def cmd_weather(message: Message):
-    if not await handle_protected_command(message):
+    user = await handle_protected_command(message)
+    if not user:
         return
     
     try:
-        weather = await weather_service.get_weather(users[message.from_user.id].city)
+        weather = await get_user_weather(user)
         intensity_factor, intensity_explanation = weather_service.get_workout_adjustment(weather)
         
         await message.answer(
-            f"🌡 Погода в городе {users[message.from_user.id].city}:\n"
+            f"🌡 Погода в городе {user.city}:\n"
             f"  • Температура: {weather.temperature}°C\n"
             f"  • Влажность: {weather.humidity}%\n"
             f"  • Описание: {weather.description}\n\n"
@@ -228,7 +306,8 @@ async def cmd_weather(message: Message):
 
 @router.message(Command("log_water"))
 async def cmd_log_water(message: Message):
-    if not await handle_protected_command(message):
+    user = await handle_protected_command(message)
+    if not user:
         return
         
     try:
@@ -246,24 +325,24 @@ async def cmd_log_water(message: Message):
             raise ValueError("Water amount out of reasonable range")
             
         user_id = message.from_user.id
-        if user_id not in daily_logs:
-            daily_logs[user_id] = DailyLog(date=datetime.now())
+        log = await repository.get_daily_log(user)
         
         try:
-            weather = await weather_service.get_weather(users[user_id].city)
-            daily_logs[user_id].water_intake += amount
-            water_norm = users[user_id].calculate_water_norm(weather.temperature)
+            weather = await get_user_weather(user)
+            log.water_intake += amount
+            repository.mark_log_dirty(user_id)
+            water_norm = user.calculate_water_norm(weather.temperature)
             
             extra_message = ""
             if weather.temperature > 25:
                 extra_message = "\n⚠️ Из-за жаркой погоды рекомендуется пить больше воды!"
             
-            logger.info(f"User {user_id} logged water intake: {amount}ml")
+            logger.debug(f"User {user_id} logged water intake: {amount}ml")
             await message.answer(
                 f"✅ Записано: {amount}мл воды\n"
-                f"💧 Всего за сегодня: {daily_logs[user_id].water_intake}мл\n"
+                f"💧 Всего за сегодня: {log.water_intake}мл\n"
                 f"🎯 Дневная норма: {water_norm}мл\n"
-                f"📊 Прогресс: {daily_logs[user_id].water_intake/water_norm*100:.1f}%"
+                f"📊 Прогресс: {log.water_intake/water_norm*100:.1f}%"
                 f"{extra_message}",
                 reply_markup=get_main_keyboard(True)
             )
@@ -290,36 +369,37 @@ async def cmd_log_food(message: Message):
             raise IndexError("Empty food description")
             
         user_id = message.from_user.id
-        if user_id not in users:
+        user = await repository.get_user(user_id)
+        if user is None:
             await message.answer("Сначала создайте профиль с помощью /set_profile")
             return
-            
-        if user_id not in daily_logs:
-            daily_logs[user_id] = DailyLog(date=datetime.now())
+        touch_user(user)
+        log = await repository.get_daily_log(user)
         
         try:
-            calories, explanation = await ai_service.estimate_food_calories(food_description)
+            items = await ai_service.estimate_meal(food_description)
+            calories = round(sum(item_calories for _, item_calories, _ in items), 1)
             
-            food_entry = FoodEntry(
-                food_name=food_description,
-                calories=calories,
-                timestamp=datetime.now(),
-                explanation=explanation
-            )
-            
-            daily_logs[user_id].calorie_intake += calories
-            daily_logs[user_id].food_log.append(food_entry)
-            daily_logs[user_id].update_bmr_calories(users[user_id])
+            log.calorie_intake += calories
+            log.food_log.add_meal(items, timestamp=datetime.now())
+            repository.mark_log_dirty(user_id)
             
-            logger.info(f"User {user_id} logged food: {food_description} ({calories}kcal)")
+            logger.debug(f"User {user_id} logged food: {food_description} ({calories}kcal, {len(items)} items)")
             
-            calorie_norm = users[user_id].calculate_calorie_norm()
+            if len(items) == 1:
+                details = f"🍎 Калории: {calories}ккал ({items[0][2]})\n"
+            else:
+                details = f"🍎 Калории: {calories}ккал\n" + "".join(
+                    f"  • {name}: {item_calories:g}ккал ({explanation})\n"
+                    for name, item_calories, explanation in items
+                )
+            calorie_norm = user.calculate_calorie_norm()
             await message.answer(
                 f"✅ Записано: {food_description}\n"
-                f"🍎 Калории: {calories}ккал ({explanation})\n"
-                f"📊 Всего калорий за сегодня: {daily_logs[user_id].calorie_intake}ккал\n"
+                f"{details}"
+                f"📊 Всего калорий за сегодня: {log.calorie_intake}ккал\n"
                 f"🎯 Дневная норма: {calorie_norm}ккал\n"
-                f"⚖️ Баланс: {daily_logs[user_id].calculate_calorie_balance():.1f}ккал"
+                f"⚖️ Баланс: {log.calculate_calorie_balance(user):.1f}ккал"
             )
         except AIServiceError as e:
             logger.error(f"AI service error for user {user_id}: {str(e)}")
@@ -339,42 +419,42 @@ async def cmd_log_workout(message: Message):
             raise IndexError("Empty workout description")
         
         user_id = message.from_user.id
-        if user_id not in users:
+        user = await repository.get_user(user_id)
+        if user is None:
             await message.answer("Сначала создайте профиль с помощью /set_profile")
             return
-            
-        if user_id not in daily_logs:
-            daily_logs[user_id] = DailyLog(date=datetime.now())
+        touch_user(user)
+        log = await repository.get_daily_log(user)
         
         try:
-            workout_type, minutes, parse_explanation = await ai_service.parse_workout_description(description)
+            # The weather lookup does not depend on the workout, so run it
+            # alongside the (single) AI round trip
+            analysis, weather = await asyncio.gather(
+                ai_service.analyze_workout(description, user.weight, user.height, user.age),
+                get_user_weather(user)
+            )
+            workout_type, minutes = analysis.workout_type, analysis.minutes
+            parse_explanation, explanation = analysis.parse_explanation, analysis.explanation
             
             if minutes <= 0 or minutes > 480:
                 raise ValueError("Workout duration out of reasonable range")
             
-            weather = await weather_service.get_weather(users[user_id].city)
             intensity_factor, intensity_explanation = weather_service.get_workout_adjustment(weather)
+            adjusted_calories = analysis.calories * intensity_factor
             
-            calories, explanation = await ai_service.estimate_workout_calories(
-                workout_type, minutes, users[user_id].weight
-            )
-            
-            adjusted_calories = calories * intensity_factor
-            
-            workout_entry = WorkoutEntry(
+            log.calorie_burned_exercise += adjusted_calories
+            log.workout_log.add(
                 workout_type=workout_type,
                 minutes=minutes,
                 calories=adjusted_calories,
                 timestamp=datetime.now(),
                 explanation=f"{explanation} ({intensity_explanation})"
             )
+            repository.mark_log_dirty(user_id)
             
-            daily_logs[user_id].calorie_burned_exercise += adjusted_calories
-            daily_logs[user_id].workout_log.append(workout_entry)
-            daily_logs[user_id].update_bmr_calories(users[user_id])
-            
-            logger.info(f"User {user_id} logged workout: {workout_type} for {minutes}min ({adjusted_calories}kcal)")
+            logger.debug(f"User {user_id} logged workout: {workout_type} for {minutes}min ({adjusted_calories}kcal)")
             
+            bmr_burned = log.bmr_burned(user)
             outdoor_warning = "" if weather.is_outdoor_friendly else "\n⚠️ Погода не благоприятна для тренировок на улице!"
             duration_note = f" ({parse_explanation})" if "Примерная оценка" in parse_explanation else ""
             
@@ -383,9 +463,9 @@ async def cmd_log_workout(message: Message):
                 f"🌡 {intensity_explanation}\n"
                 f"🔥 Сожжено калорий: {adjusted_calories:.1f}ккал ({explanation})\n"
                 f"💪 Всего сожжено за сегодня:\n"
-                f"  • Тренировки: {daily_logs[user_id].calorie_burned_exercise:.1f}ккал\n"
-                f"  • Базовый обмен: {daily_logs[user_id].calorie_burned_bmr:.1f}ккал\n"
-                f"  • Всего: {daily_logs[user_id].calculate_calorie_burned():.1f}ккал"
+                f"  • Тренировки: {log.calorie_burned_exercise:.1f}ккал\n"
+                f"  • Базовый обмен: {bmr_burned:.1f}ккал\n"
+                f"  • Всего: {log.calorie_burned_exercise + bmr_burned:.1f}ккал"
                 f"{outdoor_warning}"
             )
         except (AIServiceError, WeatherServiceError) as e:
@@ -409,23 +489,21 @@ async def cmd_log_workout(message: Message):
 
 @router.message(Command("status"))
 async def cmd_status(message: Message):
-    if not await handle_protected_command(message):
+    user = await handle_protected_command(message)
+    if not user:
         return
         
     user_id = message.from_user.id
-    if user_id not in daily_logs:
-        daily_logs[user_id] = DailyLog(date=datetime.now())
-    
-    user = users[user_id]
-    log = daily_logs[user_id]
-    log.update_bmr_calories(user)
+    log = await repository.get_daily_log(user)
+    bmr_burned = log.bmr_burned(user)
+    calorie_burned = log.calorie_burned_exercise + bmr_burned
     
     try:
-        weather = await weather_service.get_weather(user.city)
+        weather = await get_user_weather(user)
         water_norm = user.calculate_water_norm(weather.temperature)
         calorie_norm = user.calculate_calorie_norm()
         
-        logger.info(f"User {user_id} requested status")
+        logger.debug(f"User {user_id} requested status")
         
         weather_advice = ""
         if weather.temperature > 25:
@@ -440,9 +518,9 @@ async def cmd_status(message: Message):
             f"🍎 Потребление калорий: {log.calorie_intake}ккал\n"
             f"🔥 Расход калорий:\n"
             f"  • Тренировки: {log.calorie_burned_exercise:.1f}ккал\n"
-            f"  • Базовый обмен: {log.calorie_burned_bmr:.1f}ккал\n"
-            f"  • Всего: {log.calculate_calorie_burned():.1f}ккал\n"
-            f"⚖️ Баланс калорий: {log.calculate_calorie_balance():.1f}ккал\n"
+            f"  • Базовый обмен: {bmr_burned:.1f}ккал\n"
+            f"  • Всего: {calorie_burned:.1f}ккал\n"
+            f"⚖️ Баланс калорий: {log.calorie_intake - calorie_burned:.1f}ккал\n"
             f"🌡 Погода: {weather.temperature}°C, {weather.description}"
             f"{weather_advice}",
             reply_markup=get_main_keyboard(True)
@@ -454,29 +532,32 @@ async def cmd_status(message: Message):
             f"🍎 Потребление калорий: {log.calorie_intake}ккал\n"
             f"🔥 Расход калорий:\n"
             f"  • Тренировки: {log.calorie_burned_exercise:.1f}ккал\n"
-            f"  • Базовый обмен: {log.calorie_burned_bmr:.1f}ккал\n"
-            f"  • Всего: {log.calculate_calorie_burned():.1f}ккал\n"
+            f"  • Базовый обмен: {bmr_burned:.1f}ккал\n"
+            f"  • Всего: {calorie_burned:.1f}ккал\n"
             f"⚠️ Не удалось получить информацию о погоде",
             reply_markup=get_main_keyboard(True)
         )
 
 @router.message(Command(commands=["status", "weather", "log_water", "log_food", "log_workout"]))
-async def handle_protected_command(message: Message):
-    """Handle commands that require a profile."""
-    if message.from_user.id not in users:
+async def handle_protected_command(message: Message) -> Optional[UserProfile]:
+    """Handle commands that require a profile. Returns the profile if it exists."""
+    user = await repository.get_user(message.from_user.id)
+    if user is None:
         await message.answer(
             "⚠️ Сначала создайте профиль с помощью /set_profile",
             reply_markup=get_main_keyboard(False)
         )
-        return False
-    return True
+        return None
+    touch_user(user)
+    reminder_service.ensure(user)
+    return user
 
 @router.message(F.text.startswith('/'))
 async def handle_unknown_command(message: Message):
     """Handle unknown commands."""
     command = message.text.split()[0][1:]
     if command not in AVAILABLE_COMMANDS:
-        has_profile = message.from_user.id in users
+        has_profile = await repository.has_user(message.from_user.id)
         logger.warning(f"User {message.from_user.id} tried unknown command: {command}")
         await message.answer(
             f"❌ Неизвестная команда: /{command}\n"
@@ -0,0 +1,91 @@
+from array import array
+from datetime import date
+from typing import Optional
+
+METRICS = ("water_intake", "calorie_intake", "calorie_burned_exercise", "calorie_burned_bmr")
+
+_EPOCH = date(1970, 1, 1).toordinal()
+
+def day_number(day: date) -> int:
+    return day.toordinal() - _EPOCH
+
+class DailyHistory:
+    """Archived daily totals for one user, stored column by column.
+
+    Each metric is a contiguous array of doubles indexed by day offset from
+    start_day, plus a byte mask marking the days that were actually logged,
+    so reading one day is O(1) and a date range is a slice that can be
+    summed or averaged without touching per-day objects.
+    """
+
+    __slots__ = ("start_day", "columns", "logged")
+
+    def __init__(self, start_day: Optional[int] = None):
+        self.start_day = start_day
+        self.columns: dict[str, array] = {metric: array("d") for metric in METRICS}
+        self.logged = array("B")
+
+    def __len__(self) -> int:
+        return len(self.logged)
+
+    def _index(self, day: date) -> Optional[int]:
+        if self.start_day is None:
+            return None
+        index = day_number(day) - self.start_day
+        return index if 0 <= index < len(self.logged) else None
+
+    def set_day(self, day: date, totals: dict[str, float]):
+        number = day_number(day)
+        if self.start_day is None:
+            self.start_day = number
+        elif number < self.start_day:
+            # Prepend empty days so the new day fits at index 0
+            gap = self.start_day - number
+            for metric in METRICS:
+                self.columns[metric] = array("d", bytes(8 * gap)) + self.columns[metric]
+            self.logged = array("B", bytes(gap)) + self.logged
+            self.start_day = number
+        index = number - self.start_day
+        if index >= len(self.logged):
+            gap = index + 1 - len(self.logged)
+            for metric in METRICS:
+                self.columns[metric].frombytes(bytes(8 * gap))
+            self.logged.frombytes(bytes(gap))
+        for metric in METRICS:
+            self.columns[metric][index] = float(totals.get(metric, 0))
+        self.logged[index] = 1
+
+    def get_day(self, day: date) -> Optional[dict[str, float]]:
+        index = self._index(day)
+        if index is None or not self.logged[index]:
+            return None
+        return {metric: self.columns[metric][index] for metric in METRICS}
+
+    def _bounds(self, start: date, end: date) -> tuple[int, int]:
+        if self.start_day is None:
+            return 0, 0
+        lo = max(0, day_number(start) - self.start_day)
+        hi = min(len(self.logged), day_number(end) - self.start_day + 1)
+        return lo, max(lo, hi)
+
+    def range(self, start: date, end: date) -> dict[str, array]:
+        """Per-metric slices for the inclusive date range (unlogged days are 0)."""
+        lo, hi = self._bounds(start, end)
+        return {metric: self.columns[metric][lo:hi] for metric in METRICS}
+
+    def totals(self, start: date, end: date) -> dict[str, float]:
+        lo, hi = self._bounds(start, end)
+        result = {metric: sum(self.columns[metric][lo:hi]) for metric in METRICS}
+        result["days_logged"] = sum(self.logged[lo:hi])
+        return result
+
+    def to_row(self) -> tuple:
+        return (self.start_day, self.logged.tobytes(), *(self.columns[metric].tobytes() for metric in METRICS))
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "DailyHistory":
+        history = cls(row[0])
+        history.logged.frombytes(row[1])
+        for metric, blob in zip(METRICS, row[2:]):
+            history.columns[metric].frombytes(blob)
+        return history
@@ -0,0 +1,94 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+from ai_cache import ai_cache
+from ai_service import ai_service
+from config import config
+from handlers import AVAILABLE_COMMANDS
+from log_setup import current_command, current_user_id
+from metrics import (
+    HANDLER_SECONDS, HANDLER_ERRORS, AI_CACHE, AI_IN_FLIGHT, WEATHER_CACHE, ACTIVE_USERS,
+    RATE_LIMITED, AI_QUEUE_WAITING, AI_QUEUE_ADMISSIONS, AI_QUEUE_WAIT, REMINDERS_SCHEDULED, REMINDERS
+)
+from reminders import reminder_service
+from scheduler import RateLimiter, command_of
+from storage import repository
+from weather_service import WeatherService
+
+logger = logging.getLogger(__name__)
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Time every message handler, labelled by command.
+
+    Known commands get their own pre-bound children; anything else is
+    "unknown", and plain text (profile wizard answers) is "text". The user
+    and command are also put in the logging context. Each message gets a
+    structured line with the latency, at DEBUG (so it is sampled) unless the
+    handler took longer than LOG_SLOW_HANDLER_SECONDS.
+    """
+
+    def __init__(self):
+        labels = [*AVAILABLE_COMMANDS, "unknown", "text"]
+        self._latency = {label: HANDLER_SECONDS.labels(label) for label in labels}
+        self._errors = {label: HANDLER_ERRORS.labels(label) for label in labels}
+
+    def _label(self, text: str) -> str:
+        command = command_of(text)
+        if command is None:
+            return "text"
+        return command if command in self._latency else "unknown"
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: dict[str, Any]
+    ) -> Any:
+        label = self._label(event.text or "")
+        user_token = current_user_id.set(event.from_user.id if event.from_user else None)
+        command_token = current_command.set(label)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self._errors[label].inc()
+            logger.exception("Handler failed")
+            raise
+        finally:
+            latency = time.perf_counter() - started
+            self._latency[label].observe(latency)
+            level = logging.WARNING if latency >= config.LOG_SLOW_HANDLER_SECONDS else logging.DEBUG
+            logger.log(level, "Handled message", extra={"latency_ms": round(latency * 1000, 2)})
+            current_user_id.reset(user_token)
+            current_command.reset(command_token)
+
+def active_users() -> int:
+    since = datetime.now() - timedelta(minutes=config.ACTIVE_USER_MINUTES)
+    return sum(1 for user in repository.cached_users() if user.last_active >= since)
+
+def register_collectors(rate_limiter: Optional[RateLimiter] = None):
+    """Expose counters the services already keep, read at scrape time."""
+    AI_IN_FLIGHT.bind(lambda: ai_service.in_flight)
+    AI_QUEUE_WAITING.bind(lambda: ai_service.scheduler.waiting)
+    AI_QUEUE_ADMISSIONS.bind(lambda: ai_service.scheduler.stats.immediate, "immediate")
+    AI_QUEUE_ADMISSIONS.bind(lambda: ai_service.scheduler.stats.queued, "queued")
+    AI_QUEUE_WAIT.bind(lambda: ai_service.scheduler.stats.wait_seconds)
+    if rate_limiter is not None:
+        RATE_LIMITED.bind(lambda: rate_limiter.stats.rejected)
+    AI_CACHE.bind(lambda: ai_cache.stats.memory_hits, "memory_hit")
+    AI_CACHE.bind(lambda: ai_cache.stats.disk_hits, "disk_hit")
+    AI_CACHE.bind(lambda: ai_cache.stats.misses, "miss")
+    WEATHER_CACHE.bind(lambda: WeatherService.stats.hits, "hit")
+    WEATHER_CACHE.bind(lambda: WeatherService.stats.stale, "stale")
+    WEATHER_CACHE.bind(lambda: WeatherService.stats.misses, "miss")
+    ACTIVE_USERS.bind(active_users)
+    REMINDERS_SCHEDULED.bind(lambda: len(reminder_service.wheel))
+    REMINDERS.bind(lambda: reminder_service.stats.sent, "sent")
+    REMINDERS.bind(lambda: reminder_service.stats.skipped_quiet, "quiet_hours")
+    REMINDERS.bind(lambda: reminder_service.stats.skipped_on_track, "on_track")
+    REMINDERS.bind(lambda: reminder_service.stats.send_errors, "send_error")
@@ -0,0 +1,167 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+from config import config
+
+# Set by the handler middleware for the duration of one update, so every
+# record logged while handling it carries the user and command
+current_user_id: ContextVar[Optional[int]] = ContextVar("current_user_id", default=None)
+current_command: ContextVar[Optional[str]] = ContextVar("current_command", default=None)
+
+_STANDARD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any extra fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class ContextFilter(logging.Filter):
+    """Attach the current user id and command to every record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "user_id"):
+            record.user_id = current_user_id.get()
+        if not hasattr(record, "command"):
+            record.command = current_command.get()
+        return True
+
+class DebugSampler(logging.Filter):
+    """Let through only a fraction of DEBUG records; other levels always pass."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+class DroppingQueueHandler(QueueHandler):
+    """Hand records to the writer thread without ever blocking the caller.
+
+    When the queue is full (the disk is stalled) records are dropped and
+    counted; the count is logged once the writer catches up.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge args and render the traceback here; JSON formatting
+        # happens on the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            notice = logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                       f"Dropped {dropped} log records while the log queue was full", None, None)
+            try:
+                self.queue.put_nowait(notice)
+            except queue.Full:
+                self.dropped += dropped
+
+class SizeAndTimeRotatingFileHandler(RotatingFileHandler):
+    """Rotate when the file exceeds max_bytes or every interval seconds, whichever comes first."""
+
+    def __init__(self, filename: str, max_bytes: int, interval: float, backup_count: int):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.interval and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.interval
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # Block on shutdown so the stop marker is never lost on a full queue
+        self.queue.put(self._sentinel)
+
+_listener: Optional[QueueListener] = None
+
+def setup_logging(path: Optional[str] = None):
+    """Route all logging through a bounded queue to a background writer thread."""
+    global _listener
+    if _listener is not None:
+        return
+
+    file_handler = SizeAndTimeRotatingFileHandler(
+        path or config.LOG_PATH,
+        config.LOG_MAX_BYTES,
+        config.LOG_ROTATE_HOURS * 3600,
+        config.LOG_BACKUP_COUNT
+    )
+    file_handler.setFormatter(JsonFormatter())
+    handlers = [file_handler]
+    if config.LOG_CONSOLE:
+        console = logging.StreamHandler(sys.stderr)
+        console.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        handlers.append(console)
+
+    log_queue = queue.Queue(config.LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(DebugSampler(config.LOG_DEBUG_SAMPLE_RATE))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(config.LOG_LEVEL)
+    # aiogram logs every update at INFO; the handler middleware logs them with more context
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    _listener = _Listener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def log_path_for_shard(shard: Optional[int]) -> str:
+    if shard is None:
+        return config.LOG_PATH
+    root, ext = os.path.splitext(config.LOG_PATH)
+    return f"{root}.shard{shard}{ext}"
@@ -0,0 +1,288 @@
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _label_string(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class _Metric:
+    """A metric family. Children are bound once per label set via labels().
+
+    Label strings are rendered at bind time, so updating a bound child is
+    just an attribute increment with no per-call allocation.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+
+    def _new_child(self, labels: str):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child(_label_string(self.labelnames, values))
+        return child
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for child in self._children.values():
+            lines.extend(child.render(self.name))
+        return lines
+
+class _Value:
+    __slots__ = ("labels", "value")
+
+    def __init__(self, labels: str):
+        self.labels = labels
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def render(self, name: str) -> list[str]:
+        return [f"{name}{self.labels} {_format(self.value)}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self, labels: str) -> _Value:
+        return _Value(labels)
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self, labels: str) -> _Value:
+        return _Value(labels)
+
+class _Observed:
+    __slots__ = ("labels", "read")
+
+    def __init__(self, labels: str, read: Callable[[], float]):
+        self.labels = labels
+        self.read = read
+
+    def render(self, name: str) -> list[str]:
+        try:
+            return [f"{name}{self.labels} {_format(self.read())}"]
+        except Exception as e:
+            logger.warning(f"Failed to collect metric {name}: {str(e)}")
+            return []
+
+class CallbackMetric(_Metric):
+    """Counter or gauge whose value is read from existing state at scrape time."""
+
+    def __init__(self, name: str, help: str, kind: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+
+    def bind(self, read: Callable[[], float], *values: str):
+        self._children[values] = _Observed(_label_string(self.labelnames, values), read)
+
+class _HistogramChild:
+    __slots__ = ("labels", "bounds", "counts", "sum")
+
+    def __init__(self, labels: str, bounds: tuple[float, ...]):
+        self.labels = labels
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def render(self, name: str) -> list[str]:
+        inner = self.labels[1:-1]
+        sep = "," if inner else ""
+        lines = []
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{inner}{sep}le="{_format(bound)}"}} {total}')
+        total += self.counts[-1]
+        lines.append(f'{name}_bucket{{{inner}{sep}le="+Inf"}} {total}')
+        lines.append(f"{name}_sum{self.labels} {_format(self.sum)}")
+        lines.append(f"{name}_count{self.labels} {total}")
+        return lines
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self, labels: str) -> _HistogramChild:
+        return _HistogramChild(labels, self.buckets)
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+def timed(latency: _HistogramChild, errors: _Value, error_types: tuple = (Exception,)):
+    """Wrap a coroutine function to record its latency and failures in bound children."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except error_types:
+                errors.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+# Handlers
+HANDLER_SECONDS = registry.register(Histogram(
+    "fitness_handler_seconds", "Time spent handling a message, by command", ["command"]))
+HANDLER_ERRORS = registry.register(Counter(
+    "fitness_handler_errors_total", "Messages whose handler raised, by command", ["command"]))
+
+# AI
+AI_REQUEST_SECONDS = registry.register(Histogram(
+    "fitness_ai_request_seconds", "DeepSeek completion latency, including the concurrency queue",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32)))
+AI_REQUEST_ERRORS = registry.register(Counter("fitness_ai_request_errors_total", "Failed DeepSeek completions"))
+AI_RETRIES = registry.register(Counter("fitness_ai_retries_total", "Completions re-requested after an unusable answer"))
+AI_CACHE = registry.register(CallbackMetric(
+    "fitness_ai_cache_lookups_total", "AI estimate cache lookups by result", "counter", ["result"]))
+AI_IN_FLIGHT = registry.register(CallbackMetric(
+    "fitness_ai_in_flight", "DeepSeek completions currently in progress", "gauge"))
+
+# Scheduling
+RATE_LIMITED = registry.register(CallbackMetric(
+    "fitness_rate_limited_total", "AI-backed commands refused by the per-user rate limit", "counter"))
+AI_QUEUE_WAITING = registry.register(CallbackMetric(
+    "fitness_ai_queue_waiting", "DeepSeek completions waiting for a fair-queue slot", "gauge"))
+AI_QUEUE_ADMISSIONS = registry.register(CallbackMetric(
+    "fitness_ai_queue_admissions_total", "DeepSeek completions by whether they had to queue", "counter", ["result"]))
+AI_QUEUE_WAIT = registry.register(CallbackMetric(
+    "fitness_ai_queue_wait_seconds_total", "Total time completions spent waiting in the fair queue", "counter"))
+
+# Weather
+WEATHER_SECONDS = registry.register(Histogram(
+    "fitness_weather_seconds", "get_weather latency, cache hits included"))
+WEATHER_ERRORS = registry.register(Counter("fitness_weather_errors_total", "get_weather calls that failed"))
+WEATHER_CACHE = registry.register(CallbackMetric(
+    "fitness_weather_cache_lookups_total", "Weather cache lookups by result", "counter", ["result"]))
+
+# Reminders
+REMINDERS_SCHEDULED = registry.register(CallbackMetric(
+    "fitness_reminders_scheduled", "Reminders on the timing wheel", "gauge"))
+REMINDERS = registry.register(CallbackMetric(
+    "fitness_reminders_total", "Due reminders by outcome", "counter", ["result"]))
+
+# Snapshots
+WARMUP_SECONDS = registry.register(Gauge("fitness_warmup_seconds", "Time spent restoring the startup snapshot"))
+SNAPSHOT_SECONDS = registry.register(Gauge("fitness_snapshot_seconds", "Duration of the latest snapshot write"))
+SNAPSHOT_BYTES = registry.register(Gauge("fitness_snapshot_bytes", "Size of the latest snapshot file"))
+
+# Runtime
+ACTIVE_USERS = registry.register(CallbackMetric(
+    "fitness_active_users", "Users active within ACTIVE_USER_MINUTES", "gauge"))
+LOOP_LAG = registry.register(Gauge("fitness_event_loop_lag_seconds", "Latest event-loop scheduling delay"))
+LOOP_LAG_SECONDS = registry.register(Histogram(
+    "fitness_event_loop_delay_seconds", "Distribution of event-loop scheduling delays",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)))
+
+class LoopLagMonitor:
+    """Measure how late a periodic timer fires, i.e. how long the loop was blocked."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._gauge = LOOP_LAG.labels()
+        self._histogram = LOOP_LAG_SECONDS.labels()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self._gauge.set(lag)
+            self._histogram.observe(lag)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+class MetricsServer:
+    """Serve the registry in Prometheus text format on /metrics."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=registry.render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -1,6 +1,9 @@
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List
-from pydantic import BaseModel
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from typing import ClassVar, Optional
+from pydantic import BaseModel, Field, PrivateAttr
+
+from entry_log import FoodLog, WorkoutLog
 
 class UserProfile(BaseModel):
     user_id: int
@@ -8,45 +11,85 @@ class UserProfile(BaseModel):
     height: Optional[float] = None
     age: Optional[int] = None
     activity_minutes: Optional[int] = None
-    city: Optional[str] = None
+    city: Optional[str] = None  # display name
+    city_id: Optional[int] = None  # canonical id the weather is cached under, see WeatherService.resolve_city
     custom_calorie_goal: Optional[int] = None
     last_update: datetime = datetime.now()
+    last_active: datetime = Field(default_factory=datetime.now)
+    utc_offset: Optional[int] = None  # seconds east of UTC, from the city's weather data
+
+    _derived: Optional["DerivedValues"] = PrivateAttr(default=None)
+
+    def local_now(self) -> datetime:
+        """Current wall-clock time in the user's city (server time if unknown)."""
+        if self.utc_offset is None:
+            return datetime.now()
+        return datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=self.utc_offset)
+
+    def day_start(self, day: date) -> datetime:
+        """Server-local moment at which the given day starts for the user."""
+        midnight = datetime.combine(day, time())
+        if self.utc_offset is None:
+            return midnight
+        utc_midnight = (midnight - timedelta(seconds=self.utc_offset)).replace(tzinfo=timezone.utc)
+        return utc_midnight.astimezone().replace(tzinfo=None)
     
+    def __setattr__(self, name: str, value):
+        super().__setattr__(name, value)
+        if name in _DERIVED_FROM:
+            self._derived = None
+
+    @property
+    def derived(self) -> "DerivedValues":
+        """Norms that depend only on the profile, computed once per profile change."""
+        if self._derived is None:
+            self._derived = DerivedValues.from_profile(self)
+        return self._derived
+
     def calculate_water_norm(self, temperature: float) -> float:
-        if not self.weight:
-            return 0
-        
-        base_norm = self.weight * 30
-        activity_addition = (self.activity_minutes or 0) // 30 * 500
-        temp_addition = 500 if temperature > 25 else 0
-        
-        return base_norm + activity_addition + temp_addition
+        return self.derived.water_norm(temperature)
 
     def calculate_calorie_norm(self) -> float:
-        if not all([self.weight, self.height, self.age]):
-            return 0
-        
-        if self.custom_calorie_goal:
-            return self.custom_calorie_goal
-            
-        bmr = 10 * self.weight + 6.25 * self.height - 5 * self.age
-
-        activity_calories = (self.activity_minutes or 0) * 7
-        
-        return bmr + activity_calories
+        return self.derived.calorie_norm
 
     def calculate_bmr_per_minute(self) -> float:
-        if not all([self.weight, self.height, self.age]):
-            return 0
-        
-        daily_bmr = 10 * self.weight + 6.25 * self.height - 5 * self.age
-        return daily_bmr / 1440
+        return self.derived.bmr_per_minute
+
+_DERIVED_FROM = frozenset({"weight", "height", "age", "activity_minutes", "custom_calorie_goal"})
+
+@dataclass(slots=True, frozen=True)
+class DerivedValues:
+    bmr_per_minute: float
+    calorie_norm: float
+    water_norm_base: float
+    water_norm_hot: float
+
+    HOT_TEMPERATURE: ClassVar[float] = 25
+
+    @classmethod
+    def from_profile(cls, user: UserProfile) -> "DerivedValues":
+        if all([user.weight, user.height, user.age]):
+            daily_bmr = 10 * user.weight + 6.25 * user.height - 5 * user.age
+            bmr_per_minute = daily_bmr / 1440
+            calorie_norm = user.custom_calorie_goal or daily_bmr + (user.activity_minutes or 0) * 7
+        else:
+            bmr_per_minute = calorie_norm = 0
+        if user.weight:
+            water_norm_base = user.weight * 30 + (user.activity_minutes or 0) // 30 * 500
+            water_norm_hot = water_norm_base + 500
+        else:
+            water_norm_base = water_norm_hot = 0
+        return cls(bmr_per_minute, calorie_norm, water_norm_base, water_norm_hot)
+
+    def water_norm(self, temperature: float) -> float:
+        return self.water_norm_hot if temperature > self.HOT_TEMPERATURE else self.water_norm_base
 
 class FoodEntry(BaseModel):
     food_name: str
     calories: float
     timestamp: datetime
     explanation: str
+    meal: Optional[int] = None
 
 class WorkoutEntry(BaseModel):
     workout_type: str
@@ -55,117 +98,30 @@ class WorkoutEntry(BaseModel):
     timestamp: datetime
     explanation: str
 
+FoodLog.model = FoodEntry
+WorkoutLog.model = WorkoutEntry
+
 class DailyLog(BaseModel):
     date: datetime
     water_intake: float = 0
     calorie_intake: float = 0
     calorie_burned_exercise: float = 0
     calorie_burned_bmr: float = 0
-    food_log: List[FoodEntry] = []
-    workout_log: List[WorkoutEntry] = []
-    last_update: datetime = datetime.now()
+    food_log: FoodLog = Field(default_factory=FoodLog)
+    workout_log: WorkoutLog = Field(default_factory=WorkoutLog)
+    last_update: datetime = Field(default_factory=datetime.now)
     
-    def update_bmr_calories(self, user: UserProfile):
-        now = datetime.now()
-        minutes_passed = (now - self.last_update).total_seconds() / 60
-        self.calorie_burned_bmr += user.calculate_bmr_per_minute() * minutes_passed
-        self.last_update = now
-
-    def calculate_calorie_burned(self) -> float:
-        return self.calorie_burned_exercise + self.calorie_burned_bmr
-
-    def calculate_calorie_balance(self) -> float:
-        return self.calorie_intake - self.calculate_calorie_burned()
-
-    def calculate_water_balance(self) -> float:
-        return self.water_intake - self.calculate_water_norm()
-
-    def calculate_water_norm(self) -> float:
-        if not self.weight:
-            return 0
-        
-        base_norm = self.weight * 30
-        activity_addition = (self.activity_minutes or 0) // 30 * 500
-        temp_addition = 500 if self.temperature > 25 else 0
-        
-        return base_norm + activity_addition + temp_addition
+    def bmr_burned(self, user: UserProfile, now: Optional[datetime] = None) -> float:
+        """BMR calories burned so far today, in closed form from last_update.
 
-    def calculate_calorie_norm(self) -> float:
-        if not all([self.weight, self.height, self.age]):
-            return 0
-        
-        if self.custom_calorie_goal:
-            return self.custom_calorie_goal
-            
-        bmr = 10 * self.weight + 6.25 * self.height - 5 * self.age
-        
-        activity_calories = (self.activity_minutes or 0) * 7
-        
-        return bmr + activity_calories
+        calorie_burned_bmr holds what was accrued up to last_update (the day
+        start for fresh logs), so reading never mutates the log.
+        """
+        minutes_passed = max(0.0, ((now or datetime.now()) - self.last_update).total_seconds() / 60)
+        return self.calorie_burned_bmr + user.derived.bmr_per_minute * minutes_passed
 
-    def calculate_bmr_per_minute(self) -> float:
-        if not all([self.weight, self.height, self.age]):
-            return 0
-        
-        daily_bmr = 10 * self.weight + 6.25 * self.height - 5 * self.age
-        return daily_bmr / 1440
-
-    def update_bmr_calories(self, user: UserProfile):
-        now = datetime.now()
-        minutes_passed = (now - self.last_update).total_seconds() / 60
-        self.calorie_burned_bmr += user.calculate_bmr_per_minute() * minutes_passed
-        self.last_update = now
-
-    def calculate_calorie_burned(self) -> float:
-        return self.calorie_burned_exercise + self.calorie_burned_bmr
-
-    def calculate_calorie_balance(self) -> float:
-        return self.calorie_intake - self.calculate_calorie_burned()
-
-    def calculate_water_balance(self) -> float:
-        return self.water_intake - self.calculate_water_norm()
-
-    def calculate_water_norm(self) -> float:
-        if not self.weight:
-            return 0
-        
-        base_norm = self.weight * 30
-        activity_addition = (self.activity_minutes or 0) // 30 * 500
-        temp_addition = 500 if self.temperature > 25 else 0
-        
-        return base_norm + activity_addition + temp_addition
-
-    def calculate_calorie_norm(self) -> float:
-        if not all([self.weight, self.height, self.age]):
-            return 0
-        
-        if self.custom_calorie_goal:
-            return self.custom_calorie_goal
-
-        bmr = 10 * self.weight + 6.25 * self.height - 5 * self.age
-        
-        activity_calories = (self.activity_minutes or 0) * 7
-        
-        return bmr + activity_calories
+    def calculate_calorie_burned(self, user: UserProfile, now: Optional[datetime] = None) -> float:
+        return self.calorie_burned_exercise + self.bmr_burned(user, now)
 
-    def calculate_bmr_per_minute(self) -> float:
-        if not all([self.weight, self.height, self.age]):
-            return 0
-        
-        daily_bmr = 10 * self.weight + 6.25 * self.height - 5 * self.age
-        return daily_bmr / 1440
-
-    def update_bmr_calories(self, user: UserProfile):
-        now = datetime.now()
-        minutes_passed = (now - self.last_update).total_seconds() / 60
-        self.calorie_burned_bmr += user.calculate_bmr_per_minute() * minutes_passed
-        self.last_update = now
-
-    def calculate_calorie_burned(self) -> float:
-        return self.calorie_burned_exercise + self.calorie_burned_bmr
-
-    def calculate_calorie_balance(self) -> float:
-        return self.calorie_intake - self.calculate_calorie_burned()
-
-    def calculate_water_balance(self) -> float:
-        return self.water_intake - self.calculate_water_norm() 
\ No newline at end of file
+    def calculate_calorie_balance(self, user: UserProfile, now: Optional[datetime] = None) -> float:
+        return self.calorie_intake - self.calculate_calorie_burned(user, now)
@@ -0,0 +1,492 @@
+import asyncio
+import logging
+import math
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramRetryAfter
+
+from config import config
+from models import UserProfile, DailyLog
+from scheduler import TokenBucket
+from storage import StorageError, repository
+from weather_service import WeatherService
+
+logger = logging.getLogger(__name__)
+
+DAY_MINUTES = 1440
+# Rows are reread this long after their change time, so a slow commit by
+# another process with an earlier timestamp is not missed
+SYNC_OVERLAP = 30.0
+# Water norm assumed when the city's weather is not cached
+DEFAULT_TEMPERATURE = 20.0
+
+def parse_clock(text: str) -> int:
+    """Minute of the day from "HH:MM"."""
+    hours, minutes = text.strip().split(":")
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"Invalid time: {text}")
+    return hours * 60 + minutes
+
+def parse_quiet_hours(text: str) -> tuple[int, int]:
+    """Quiet hours from "23:00-08:00" as start and end minutes of the day."""
+    start, end = text.replace("–", "-").split("-")
+    return parse_clock(start), parse_clock(end)
+
+def format_clock(minute: int) -> str:
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+@dataclass(slots=True, frozen=True)
+class Checkpoint:
+    kind: str  # "water" or "meal"
+    minute: int
+
+def checkpoints_from_config() -> list[Checkpoint]:
+    checkpoints = [
+        Checkpoint(kind, parse_clock(clock))
+        for kind, times in (("water", config.REMINDER_WATER_TIMES), ("meal", config.REMINDER_MEAL_TIMES))
+        for clock in times.split(",") if clock.strip()
+    ]
+    return sorted(checkpoints, key=lambda checkpoint: checkpoint.minute)
+
+@dataclass(slots=True)
+class Subscription:
+    enabled: bool
+    utc_offset: Optional[int]
+    quiet_start: int
+    quiet_end: int
+
+    def is_quiet(self, minute: int) -> bool:
+        if self.quiet_start <= self.quiet_end:
+            return self.quiet_start <= minute < self.quiet_end
+        return minute >= self.quiet_start or minute < self.quiet_end
+
+    def awake_fraction(self, minute: int) -> float:
+        """Share of the waking day (quiet end to quiet start) elapsed by the minute."""
+        length = (self.quiet_start - self.quiet_end) % DAY_MINUTES or DAY_MINUTES
+        return min(1.0, ((minute - self.quiet_end) % DAY_MINUTES) / length)
+
+    def offset(self) -> int:
+        if self.utc_offset is not None:
+            return self.utc_offset
+        return time.localtime().tm_gmtoff
+
+    def next_time(self, minute: int, now: float) -> float:
+        """Unix time of the next occurrence of the local minute of the day after now."""
+        offset = self.offset()
+        local_now = now + offset
+        due = local_now - local_now % 86400 + minute * 60
+        if due <= local_now:
+            due += 86400
+        return due - offset
+
+class TimingWheel:
+    """Hashed timing wheel: O(1) schedule and cancel, work per tick proportional to what is due.
+
+    Time is cut into ticks of `tick` seconds and tick n lives in slot
+    n % slots. Each key remembers its absolute tick, so a slot can hold
+    keys for later revolutions; they are simply left in place until their
+    tick comes. With one revolution per day and daily reminders that is at
+    most one extra look per key per day, so a single level is enough.
+    """
+
+    def __init__(self, tick: float, slots: int, origin: float):
+        self.tick = tick
+        self.origin = origin
+        self._slots: list[set[int]] = [set() for _ in range(slots)]
+        self._due: dict[int, int] = {}
+        self._current = self._tick_of(origin)
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._due
+
+    @property
+    def now(self) -> float:
+        """Time of the last tick advance has processed."""
+        return self.origin + self._current * self.tick
+
+    def _tick_of(self, when: float) -> int:
+        return int((when - self.origin) // self.tick)
+
+    def schedule(self, key: int, when: float):
+        """Fire the key at the first tick boundary at or after `when`, replacing any earlier schedule."""
+        self.cancel(key)
+        tick = max(math.ceil((when - self.origin) / self.tick), self._current + 1)
+        self._due[key] = tick
+        self._slots[tick % len(self._slots)].add(key)
+
+    def cancel(self, key: int) -> bool:
+        tick = self._due.pop(key, None)
+        if tick is None:
+            return False
+        self._slots[tick % len(self._slots)].discard(key)
+        return True
+
+    def advance(self, now: float) -> list[int]:
+        """Move to `now` and return the keys that became due, removing them."""
+        target = self._tick_of(now)
+        if target <= self._current:
+            return []
+        fired = []
+        # After a long stall one pass over every slot is enough, ticks are absolute
+        first = max(self._current + 1, target - len(self._slots) + 1)
+        for tick in range(first, target + 1):
+            slot = self._slots[tick % len(self._slots)]
+            if not slot:
+                continue
+            due = [key for key in slot if self._due[key] <= target]
+            for key in due:
+                slot.discard(key)
+                del self._due[key]
+            fired.extend(due)
+        self._current = target
+        return fired
+
+@dataclass
+class ReminderStats:
+    fired: int = 0
+    sent: int = 0
+    skipped_quiet: int = 0
+    skipped_on_track: int = 0
+    send_errors: int = 0
+
+class ReminderStore:
+    """Subscriptions in SQLite; they fully determine the reminder schedule.
+
+    Changes are written behind like profiles. Every row carries the time it
+    was last changed, so the process running the reminders can pick up
+    changes made by other shard workers.
+    """
+
+    def __init__(self, path: str, flush_interval: float):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._dirty: dict[int, Subscription] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS reminder_subscriptions (user_id INTEGER PRIMARY KEY, "
+            "enabled INTEGER NOT NULL, utc_offset INTEGER, quiet_start INTEGER NOT NULL, "
+            "quiet_end INTEGER NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS reminder_subscriptions_updated ON reminder_subscriptions (updated)")
+        self._db.commit()
+
+    async def _run(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def start(self):
+        if self._executor is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reminders")
+        await self._run(self._open)
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        if self._executor is None:
+            return
+        await self.flush()
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except StorageError as e:
+                logger.error(f"Reminder flush failed: {str(e)}")
+
+    def _load(self, since: float) -> list[tuple]:
+        return self._db.execute(
+            "SELECT user_id, enabled, utc_offset, quiet_start, quiet_end, updated "
+            "FROM reminder_subscriptions WHERE updated > ?", (since,)
+        ).fetchall()
+
+    def _write(self, rows: list[tuple]):
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO reminder_subscriptions "
+                "(user_id, enabled, utc_offset, quiet_start, quiet_end, updated) VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+
+    async def load(self, since: float = 0.0) -> list[tuple]:
+        try:
+            return await self._run(self._load, since)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to load reminder subscriptions: {str(e)}")
+            raise StorageError(f"Database error: {str(e)}")
+
+    def save(self, user_id: int, subscription: Subscription):
+        self._dirty[user_id] = subscription
+
+    def is_pending(self, user_id: int) -> bool:
+        return user_id in self._dirty
+
+    async def flush(self) -> int:
+        if not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, {}
+        now = time.time()
+        rows = [
+            (user_id, int(s.enabled), s.utc_offset, s.quiet_start, s.quiet_end, now)
+            for user_id, s in dirty.items()
+        ]
+        try:
+            await self._run(self._write, rows)
+        except sqlite3.Error as e:
+            self._dirty = {**dirty, **self._dirty}
+            logger.error(f"Failed to save {len(rows)} reminder subscriptions: {str(e)}")
+            raise StorageError(f"Database error: {str(e)}")
+        return len(rows)
+
+class ReminderService:
+    """Water and meal-logging reminders for every subscribed user on one timing wheel.
+
+    Reminders are opt-in: users are registered with reminders off and turn
+    them on with /reminders on. Each subscribed user has one wheel entry per
+    checkpoint of the day
+    (REMINDER_WATER_TIMES, REMINDER_MEAL_TIMES) in their local time. Every
+    tick the due entries are rescheduled for the next day and evaluated
+    together: profiles and logs are read in bulk, a reminder is dropped
+    during the user's quiet hours or if they are on track, and the rest are
+    sent through a rate-limited outbox.
+
+    Subscriptions can be changed by any process; only the one that runs the
+    wheel (see start) sends reminders, and it rereads changed subscriptions
+    from the store every tick.
+    """
+
+    def __init__(self, store: ReminderStore, checkpoints: list[Checkpoint], tick: float, send_rate: float):
+        self.store = store
+        self.checkpoints = checkpoints
+        self.wheel = TimingWheel(tick, math.ceil(86400 / tick), time.time())
+        self.subscriptions: dict[int, Subscription] = {}
+        self.stats = ReminderStats()
+        self.default_quiet = parse_quiet_hours(config.REMINDER_QUIET_HOURS)
+        self._bucket = TokenBucket(send_rate, max(1.0, send_rate), time.monotonic())
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        self._bot: Optional[Bot] = None
+        self._tasks: list[asyncio.Task] = []
+        self._synced = 0.0
+
+    def _key(self, user_id: int, index: int) -> int:
+        return user_id * len(self.checkpoints) + index
+
+    def _schedule(self, user_id: int, subscription: Subscription, now: float):
+        for index, checkpoint in enumerate(self.checkpoints):
+            key = self._key(user_id, index)
+            if subscription.enabled:
+                self.wheel.schedule(key, subscription.next_time(checkpoint.minute, now))
+            else:
+                self.wheel.cancel(key)
+
+    def _apply(self, user_id: int, subscription: Subscription):
+        self.subscriptions[user_id] = subscription
+        if self._bot is not None:
+            # From the last processed tick, not the clock: a checkpoint due in
+            # the tick about to be processed must stay in it
+            self._schedule(user_id, subscription, self.wheel.now)
+
+    def _update(self, user_id: int, subscription: Subscription):
+        self._apply(user_id, subscription)
+        self.store.save(user_id, subscription)
+
+    def ensure(self, user: UserProfile):
+        """Register users seen for the first time, with reminders off, and follow changes of their time zone."""
+        subscription = self.subscriptions.get(user.user_id)
+        if subscription is None:
+            self._update(user.user_id, Subscription(False, user.utc_offset, *self.default_quiet))
+        elif subscription.utc_offset != user.utc_offset:
+            self._update(user.user_id, replace(subscription, utc_offset=user.utc_offset))
+
+    def get(self, user: UserProfile) -> Subscription:
+        self.ensure(user)
+        return self.subscriptions[user.user_id]
+
+    def set_enabled(self, user: UserProfile, enabled: bool):
+        self._update(user.user_id, replace(self.get(user), enabled=enabled))
+
+    def set_quiet_hours(self, user: UserProfile, start: int, end: int):
+        self._update(user.user_id, replace(self.get(user), quiet_start=start, quiet_end=end))
+
+    async def _sync(self, chunk: int = 10000) -> int:
+        """Apply subscriptions changed in the store since the last sync."""
+        rows = await self.store.load(self._synced - SYNC_OVERLAP if self._synced else 0.0)
+        for i, (user_id, enabled, utc_offset, quiet_start, quiet_end, updated) in enumerate(rows):
+            # A change not yet flushed here is newer than what the store has;
+            # rows reread because of the overlap are usually unchanged
+            subscription = Subscription(bool(enabled), utc_offset, quiet_start, quiet_end)
+            if not self.store.is_pending(user_id) and self.subscriptions.get(user_id) != subscription:
+                self._apply(user_id, subscription)
+            self._synced = max(self._synced, updated)
+            if i % chunk == chunk - 1:
+                await asyncio.sleep(0)
+        return len(rows)
+
+    async def start(self, bot: Optional[Bot] = None):
+        """Load subscriptions and keep them in sync; with a bot, also run the wheel and send reminders.
+
+        Exactly one process should be given the bot, or users get every reminder once per process.
+        """
+        if not self.checkpoints:
+            # Wheel keys are user_id * len(checkpoints) + index
+            raise ValueError("REMINDER_WATER_TIMES and REMINDER_MEAL_TIMES are both empty; "
+                             "set REMINDERS_ENABLED=0 to turn reminders off")
+        await self.store.start()
+        started = time.perf_counter()
+        loaded = await self._sync()
+        self._tasks = [asyncio.create_task(self._run())]
+        if bot is None:
+            return
+        self._bot = bot
+        self.wheel.advance(time.time())
+        now = self.wheel.now
+        for i, (user_id, subscription) in enumerate(self.subscriptions.items()):
+            self._schedule(user_id, subscription, now)
+            if i % 10000 == 9999:
+                await asyncio.sleep(0)
+        self._tasks.append(asyncio.create_task(self._send_loop()))
+        logger.info(f"Reminders: {len(self.wheel)} scheduled for {loaded} subscriptions "
+                    f"in {time.perf_counter() - started:.2f}s")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.store.close()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.wheel.tick - (time.time() - self.wheel.origin) % self.wheel.tick)
+            try:
+                await self._sync()
+                if self._bot is not None:
+                    await self.process(self.wheel.advance(time.time()))
+            except Exception as e:
+                logger.error(f"Reminder tick failed: {str(e)}")
+
+    async def process(self, keys: list[int], chunk: int = 500) -> int:
+        """Reschedule and evaluate the reminders due in one tick. Returns the number queued for sending."""
+        if not keys:
+            return 0
+        now = time.time()
+        due: dict[int, dict[str, Checkpoint]] = {}
+        for key in keys:
+            user_id, index = divmod(key, len(self.checkpoints))
+            subscription = self.subscriptions.get(user_id)
+            if subscription is None or not subscription.enabled:
+                continue
+            checkpoint = self.checkpoints[index]
+            self.wheel.schedule(key, subscription.next_time(checkpoint.minute, now))
+            if subscription.is_quiet(checkpoint.minute):
+                self.stats.skipped_quiet += 1
+                continue
+            # After a stall several checkpoints of a kind can be due at once, one reminder is enough
+            kinds = due.setdefault(user_id, {})
+            if checkpoint.kind not in kinds or kinds[checkpoint.kind].minute < checkpoint.minute:
+                kinds[checkpoint.kind] = checkpoint
+        self.stats.fired += len(keys)
+
+        queued = 0
+        user_ids = list(due)
+        for i in range(0, len(user_ids), chunk):
+            batch = user_ids[i:i + chunk]
+            try:
+                users = await repository.peek_many(batch)
+            except StorageError:
+                continue
+            for user_id in batch:
+                if user_id not in users:
+                    continue
+                profile, log = users[user_id]
+                for checkpoint in due[user_id].values():
+                    try:
+                        text = self.evaluate(checkpoint, self.subscriptions[user_id], profile, log, now)
+                    except (TypeError, ValueError, ZeroDivisionError) as e:
+                        logger.warning(f"Cannot evaluate a reminder for user {user_id}: {str(e)}")
+                        continue
+                    if text is None:
+                        self.stats.skipped_on_track += 1
+                        continue
+                    self._outbox.put_nowait((user_id, text))
+                    queued += 1
+            await asyncio.sleep(0)
+        return queued
+
+    def evaluate(self, checkpoint: Checkpoint, subscription: Subscription, user: UserProfile,
+                 log: Optional[DailyLog], now: float) -> Optional[str]:
+        """Reminder text for one checkpoint, or None if the user is on track."""
+        if log is not None and log.date.date() != user.local_now().date():
+            log = None
+        clock = format_clock(checkpoint.minute)
+        if checkpoint.kind == "water":
+            weather = WeatherService.cache.get(user.city_id) if user.city_id is not None else None
+            norm = user.calculate_water_norm(weather.temperature if weather is not None else DEFAULT_TEMPERATURE)
+            intake = log.water_intake if log is not None else 0.0
+            expected = norm * subscription.awake_fraction(checkpoint.minute)
+            if intake >= expected * config.REMINDER_WATER_SHARE:
+                return None
+            return (f"💧 К {clock} вы выпили {intake / norm * 100:.0f}% дневной нормы воды "
+                    f"({intake:.0f} из {norm:.0f} мл).\nЗапишите стакан воды: /log_water 250")
+        last_meal = log.food_log.last_timestamp() if log is not None else None
+        if last_meal is not None and now - last_meal < config.REMINDER_MEAL_GAP_HOURS * 3600:
+            return None
+        if last_meal is None:
+            since = "сегодня"
+        else:
+            since = f"с {datetime.fromtimestamp(last_meal + subscription.offset(), timezone.utc):%H:%M}"
+        return f"🍽 Вы не записывали еду {since}. Не забудьте: /log_food <что съели>"
+
+    async def _send_loop(self):
+        while True:
+            user_id, text = await self._outbox.get()
+            delay = self._bucket.wait_time(time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._bucket.try_take(time.monotonic())
+            try:
+                await self._bot.send_message(user_id, text)
+                self.stats.sent += 1
+            except TelegramForbiddenError:
+                # The user blocked the bot
+                self.stats.send_errors += 1
+                self._update(user_id, replace(self.subscriptions[user_id], enabled=False))
+            except TelegramRetryAfter as e:
+                self.stats.send_errors += 1
+                self._outbox.put_nowait((user_id, text))
+                await asyncio.sleep(e.retry_after)
+            except TelegramAPIError as e:
+                self.stats.send_errors += 1
+                logger.warning(f"Failed to send a reminder to user {user_id}: {str(e)}")
+
+    def get_stats(self) -> dict:
+        return {"subscriptions": len(self.subscriptions), "scheduled": len(self.wheel),
+                "outbox": self._outbox.qsize(), **vars(self.stats)}
+
+reminder_service = ReminderService(
+    ReminderStore(config.DB_PATH, config.STORAGE_FLUSH_INTERVAL),
+    checkpoints_from_config(),
+    config.REMINDER_TICK,
+    config.REMINDER_SEND_RATE
+)
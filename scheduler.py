@@ -0,0 +1,251 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import re
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, Update
+
+logger = logging.getLogger(__name__)
+
+# Commands whose handlers may wait on an LLM call; everything else is
+# answered from memory, the caches or a single weather lookup
+EXPENSIVE_COMMANDS = frozenset({"log_food", "log_workout"})
+
+_COMMAND = re.compile(r"/([A-Za-z0-9_]+)")
+
+def command_of(text: str) -> Optional[str]:
+    match = _COMMAND.match(text)
+    return match.group(1) if match else None
+
+def is_expensive(update: Update) -> bool:
+    message = update.message
+    return message is not None and command_of(message.text or "") in EXPENSIVE_COMMANDS
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `capacity` saved up."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def try_take(self, now: float, amount: float = 1.0) -> bool:
+        self._refill(now)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def wait_time(self, now: float, amount: float = 1.0) -> float:
+        """Seconds until `amount` tokens are available."""
+        self._refill(now)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+@dataclass
+class RateLimiterStats:
+    allowed: int = 0
+    rejected: int = 0
+
+class RateLimiter:
+    """Per-user token buckets, least recently used evicted past max_users.
+
+    An evicted user has been idle the longest, so their bucket would have
+    refilled anyway; forgetting it costs at most one extra burst.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: float, max_users: int):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_users = max_users
+        self.stats = RateLimiterStats()
+        self._buckets: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+
+    def acquire(self, key: Hashable) -> float:
+        """Take a token for key. Returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        if bucket.try_take(now):
+            self.stats.allowed += 1
+            return 0.0
+        self.stats.rejected += 1
+        return bucket.wait_time(now)
+
+@dataclass
+class FairQueueStats:
+    immediate: int = 0
+    queued: int = 0
+    cancelled: int = 0
+    wait_seconds: float = 0.0
+
+class FairQueue:
+    """Share a fixed number of concurrent slots fairly between users.
+
+    Self-clocked weighted fair queuing: each request gets a finish tag of
+    max(virtual time, the user's previous finish tag) + cost, and waiting
+    requests are served in tag order. A user with ten requests queued is
+    interleaved with everyone else instead of holding the next ten slots.
+    An optional global token bucket caps how fast slots are handed out
+    (the upstream API's rate limit); requests wait in the same fair order
+    for tokens.
+    """
+
+    def __init__(self, slots: int, rate: float = 0, burst: float = 1):
+        self.slots = slots
+        self.active = 0
+        self.waiting = 0
+        self.stats = FairQueueStats()
+        self._bucket: Optional[TokenBucket] = None
+        self.set_rate(rate, burst)
+        self._heap: list[tuple[float, int, Hashable, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._vtime = 0.0
+        self._finish: dict[Hashable, float] = {}
+        self._queued: dict[Hashable, int] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def set_rate(self, rate: float, burst: float = 1):
+        """Cap how fast slots are handed out; a rate of 0 removes the cap."""
+        self._bucket = TokenBucket(rate, max(1.0, burst), time.monotonic()) if rate > 0 else None
+
+    def _take_token(self) -> bool:
+        return self._bucket is None or self._bucket.try_take(time.monotonic())
+
+    def saturated(self) -> bool:
+        """Whether a new request would have to wait."""
+        if self.waiting or self.active >= self.slots:
+            return True
+        return self._bucket is not None and self._bucket.wait_time(time.monotonic()) > 0
+
+    def _forget(self, key: Hashable):
+        left = self._queued[key] - 1
+        if left:
+            self._queued[key] = left
+        else:
+            # Tags only grow, so an idle user's next request would start at
+            # the virtual time anyway
+            del self._queued[key]
+            del self._finish[key]
+
+    def _dispatch(self):
+        while self._heap and self.active < self.slots:
+            finish, _, key, future = self._heap[0]
+            if future.done():
+                heapq.heappop(self._heap)
+                continue
+            if not self._take_token():
+                if self._timer is None:
+                    delay = self._bucket.wait_time(time.monotonic())
+                    self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+                return
+            heapq.heappop(self._heap)
+            self._vtime = finish
+            self.waiting -= 1
+            self.active += 1
+            self._forget(key)
+            future.set_result(None)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    async def acquire(self, key: Hashable, cost: float = 1.0):
+        if not self._heap and self.active < self.slots and self._take_token():
+            self.active += 1
+            self.stats.immediate += 1
+            return
+        finish = max(self._vtime, self._finish.get(key, 0.0)) + cost
+        self._finish[key] = finish
+        self._queued[key] = self._queued.get(key, 0) + 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (finish, next(self._seq), key, future))
+        self.waiting += 1
+        self.stats.queued += 1
+        started = time.perf_counter()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just before the caller was cancelled
+                self.release()
+            else:
+                future.cancel()
+                self.waiting -= 1
+                self._forget(key)
+                self.stats.cancelled += 1
+            raise
+        finally:
+            self.stats.wait_seconds += time.perf_counter() - started
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, key: Hashable, cost: float = 1.0):
+        await self.acquire(key, cost)
+        try:
+            yield
+        finally:
+            self.release()
+
+class SchedulingMiddleware(BaseMiddleware):
+    """Gate expensive commands: per-user rate limit and "queued" feedback.
+
+    Cheap commands pass straight through. An expensive command over the
+    user's limit is answered with a retry hint instead of being handled;
+    one that will have to wait for an AI slot is handled as usual, but the
+    user is told first that the answer will take a while.
+    """
+
+    def __init__(self, limiter: Optional[RateLimiter], queue: FairQueue):
+        self.limiter = limiter
+        self.queue = queue
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: dict[str, Any]
+    ) -> Any:
+        if event.from_user is None or command_of(event.text or "") not in EXPENSIVE_COMMANDS:
+            return await handler(event, data)
+
+        if self.limiter is not None:
+            retry_after = self.limiter.acquire(event.from_user.id)
+            if retry_after:
+                logger.info("Rate limited", extra={"retry_after": round(retry_after, 1)})
+                await event.answer(
+                    "⏳ Слишком много запросов подряд.\n"
+                    f"Попробуйте снова через {math.ceil(retry_after)} сек."
+                )
+                return None
+
+        if self.queue.saturated():
+            await event.answer(
+                "⏳ Сейчас много запросов, ваш запрос в очереди"
+                f" (перед вами: {self.queue.waiting}). Ответ придет чуть позже."
+            )
+        return await handler(event, data)
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import struct
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from update_queue import UpdateQueue, update_user_id
+
+logger = logging.getLogger(__name__)
+
+_FRAME_HEADER = struct.Struct(">I")
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[dict]:
+    """Read one length-prefixed JSON frame, or None when the peer has gone."""
+    try:
+        header = await reader.readexactly(_FRAME_HEADER.size)
+        return json.loads(await reader.readexactly(_FRAME_HEADER.unpack(header)[0]))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+def write_frame(writer: asyncio.StreamWriter, message: dict):
+    payload = json.dumps(message, ensure_ascii=False).encode()
+    writer.write(_FRAME_HEADER.pack(len(payload)) + payload)
+
+def shard_for(user_id: int, shards: int) -> int:
+    # Fibonacci hashing spreads sequential ids evenly across shards
+    return ((user_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) % shards
+
+@dataclass
+class ShardStats:
+    routed: int = 0
+    acked: int = 0
+    rejected: int = 0
+    replayed: int = 0
+    restarts: int = 0
+
+class ShardRouter:
+    """Front-process side of the scale-out mode.
+
+    Routes each update by user to one of N worker processes over a Unix
+    socket. An update stays pending until its worker acknowledges it, so a
+    worker that crashes or is restarted gets its unfinished updates replayed
+    when the replacement connects. Each worker owns the users that hash to
+    it; when the number of workers changes, routing pauses until every
+    pending update is acknowledged and all workers have restarted (flushing
+    their caches), so no two processes ever hold the same user.
+    """
+
+    def __init__(self, shards: int, socket_path: str, window: int, restart_delay: float,
+                 worker_command: Callable[[int, int], list[str]]):
+        self.shards = shards
+        self.socket_path = socket_path
+        self.window = window
+        self.restart_delay = restart_delay
+        self.worker_command = worker_command
+        self.stats = ShardStats()
+        self._pending: list[OrderedDict[int, dict]] = []
+        self._writers: list[Optional[asyncio.StreamWriter]] = []
+        self._processes: list[Optional[asyncio.subprocess.Process]] = []
+        self._supervisors: list[asyncio.Task] = []
+        self._held: list[Update] = []
+        self._resizing = False
+        self._stopping = False
+        self._closed = False
+        self._changed = asyncio.Condition()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def _reset_shards(self):
+        self._pending = [OrderedDict() for _ in range(self.shards)]
+        self._writers = [None] * self.shards
+        self._processes = [None] * self.shards
+
+    def shard_of(self, update: Update) -> int:
+        # Workers own users, not chats: a user's profile and log live on one
+        # shard whichever chat (private or group) the message comes from
+        return shard_for(update_user_id(update), self.shards)
+
+    def _route(self, update: Update):
+        shard = self.shard_of(update)
+        message = {"update": update.model_dump(mode="json", exclude_unset=True)}
+        self._pending[shard][update.update_id] = message
+        self.stats.routed += 1
+        writer = self._writers[shard]
+        if writer is not None:
+            write_frame(writer, message)
+
+    def _has_room(self, update: Update) -> bool:
+        if self._resizing:
+            return len(self._held) < self.window * self.shards
+        return len(self._pending[self.shard_of(update)]) < self.window
+
+    def offer(self, update: Update) -> bool:
+        """Route the update without waiting; False if its shard is saturated."""
+        if self._closed or not self._has_room(update):
+            self.stats.rejected += 1
+            return False
+        if self._resizing:
+            self._held.append(update)
+        else:
+            self._route(update)
+        return True
+
+    async def put(self, update: Update):
+        """Route the update, waiting while its shard is saturated."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._has_room(update))
+        self.offer(update)
+
+    def health(self) -> dict:
+        return {
+            "shards": self.shards,
+            "connected": sum(writer is not None for writer in self._writers),
+            "pending": [len(pending) for pending in self._pending],
+            "held": len(self._held),
+            **vars(self.stats),
+        }
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        hello = await read_frame(reader)
+        shard = hello.get("hello") if isinstance(hello, dict) else None
+        if not isinstance(shard, int) or not 0 <= shard < self.shards:
+            logger.warning(f"Rejected shard connection with handshake {hello}")
+            writer.close()
+            return
+        previous = self._writers[shard]
+        if previous is not None:
+            previous.close()
+        self._writers[shard] = writer
+        pending = self._pending[shard]
+        for message in pending.values():
+            write_frame(writer, message)
+        if pending:
+            self.stats.replayed += len(pending)
+            logger.info(f"Replayed {len(pending)} pending updates to shard {shard}")
+        logger.info(f"Shard {shard} connected")
+
+        while (message := await read_frame(reader)) is not None:
+            if "ack" in message and pending.pop(message["ack"], None) is not None:
+                self.stats.acked += 1
+                await self._notify()
+        if self._writers[shard] is writer:
+            self._writers[shard] = None
+            logger.warning(f"Shard {shard} disconnected with {len(pending)} pending updates")
+        writer.close()
+
+    async def _supervise(self, shard: int):
+        while not self._stopping:
+            process = await asyncio.create_subprocess_exec(*self.worker_command(shard, self.shards))
+            self._processes[shard] = process
+            if self._stopping:
+                process.terminate()
+            logger.info(f"Started shard worker {shard} (pid {process.pid})")
+            code = await process.wait()
+            self._processes[shard] = None
+            if self._stopping:
+                break
+            self.stats.restarts += 1
+            logger.warning(f"Shard worker {shard} exited with code {code}, restarting")
+            await asyncio.sleep(self.restart_delay)
+
+    def _start_workers(self):
+        self._supervisors = [asyncio.create_task(self._supervise(shard)) for shard in range(self.shards)]
+
+    async def _stop_workers(self):
+        self._stopping = True
+        for process in self._processes:
+            if process is not None and process.returncode is None:
+                process.terminate()
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+        self._supervisors = []
+        self._stopping = False
+
+    async def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._reset_shards()
+        self._server = await asyncio.start_unix_server(self._handle_connection, self.socket_path)
+        self._start_workers()
+        logger.info(f"Shard router started with {self.shards} workers on {self.socket_path}")
+
+    async def _drain(self, timeout: float) -> bool:
+        try:
+            async with self._changed:
+                await asyncio.wait_for(
+                    self._changed.wait_for(lambda: not any(self._pending)), timeout
+                )
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def restart_worker(self, shard: int):
+        """Restart one worker; its unacknowledged updates are replayed to the new process."""
+        process = self._processes[shard]
+        if process is not None and process.returncode is None:
+            process.terminate()
+
+    def restart_all(self):
+        for shard in range(self.shards):
+            self.restart_worker(shard)
+
+    async def resize(self, shards: int, drain_timeout: float):
+        """Change the number of workers without dropping updates."""
+        if shards < 1 or shards == self.shards or self._resizing:
+            return
+        logger.info(f"Resizing shard pool from {self.shards} to {shards} workers")
+        self._resizing = True
+        if not await self._drain(drain_timeout):
+            logger.warning("Resizing with unacknowledged updates; they will be re-routed")
+        leftover = [Update.model_validate(message["update"]) for pending in self._pending for message in pending.values()]
+        await self._stop_workers()
+        self.shards = shards
+        self._reset_shards()
+        self._start_workers()
+        held, self._held = leftover + self._held, []
+        self._resizing = False
+        for update in held:
+            self._route(update)
+        await self._notify()
+
+    async def stop(self, drain_timeout: float):
+        self._closed = True
+        # Workers also get the SIGINT and may exit while draining; don't restart them
+        self._stopping = True
+        if not await self._drain(drain_timeout):
+            logger.warning(f"Stopping with {sum(map(len, self._pending))} unacknowledged updates")
+        await self._stop_workers()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for writer in self._writers:
+            if writer is not None:
+                writer.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        logger.info("Shard router stopped")
+
+class ShardWorker:
+    """Worker-process side: handle the updates routed to one shard."""
+
+    def __init__(self, shard: int, socket_path: str, dp: Dispatcher, bot: Bot,
+                 workers: int, queue_size: int, drain_timeout: float, fast_workers: int = 0):
+        self.shard = shard
+        self.socket_path = socket_path
+        self.drain_timeout = drain_timeout
+        self.bot = bot
+        self.queue = UpdateQueue(dp, bot, workers, queue_size, on_done=self._ack, fast_workers=fast_workers)
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def _ack(self, update: Update):
+        if self._writer is not None and not self._writer.is_closing():
+            write_frame(self._writer, {"ack": update.update_id})
+            await self._writer.drain()
+
+    async def run(self):
+        reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+        write_frame(self._writer, {"hello": self.shard})
+        await self._writer.drain()
+        self.queue.start()
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+
+        async def receive():
+            while (message := await read_frame(reader)) is not None:
+                await self.queue.put(Update.model_validate(message["update"], context={"bot": self.bot}))
+            stop.set()
+
+        receiver = asyncio.create_task(receive())
+        await stop.wait()
+        receiver.cancel()
+        await asyncio.gather(receiver, return_exceptions=True)
+        # Finish what was already received so it is acknowledged, not replayed
+        await self.queue.stop(self.drain_timeout)
+        self._writer.close()
+        logger.info(f"Shard worker {self.shard} stopped")
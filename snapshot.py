@@ -0,0 +1,232 @@
+import asyncio
+import io
+import logging
+import os
+import pickle
+import time
+import zlib
+from contextlib import suppress
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from ai_cache import ai_cache
+from config import config
+from metrics import WARMUP_SECONDS, SNAPSHOT_SECONDS, SNAPSHOT_BYTES
+from models import UserProfile, DailyLog
+from storage import StorageError, repository
+from weather_service import WeatherInfo, WeatherService
+
+logger = logging.getLogger(__name__)
+
+# File layout: magic with a format version, then a zlib-compressed pickle of
+# plain tuples, lists, strings and numbers (no classes, see _PlainUnpickler)
+MAGIC = b"FBSNAP\x01"
+
+class SnapshotError(Exception):
+    pass
+
+class _PlainUnpickler(pickle.Unpickler):
+    """Refuses to import anything, so a snapshot can only contain built-in values."""
+
+    def find_class(self, module: str, name: str):
+        raise pickle.UnpicklingError(f"Snapshot may not reference {module}.{name}")
+
+def _write_file(path: str, payload: dict) -> int:
+    data = MAGIC + zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    # Readers see either the previous snapshot or the complete new one
+    os.replace(tmp_path, path)
+    with suppress(OSError):
+        directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+    return len(data)
+
+def _read_file(path: str) -> dict:
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise SnapshotError("Unknown snapshot format")
+    try:
+        payload = _PlainUnpickler(io.BytesIO(zlib.decompress(data[len(MAGIC):]))).load()
+    except (zlib.error, pickle.UnpicklingError, EOFError, ValueError) as e:
+        raise SnapshotError(f"Corrupt snapshot: {str(e)}")
+    if not isinstance(payload, dict):
+        raise SnapshotError("Corrupt snapshot: unexpected payload")
+    return payload
+
+def snapshot_path_for_shard(shard: Optional[int]) -> str:
+    if shard is None:
+        return config.SNAPSHOT_PATH
+    root, ext = os.path.splitext(config.SNAPSHOT_PATH)
+    return f"{root}.shard{shard}{ext}"
+
+@dataclass
+class WarmUp:
+    seconds: float = 0.0
+    snapshot_age: float = 0.0
+    profiles: int = 0
+    logs: int = 0
+    preloaded: int = 0
+    weather: int = 0
+    ai_estimates: int = 0
+    skipped: int = 0
+
+class Snapshotter:
+    """Periodic snapshots of the in-memory state for a warm restart.
+
+    A snapshot holds the cached profiles with today's logs, the weather cache
+    and the in-memory AI estimates. It is collected on the event loop in
+    chunks of SNAPSHOT_CHUNK entries, so handlers keep running in between,
+    and compressed and written from a worker thread. Profiles and logs are
+    only restored as-is if nothing was written to the database after the
+    snapshot was taken; otherwise the same users are reloaded from the
+    database in bulk. A shard worker only loads a snapshot taken by the same
+    shard with the same number of shards, since otherwise it would hold
+    users another worker owns.
+    """
+
+    def __init__(self, path: str, interval: float, chunk: int,
+                 shard: Optional[int] = None, shard_count: Optional[int] = None):
+        self.path = path
+        self.interval = interval
+        self.chunk = max(1, chunk)
+        self.shard = shard
+        self.shard_count = shard_count if shard is not None else None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Snapshots every {self.interval:.0f}s to {self.path}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save()
+            except (OSError, StorageError) as e:
+                logger.error(f"Snapshot failed: {str(e)}")
+
+    async def _yield(self, index: int):
+        if index % self.chunk == self.chunk - 1:
+            await asyncio.sleep(0)
+
+    async def _collect_users(self) -> list[tuple[int, str, Optional[str]]]:
+        users = []
+        for i, (user_id, profile, log) in enumerate(repository.cached_state()):
+            if log is not None and log.date.date() != profile.local_now().date():
+                log = None
+            users.append((user_id, profile.model_dump_json(), log.model_dump_json() if log is not None else None))
+            await self._yield(i)
+        return users
+
+    async def save(self) -> int:
+        """Write a snapshot now. Returns its size in bytes."""
+        async with self._lock:
+            started = time.perf_counter()
+            await repository.flush()
+            generation = repository.generation
+            users = await self._collect_users()
+            weather = [
+                (city_id, info.temperature, info.humidity, info.description, info.is_outdoor_friendly,
+                 info.last_updated.timestamp(), info.utc_offset, group_id)
+                for city_id, info, group_id in WeatherService.export_cache()
+            ]
+            estimates = [(namespace, key, expires_at, value)
+                         for (namespace, key), (expires_at, value) in ai_cache.export_memory()]
+            # A flush while collecting means some profiles may be newer than the
+            # generation recorded, and a later restore could not tell
+            await repository.flush()
+            payload = {
+                "created": time.time(),
+                "shard": self.shard,
+                "shard_count": self.shard_count,
+                "generation": generation if repository.generation == generation else None,
+                "users": users,
+                "weather": weather,
+                "ai": estimates,
+            }
+            size = await asyncio.to_thread(_write_file, self.path, payload)
+            elapsed = time.perf_counter() - started
+            SNAPSHOT_SECONDS.labels().set(elapsed)
+            SNAPSHOT_BYTES.labels().set(size)
+            logger.info(f"Snapshot of {len(users)} profiles, {len(weather)} cities and {len(estimates)} "
+                        f"AI estimates written in {elapsed:.2f}s ({size / 1024:.0f} KiB)")
+            return size
+
+    async def _restore_users(self, users: list, result: WarmUp):
+        for i, (user_id, profile_data, log_data) in enumerate(users):
+            try:
+                profile = UserProfile.model_validate_json(profile_data)
+                log = DailyLog.model_validate_json(log_data) if log_data is not None else None
+            except ValueError:
+                result.skipped += 1
+                continue
+            repository.seed(user_id, profile, log)
+            result.profiles += 1
+            result.logs += log is not None
+            await self._yield(i)
+
+    async def load(self) -> Optional[WarmUp]:
+        """Restore the latest snapshot, if any. Call after the repository is started."""
+        started = time.perf_counter()
+        try:
+            payload = await asyncio.to_thread(_read_file, self.path)
+        except FileNotFoundError:
+            logger.info(f"No snapshot at {self.path}, starting with cold caches")
+            return None
+        except (OSError, SnapshotError) as e:
+            logger.warning(f"Ignoring snapshot {self.path}: {str(e)}")
+            return None
+
+        if (payload.get("shard"), payload.get("shard_count")) != (self.shard, self.shard_count):
+            logger.warning(f"Ignoring snapshot {self.path}: taken by shard {payload.get('shard')} of "
+                           f"{payload.get('shard_count')}, this is shard {self.shard} of {self.shard_count}")
+            return None
+
+        result = WarmUp(snapshot_age=time.time() - payload.get("created", 0))
+        users = payload.get("users", [])
+        if payload.get("generation") is not None and payload["generation"] == repository.generation:
+            await self._restore_users(users, result)
+        else:
+            result.preloaded = await repository.preload([user_id for user_id, _, _ in users], self.chunk)
+
+        for i, (city_id, temperature, humidity, description, outdoor, updated, utc_offset, group_id) \
+                in enumerate(payload.get("weather", [])):
+            WeatherService.seed(city_id, WeatherInfo(
+                temperature, humidity, description, outdoor, datetime.fromtimestamp(updated), utc_offset
+            ), group_id)
+            result.weather += 1
+            await self._yield(i)
+        for i, (namespace, key, expires_at, value) in enumerate(payload.get("ai", [])):
+            ai_cache.seed((namespace, key), (expires_at, value))
+            result.ai_estimates += 1
+            await self._yield(i)
+
+        result.seconds = time.perf_counter() - started
+        WARMUP_SECONDS.labels().set(result.seconds)
+        logger.info(
+            f"Warm-up took {result.seconds:.2f}s: {result.profiles} profiles ({result.logs} with today's log) "
+            f"from the snapshot, {result.preloaded} from the database, {result.weather} cities, "
+            f"{result.ai_estimates} AI estimates; snapshot was {result.snapshot_age:.0f}s old"
+            + (f", {result.skipped} unreadable profiles skipped" if result.skipped else "")
+        )
+        return result
@@ -0,0 +1,411 @@
+import asyncio
+import logging
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from typing import Callable, Optional
+
+from config import config
+from history import DailyHistory, METRICS, day_number
+from models import UserProfile, DailyLog
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class StorageError(Exception):
+    pass
+
+class SQLiteRepository:
+    """Profiles and daily logs in SQLite with an in-memory write-behind cache.
+
+    Reads are served from an LRU of hot users; misses load from disk on a
+    dedicated worker thread so the event loop never blocks on SQLite. Writes
+    only mark entries dirty; a background task flushes all dirty entries in
+    one transaction every STORAGE_FLUSH_INTERVAL seconds, or sooner once
+    STORAGE_FLUSH_MAX_DIRTY entries are pending. Dirty entries are never
+    evicted before they are written, and neither are users pinned by an
+    update in flight, whose handler may still change the objects it holds.
+    """
+
+    def __init__(self, path: str, cache_size: int, flush_interval: float, flush_max_dirty: int):
+        self.path = path
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.flush_max_dirty = flush_max_dirty
+        # user_id -> profile, or None for users known to have no profile
+        self._users: "OrderedDict[int, Optional[UserProfile]]" = OrderedDict()
+        self._logs: dict[int, DailyLog] = {}
+        self._histories: dict[int, DailyHistory] = {}
+        self._dirty_histories: set[int] = set()
+        self._pending_entries: list[tuple] = []
+        self._dirty_users: set[int] = set()
+        self._dirty_logs: set[int] = set()
+        # user_id -> number of updates in flight for the user
+        self._pinned: dict[int, int] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        # Bumped by every flush that writes something, persisted with the data
+        # under generation_key; shard workers share the database, so each
+        # counts its own writes under a key of its own
+        self.generation = 0
+        self.generation_key = "generation"
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_requested = asyncio.Event()
+
+    async def _run(self, fn: Callable, *args):
+        if self._executor is None:
+            await self.start()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS daily_logs (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS history (user_id INTEGER PRIMARY KEY, start_day INTEGER NOT NULL, "
+            "logged BLOB NOT NULL, " + ", ".join(f"{metric} BLOB NOT NULL" for metric in METRICS) + ")"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS history_entries (user_id INTEGER NOT NULL, day INTEGER NOT NULL, "
+            "kind TEXT NOT NULL, name TEXT NOT NULL, calories REAL NOT NULL, minutes REAL, timestamp TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS history_entries_user_day ON history_entries (user_id, day)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._db.commit()
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (self.generation_key,)).fetchone()
+        self.generation = row[0] if row else 0
+
+    async def start(self):
+        if self._executor is not None:
+            return
+        # One thread owns the connection, so SQLite calls are naturally serialized
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._open)
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        logger.info(f"Storage opened at {self.path}")
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self._executor is None:
+            return
+        await self.flush()
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        self._db = None
+        logger.info("Storage closed")
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Storage flush failed: {str(e)}")
+
+    def _load_user(self, user_id: int) -> Optional[str]:
+        row = self._db.execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def _load_log(self, user_id: int) -> Optional[str]:
+        row = self._db.execute("SELECT data FROM daily_logs WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def _load_history(self, user_id: int) -> Optional[tuple]:
+        return self._db.execute(
+            f"SELECT start_day, logged, {', '.join(METRICS)} FROM history WHERE user_id = ?", (user_id,)
+        ).fetchone()
+
+    def _load_many(self, user_ids: list[int]) -> tuple[list[tuple[int, str]], list[tuple[int, str]]]:
+        placeholders = ", ".join("?" * len(user_ids))
+        users = self._db.execute(f"SELECT user_id, data FROM users WHERE user_id IN ({placeholders})", user_ids).fetchall()
+        logs = self._db.execute(f"SELECT user_id, data FROM daily_logs WHERE user_id IN ({placeholders})", user_ids).fetchall()
+        return users, logs
+
+    def _write(self, users: list[tuple[int, str]], logs: list[tuple[int, str]],
+               histories: list[tuple], entries: list[tuple], generation: int):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (self.generation_key, generation))
+            self._db.executemany("INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)", users)
+            self._db.executemany("INSERT OR REPLACE INTO daily_logs (user_id, data) VALUES (?, ?)", logs)
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO history (user_id, start_day, logged, {', '.join(METRICS)}) "
+                f"VALUES ({', '.join('?' * (len(METRICS) + 3))})", histories
+            )
+            self._db.executemany(
+                "INSERT INTO history_entries (user_id, day, kind, name, calories, minutes, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", entries
+            )
+
+    def _remember(self, user_id: int, profile: Optional[UserProfile]):
+        self._users[user_id] = profile
+        self._users.move_to_end(user_id)
+        excess = len(self._users) - self.cache_size
+        if excess <= 0:
+            return
+        # Walk from the least recently used end and stop as soon as enough clean
+        # entries are found; dirty ones are skipped, and there are at most
+        # STORAGE_FLUSH_MAX_DIRTY of them between flushes
+        victims = []
+        for candidate in self._users:
+            # save_user marks the profile dirty only after remembering it
+            if candidate == user_id or candidate in self._pinned:
+                continue
+            if candidate in self._dirty_users or candidate in self._dirty_logs or candidate in self._dirty_histories:
+                continue
+            victims.append(candidate)
+            if len(victims) == excess:
+                break
+        for candidate in victims:
+            del self._users[candidate]
+            self._logs.pop(candidate, None)
+            self._histories.pop(candidate, None)
+
+    @contextmanager
+    def pinned(self, user_id: int):
+        """Keep the user's cached profile, log and history from being evicted inside the block."""
+        self._pinned[user_id] = self._pinned.get(user_id, 0) + 1
+        try:
+            yield
+        finally:
+            if self._pinned[user_id] == 1:
+                del self._pinned[user_id]
+            else:
+                self._pinned[user_id] -= 1
+
+    def _mark(self, dirty: set[int], user_id: int):
+        dirty.add(user_id)
+        if len(self._dirty_users) + len(self._dirty_logs) + len(self._dirty_histories) >= self.flush_max_dirty:
+            self._flush_requested.set()
+
+    async def get_user(self, user_id: int) -> Optional[UserProfile]:
+        profile = self._users.get(user_id, _MISSING)
+        if profile is not _MISSING:
+            self._users.move_to_end(user_id)
+            return profile
+        try:
+            data = await self._run(self._load_user, user_id)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to load profile for user {user_id}: {str(e)}")
+            raise StorageError(f"Database error: {str(e)}")
+        # Another coroutine may have cached or created the user meanwhile
+        if user_id in self._users:
+            return self._users[user_id]
+        profile = UserProfile.model_validate_json(data) if data else None
+        self._remember(user_id, profile)
+        return profile
+
+    async def has_user(self, user_id: int) -> bool:
+        return await self.get_user(user_id) is not None
+
+    def save_user(self, profile: UserProfile):
+        self._remember(profile.user_id, profile)
+        self._mark(self._dirty_users, profile.user_id)
+
+    def mark_user_dirty(self, user_id: int):
+        self._mark(self._dirty_users, user_id)
+
+    async def get_daily_log(self, user: UserProfile) -> DailyLog:
+        """Return the user's log for their current local day.
+
+        Creates an empty log if none is stored. If the stored log belongs to
+        an earlier day it is closed at that day's end, archived, and replaced
+        by a fresh log starting at the user's local midnight.
+        """
+        user_id = user.user_id
+        log = self._logs.get(user_id)
+        if log is None:
+            try:
+                data = await self._run(self._load_log, user_id)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to load daily log for user {user_id}: {str(e)}")
+                raise StorageError(f"Database error: {str(e)}")
+            log = self._logs.get(user_id)
+            if log is None and data:
+                log = DailyLog.model_validate_json(data)
+                self._logs[user_id] = log
+
+        today = user.local_now().date()
+        if log is not None and log.date.date() == today:
+            return log
+        if log is not None:
+            history = await self.get_history(user_id)
+            # A concurrent call may have rolled the log over while the history
+            # was loading; archive and replace only the log still cached, with
+            # no await in between, so it is archived exactly once and a fresh
+            # log already written to is never replaced
+            if self._logs.get(user_id) is not log:
+                return await self.get_daily_log(user)
+            self._archive(user, log, history)
+        log = DailyLog(date=datetime.combine(today, time()), last_update=user.day_start(today))
+        self.save_daily_log(user_id, log)
+        return log
+
+    def _archive(self, user: UserProfile, log: DailyLog, history: DailyHistory):
+        day = log.date.date()
+        day_end = min(user.day_start(day + timedelta(days=1)), datetime.now())
+        totals = {metric: getattr(log, metric) for metric in METRICS}
+        totals["calorie_burned_bmr"] = log.bmr_burned(user, day_end)
+        history.set_day(day, totals)
+        number = day_number(day)
+        for kind, entries in (("food", log.food_log), ("workout", log.workout_log)):
+            self._pending_entries.extend(
+                (user.user_id, number, kind, name, calories, minutes, timestamp.isoformat())
+                for name, calories, minutes, timestamp in entries.rows()
+            )
+        self._mark(self._dirty_histories, user.user_id)
+        logger.info(f"Archived daily log of user {user.user_id} for {day}")
+
+    async def get_history(self, user_id: int) -> DailyHistory:
+        """Archived daily totals of the user (empty if nothing is archived yet)."""
+        history = self._histories.get(user_id)
+        if history is not None:
+            return history
+        try:
+            row = await self._run(self._load_history, user_id)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to load history for user {user_id}: {str(e)}")
+            raise StorageError(f"Database error: {str(e)}")
+        history = self._histories.get(user_id)
+        if history is None:
+            history = DailyHistory.from_row(row) if row else DailyHistory()
+            self._histories[user_id] = history
+        return history
+
+    async def get_history_totals(self, user_id: int, start: date, end: date) -> dict[str, float]:
+        return (await self.get_history(user_id)).totals(start, end)
+
+    def save_daily_log(self, user_id: int, log: DailyLog):
+        self._logs[user_id] = log
+        self._mark(self._dirty_logs, user_id)
+
+    def mark_log_dirty(self, user_id: int):
+        self._mark(self._dirty_logs, user_id)
+
+    def cached_users(self) -> list[UserProfile]:
+        """Profiles currently held in memory, i.e. the recently active users."""
+        return [profile for profile in self._users.values() if profile is not None]
+
+    def cached_state(self) -> list[tuple[int, UserProfile, Optional[DailyLog]]]:
+        """Cached profiles with their current logs, least recently used first."""
+        return [
+            (user_id, profile, self._logs.get(user_id))
+            for user_id, profile in self._users.items() if profile is not None
+        ]
+
+    def seed(self, user_id: int, profile: UserProfile, log: Optional[DailyLog]):
+        """Put an already persisted profile and log in the cache without marking them dirty."""
+        if user_id in self._users:
+            return
+        self._remember(user_id, profile)
+        if log is not None and user_id in self._users:
+            self._logs.setdefault(user_id, log)
+
+    async def preload(self, user_ids: list[int], chunk: int = 500) -> int:
+        """Warm the cache with the given users from disk. Returns the number loaded."""
+        loaded = 0
+        for i in range(0, len(user_ids), chunk):
+            missing = [user_id for user_id in user_ids[i:i + chunk] if user_id not in self._users]
+            if not missing:
+                continue
+            try:
+                users, logs = await self._run(self._load_many, missing)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to preload {len(missing)} users: {str(e)}")
+                raise StorageError(f"Database error: {str(e)}")
+            users, logs = dict(users), dict(logs)
+            # In the given order, so the most recently used end up freshest in the LRU
+            for user_id in missing:
+                data = users.get(user_id)
+                if data is None:
+                    continue
+                log = logs.get(user_id)
+                self.seed(user_id, UserProfile.model_validate_json(data),
+                          DailyLog.model_validate_json(log) if log else None)
+                loaded += 1
+        return loaded
+
+    async def peek_many(self, user_ids: list[int]) -> dict[int, tuple[UserProfile, Optional[DailyLog]]]:
+        """Profiles and logs of many users for reading only.
+
+        Cached entries are returned as they are; the rest are read from disk
+        in one query and not cached, so a background scan neither evicts hot
+        users nor keeps copies of users another process is serving.
+        """
+        result = {}
+        missing = []
+        for user_id in user_ids:
+            profile = self._users.get(user_id)
+            if profile is not None:
+                result[user_id] = (profile, self._logs.get(user_id))
+            elif user_id not in self._users:
+                missing.append(user_id)
+        if not missing:
+            return result
+        try:
+            users, logs = await self._run(self._load_many, missing)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to read {len(missing)} users: {str(e)}")
+            raise StorageError(f"Database error: {str(e)}")
+        logs = dict(logs)
+        for user_id, data in users:
+            log = logs.get(user_id)
+            result[user_id] = (UserProfile.model_validate_json(data), DailyLog.model_validate_json(log) if log else None)
+        return result
+
+    async def flush(self) -> int:
+        """Write all dirty entries in one transaction. Returns the number written."""
+        async with self._flush_lock:
+            if not self._dirty_users and not self._dirty_logs and not self._dirty_histories:
+                return 0
+            dirty_users, self._dirty_users = self._dirty_users, set()
+            dirty_logs, self._dirty_logs = self._dirty_logs, set()
+            dirty_histories, self._dirty_histories = self._dirty_histories, set()
+            entries, self._pending_entries = self._pending_entries, []
+            # Serialize on the loop so the snapshot is consistent with handlers
+            users = [
+                (user_id, self._users[user_id].model_dump_json())
+                for user_id in dirty_users if self._users.get(user_id) is not None
+            ]
+            logs = [
+                (user_id, self._logs[user_id].model_dump_json())
+                for user_id in dirty_logs if user_id in self._logs
+            ]
+            histories = [
+                (user_id, *self._histories[user_id].to_row())
+                for user_id in dirty_histories if user_id in self._histories
+            ]
+            try:
+                await self._run(self._write, users, logs, histories, entries, self.generation + 1)
+            except sqlite3.Error as e:
+                self._dirty_users |= dirty_users
+                self._dirty_logs |= dirty_logs
+                self._dirty_histories |= dirty_histories
+                self._pending_entries = entries + self._pending_entries
+                logger.error(f"Failed to flush {len(users)} profiles and {len(logs)} logs: {str(e)}")
+                raise StorageError(f"Database error: {str(e)}")
+            self.generation += 1
+            return len(users) + len(logs) + len(histories)
+
+repository = SQLiteRepository(
+    config.DB_PATH,
+    config.STORAGE_CACHE_SIZE,
+    config.STORAGE_FLUSH_INTERVAL,
+    config.STORAGE_FLUSH_MAX_DIRTY
+)
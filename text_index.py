@@ -0,0 +1,109 @@
+import re
+from collections import defaultdict
+from typing import Iterable, Optional
+
+_PUNCTUATION = re.compile(r"[^\w\s.,]+")
+_WHITESPACE = re.compile(r"\s+")
+_SEPARATORS = re.compile(r"[.,\s]+")
+_ENDINGS = ("ами", "ями", "ого", "его", "ой", "ом", "ей", "ам", "ах",
+            "а", "я", "ы", "и", "у", "ю", "е", "о")
+
+def normalize_text(text: str) -> str:
+    """Lowercase, fold "ё" and drop punctuation except decimal separators."""
+    text = text.lower().replace("ё", "е")
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+def strip_separators(text: str) -> str:
+    return _SEPARATORS.sub(" ", text).strip()
+
+def stem(text: str) -> str:
+    """Drop a common case ending so "хлеба" and "хлеб" index the same way."""
+    words = []
+    for word in text.split():
+        if len(word) > 4:
+            for ending in _ENDINGS:
+                if word.endswith(ending):
+                    word = word[:-len(ending)]
+                    break
+        words.append(word)
+    return " ".join(words)
+
+def index_key(text: str) -> str:
+    """Canonical form used both for indexing names and for queries."""
+    return stem(strip_separators(normalize_text(text)))
+
+def _content_words(text: str) -> int:
+    return sum(1 for word in text.split() if len(word) > 2)
+
+def _trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TrigramIndex:
+    """Fuzzy name lookup over a fixed set of aliases.
+
+    Every alias is indexed by its character trigrams; a query is scored
+    against the candidates sharing at least one trigram using the Dice
+    coefficient, so misspellings and word forms still match. Each alias
+    points at an integer id chosen by the caller.
+    """
+
+    def __init__(self, aliases: Iterable[tuple[str, int]]):
+        self._aliases: list[str] = []
+        self._ids: list[int] = []
+        self._sizes: list[int] = []
+        self._words: list[int] = []
+        self._exact: dict[str, int] = {}
+        postings: dict[str, list[int]] = defaultdict(list)
+        for alias, target_id in aliases:
+            alias = index_key(alias)
+            alias_index = len(self._aliases)
+            grams = _trigrams(alias)
+            self._aliases.append(alias)
+            self._ids.append(target_id)
+            self._sizes.append(len(grams))
+            self._words.append(_content_words(alias))
+            self._exact.setdefault(alias, alias_index)
+            for gram in grams:
+                postings[gram].append(alias_index)
+        self._postings = {gram: tuple(ids) for gram, ids in postings.items()}
+
+    def __len__(self) -> int:
+        return len(self._aliases)
+
+    def exact(self, key: str) -> Optional[int]:
+        """Look up an already normalized key (see index_key) without fuzzing."""
+        alias_index = self._exact.get(key)
+        return None if alias_index is None else self._ids[alias_index]
+
+    def search(self, text: str) -> Optional[tuple[int, float]]:
+        """Return the id of the best matching alias and its similarity in [0, 1]."""
+        name = index_key(text)
+        if not name:
+            return None
+        exact = self._exact.get(name)
+        if exact is not None:
+            return self._ids[exact], 1.0
+
+        grams = _trigrams(name)
+        overlap: dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for alias_index in self._postings.get(gram, ()):
+                overlap[alias_index] += 1
+        if not overlap:
+            return None
+
+        best_index, best_score = -1, 0.0
+        query_size = len(grams)
+        for alias_index, common in overlap.items():
+            score = 2 * common / (query_size + self._sizes[alias_index])
+            if score > best_score:
+                best_index, best_score = alias_index, score
+
+        # Words the best alias does not account for ("грудка с рисом") mean
+        # the query likely names something different or composite
+        query_words = _content_words(name)
+        if query_words > self._words[best_index]:
+            best_score *= self._words[best_index] / query_words
+        return self._ids[best_index], best_score
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from scheduler import is_expensive
+
+logger = logging.getLogger(__name__)
+
+def update_chat_id(update: Update) -> int:
+    """Chat (or user) the update belongs to, falling back to its id."""
+    try:
+        event = update.event
+    except LookupError:
+        return update.update_id
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else update.update_id
+
+def update_user_id(update: Update) -> int:
+    """User who sent the update, falling back to its chat for updates without one."""
+    try:
+        user = getattr(update.event, "from_user", None)
+    except LookupError:
+        user = None
+    return user.id if user is not None else update_chat_id(update)
+
+@dataclass
+class UpdateQueueStats:
+    received: int = 0
+    processed: int = 0
+    failed: int = 0
+    rejected: int = 0
+
+class UpdateQueue:
+    """Feed updates to the dispatcher from a fixed pool of workers.
+
+    Each worker has its own bounded queue and updates are routed by chat,
+    so one user's messages are handled in order while different users are
+    processed concurrently.
+
+    With fast_workers, commands that never call the AI get a separate pool
+    of workers, so a /status is not stuck behind someone else's /log_food
+    that happens to share its worker. Order is then kept per chat within
+    each pool, not across them.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int, queue_size: int,
+                 on_done: Optional[Callable[[Update], Awaitable[None]]] = None, fast_workers: int = 0):
+        self.dp = dp
+        self.bot = bot
+        self.on_done = on_done
+        self.stats = UpdateQueueStats()
+        lane_size = max(1, queue_size // (workers + fast_workers))
+        self._slow_queues = [asyncio.Queue(lane_size) for _ in range(workers)]
+        self._fast_queues = [asyncio.Queue(lane_size) for _ in range(fast_workers)]
+        self._queues = self._slow_queues + self._fast_queues
+        self._workers: list[asyncio.Task] = []
+
+    def _queue_for(self, update: Update) -> asyncio.Queue:
+        queues = self._fast_queues if self._fast_queues and not is_expensive(update) else self._slow_queues
+        return queues[update_chat_id(update) % len(queues)]
+
+    def offer(self, update: Update) -> bool:
+        """Queue the update without waiting; False if its queue is full."""
+        try:
+            self._queue_for(update).put_nowait(update)
+        except asyncio.QueueFull:
+            self.stats.rejected += 1
+            return False
+        self.stats.received += 1
+        return True
+
+    async def put(self, update: Update):
+        """Queue the update, waiting for room if its queue is full."""
+        await self._queue_for(update).put(update)
+        self.stats.received += 1
+
+    def qsize(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def health(self) -> dict:
+        return {
+            "queued": self.qsize(),
+            "queued_fast": sum(queue.qsize() for queue in self._fast_queues),
+            "workers": len(self._workers),
+            **vars(self.stats),
+        }
+
+    async def _work(self, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+                self.stats.processed += 1
+            except Exception as e:
+                self.stats.failed += 1
+                logger.error(f"Failed to process update {update.update_id}: {str(e)}")
+            finally:
+                queue.task_done()
+            if self.on_done is not None:
+                try:
+                    await self.on_done(update)
+                except Exception as e:
+                    logger.error(f"Completion callback failed for update {update.update_id}: {str(e)}")
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._work(queue)) for queue in self._queues]
+
+    async def stop(self, drain_timeout: float):
+        """Let queued updates finish (up to drain_timeout), then stop the workers."""
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)), drain_timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {self.qsize()} queued updates on shutdown")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Optional
+
+from config import config
+from models import UserProfile
+from weather_service import WeatherService, WeatherServiceError, weather_service
+
+logger = logging.getLogger(__name__)
+
+class WeatherPrefetcher:
+    """Keeps weather for active users' cities warm ahead of cache expiry.
+
+    Every tick it collects the cities of recently active users, picks the ones
+    that are missing from the cache or about to expire, orders them by the
+    number of active users and refreshes as many as the per-minute call budget
+    allows. Cities with a known OpenWeatherMap id are refreshed in batches via
+    the group endpoint; the rest fall back to single-city requests.
+    """
+
+    def __init__(self, users_provider: Callable[[], Iterable[UserProfile]]):
+        self.users_provider = users_provider
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info("Weather prefetcher started")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("Weather prefetcher stopped")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.prefetch_once()
+            except Exception as e:
+                logger.error(f"Weather prefetch tick failed: {str(e)}")
+            await asyncio.sleep(config.WEATHER_PREFETCH_INTERVAL)
+
+    def _tick_budget(self) -> int:
+        return max(1, int(config.WEATHER_PREFETCH_CALLS_PER_MINUTE * config.WEATHER_PREFETCH_INTERVAL / 60))
+
+    def due_cities(self) -> list[int]:
+        """Cities of active users needing a refresh, most popular first."""
+        now = datetime.now()
+        active_since = now - timedelta(minutes=config.WEATHER_PREFETCH_ACTIVE_MINUTES)
+        refresh_after = timedelta(minutes=config.WEATHER_CACHE_TTL_MINUTES - config.WEATHER_PREFETCH_LEAD_MINUTES)
+
+        city_counts = Counter(
+            user.city_id for user in self.users_provider()
+            if user.city_id is not None and user.last_active >= active_since
+        )
+        due = []
+        for city_id, _ in city_counts.most_common():
+            cached = WeatherService.cache.get(city_id)
+            if cached is None or now - cached.last_updated >= refresh_after:
+                due.append(city_id)
+        return due
+
+    async def prefetch_once(self) -> int:
+        """Run one prefetch pass. Returns the number of API calls made."""
+        budget = self._tick_budget()
+        batched, single = [], []
+        for city_id in self.due_cities():
+            if WeatherService.get_group_id(city_id) is not None:
+                batched.append(city_id)
+            else:
+                single.append(city_id)
+
+        # Group requests first: one call refreshes up to GROUP_MAX_IDS cities
+        group_size = WeatherService.GROUP_MAX_IDS
+        groups = [batched[i:i + group_size] for i in range(0, len(batched), group_size)]
+        groups = groups[:budget]
+        single = single[:budget - len(groups)]
+        if not groups and not single:
+            return 0
+
+        calls = [weather_service.get_weather_batch(group) for group in groups]
+        # Single-city fetches go through the coalescing path so they never
+        # duplicate a request already made by a handler
+        calls.extend(weather_service.refresh(city_id) for city_id in single)
+
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, WeatherServiceError)]
+        if errors:
+            logger.warning(f"Weather prefetch: {len(errors)} of {len(calls)} calls failed")
+        logger.info(f"Weather prefetch: {len(calls)} calls, {sum(map(len, groups)) + len(single)} cities refreshed")
+        return len(calls)
@@ -1,9 +1,13 @@
-import requests
+import asyncio
+import aiohttp
 import logging
-from dataclasses import dataclass
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from typing import Optional
+from city_index import City, get_city_index
 from config import config
+from metrics import timed, WEATHER_SECONDS, WEATHER_ERRORS
 
 logger = logging.getLogger(__name__)
 
@@ -13,17 +17,72 @@ class WeatherInfo:
     humidity: float
     description: str
     is_outdoor_friendly: bool
-    last_updated: datetime = datetime.now()
+    last_updated: datetime = field(default_factory=datetime.now)
+    utc_offset: Optional[int] = None
+
+    def age(self) -> timedelta:
+        return datetime.now() - self.last_updated
 
     def should_refresh(self) -> bool:
-        return datetime.now() - self.last_updated > timedelta(minutes=30)
+        return self.age() > timedelta(minutes=config.WEATHER_CACHE_TTL_MINUTES)
+
+    def is_expired(self) -> bool:
+        """Too old to be served even as a stale value."""
+        return self.age() > timedelta(minutes=config.WEATHER_CACHE_STALE_MINUTES)
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    stale: int = 0
+    evictions: int = 0
+    refresh_errors: int = 0
 
 class WeatherServiceError(Exception):
     pass
 
 class WeatherService:
     BASE_URL = "http://api.openweathermap.org/data/2.5/weather"
-    cache: dict[str, WeatherInfo] = {}
+    GROUP_URL = "http://api.openweathermap.org/data/2.5/group"
+    GROUP_MAX_IDS = 20  # OpenWeatherMap limit for a single group request
+    # Keyed by canonical city id (see resolve_city), so every spelling of a city shares one entry
+    cache: "OrderedDict[int, WeatherInfo]" = OrderedDict()
+    stats = CacheStats()
+    _inflight: dict[int, asyncio.Future] = {}
+    # City id -> id of the station OpenWeatherMap answered with, usable in group requests
+    _group_ids: dict[int, int] = {}
+    _session: Optional[aiohttp.ClientSession] = None
+
+    @classmethod
+    async def start(cls):
+        """Create the shared HTTP session. Called once on bot startup."""
+        if cls._session is not None and not cls._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit_per_host=config.WEATHER_MAX_CONNECTIONS,
+            keepalive_timeout=config.WEATHER_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=300
+        )
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=config.WEATHER_CONNECT_TIMEOUT,
+            sock_read=config.WEATHER_READ_TIMEOUT
+        )
+        cls._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        logger.info("Weather HTTP session started")
+
+    @classmethod
+    async def close(cls):
+        """Close the shared HTTP session. Called once on bot shutdown."""
+        if cls._session is not None and not cls._session.closed:
+            await cls._session.close()
+            logger.info("Weather HTTP session closed")
+        cls._session = None
+
+    @classmethod
+    async def _get_session(cls) -> aiohttp.ClientSession:
+        if cls._session is None or cls._session.closed:
+            await cls.start()
+        return cls._session
     
     @classmethod
     def _is_outdoor_friendly(cls, weather_id: int, temp: float) -> bool:
@@ -34,48 +93,208 @@ class WeatherService:
         return weather_id not in bad_conditions
     
     @classmethod
-    async def get_weather(cls, city: str) -> Optional[WeatherInfo]:
+    def _store(cls, city_id: int, weather_info: WeatherInfo):
+        cls.cache[city_id] = weather_info
+        cls.cache.move_to_end(city_id)
+        while len(cls.cache) > config.WEATHER_CACHE_MAX_SIZE:
+            cls.cache.popitem(last=False)
+            cls.stats.evictions += 1
+
+    @classmethod
+    def export_cache(cls) -> list[tuple[int, WeatherInfo, Optional[int]]]:
+        """Unexpired cache entries with their group ids, least recently used first."""
+        return [
+            (city_id, info, cls._group_ids.get(city_id))
+            for city_id, info in cls.cache.items() if not info.is_expired()
+        ]
+
+    @classmethod
+    def seed(cls, city_id: int, weather_info: WeatherInfo, group_id: Optional[int] = None):
+        if weather_info.is_expired() or city_id in cls.cache:
+            return
+        cls._store(city_id, weather_info)
+        if group_id is not None:
+            cls._group_ids.setdefault(city_id, group_id)
+
+    @classmethod
+    def _refresh(cls, city_id: int) -> asyncio.Future:
+        """Start a fetch for the city, or join the one already in flight."""
+        task = cls._inflight.get(city_id)
+        if task is None:
+            task = asyncio.ensure_future(cls._fetch_weather(city_id))
+            cls._inflight[city_id] = task
+            task.add_done_callback(lambda _: cls._inflight.pop(city_id, None))
+        return task
+
+    @classmethod
+    async def refresh(cls, city_id: int) -> WeatherInfo:
+        """Fetch the city's weather now, joining a fetch already in flight instead of duplicating it."""
+        # Shield so a cancelled caller does not cancel the fetch shared with others
+        return await asyncio.shield(cls._refresh(city_id))
+
+    @classmethod
+    def _on_background_refresh_done(cls, city_id: int, task: asyncio.Future):
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            cls.stats.refresh_errors += 1
+            logger.warning(f"Background weather refresh failed for city {city_id}: {task.exception()}")
+
+    @classmethod
+    @timed(WEATHER_SECONDS.labels(), WEATHER_ERRORS.labels(), (WeatherServiceError,))
+    async def get_weather(cls, city_id: int) -> Optional[WeatherInfo]:
+        cached = cls.cache.get(city_id)
+        if cached is not None and not cached.is_expired():
+            cls.cache.move_to_end(city_id)
+            if not cached.should_refresh():
+                cls.stats.hits += 1
+                return cached
+            # Serve the stale value right away and revalidate in the background
+            cls.stats.stale += 1
+            if city_id not in cls._inflight:
+                task = cls._refresh(city_id)
+                task.add_done_callback(lambda t: cls._on_background_refresh_done(city_id, t))
+            return cached
+
+        cls.stats.misses += 1
+        return await cls.refresh(city_id)
+
+    @classmethod
+    async def resolve_city(cls, text: str) -> Optional[City]:
+        """Turn what the user typed into a city with a canonical id.
+
+        The bundled city list answers without network access. Only names it
+        does not know confidently are looked up with the weather API, whose
+        city id then serves as the canonical one. Returns None if neither
+        knows the city.
+        """
+        index = get_city_index()
+        match = index.resolve(text)
+        if match is not None and match.confidence >= config.CITY_MIN_CONFIDENCE:
+            return match.city
+        data = await cls._request(cls.BASE_URL, {"q": text.strip()}, f"city {text.strip()!r}", not_found_ok=True)
+        if data is None:
+            return None
         try:
-            # Check cache first
-            if city in cls.cache and not cls.cache[city].should_refresh():
-                return cls.cache[city]
-            
-            params = {
-                "q": city,
-                "appid": config.WEATHER_API_KEY,
-                "units": "metric"
-            }
-            
-            response = requests.get(cls.BASE_URL, params=params)
-            if response.status_code != 200:
-                error_text = response.text
-                logger.error(f"Weather API error for {city}: {response.status_code} - {error_text}")
-                raise WeatherServiceError(f"API returned status {response.status_code}")
-            
-            data = response.json()
-            weather_info = WeatherInfo(
-                temperature=data["main"]["temp"],
-                humidity=data["main"]["humidity"],
-                description=data["weather"][0]["description"],
-                is_outdoor_friendly=cls._is_outdoor_friendly(
-                    data["weather"][0]["id"],
-                    data["main"]["temp"]
-                )
+            city = index.get(data["id"]) or City(
+                id=data["id"],
+                name=data.get("name") or text.strip(),
+                country=data.get("sys", {}).get("country", ""),
+                lat=data["coord"]["lat"],
+                lon=data["coord"]["lon"]
             )
-            
-            cls.cache[city] = weather_info
-            logger.info(f"Successfully fetched weather for {city}: {weather_info.temperature}°C, {weather_info.description}")
-            return weather_info
-            
-        except requests.RequestException as e:
-            logger.error(f"Network error fetching weather for {city}: {str(e)}")
+            weather_info = cls._parse_weather(data)
+        except (KeyError, IndexError, TypeError) as e:
+            logger.error(f"Failed to parse weather data for city {text.strip()!r}: {str(e)}")
+            raise WeatherServiceError(f"Data parsing error: {str(e)}")
+        index.add(city, text)
+        cls._store(city.id, weather_info)
+        cls._group_ids.setdefault(city.id, data["id"])
+        logger.info(f"Resolved city {text.strip()!r} with the weather API as {city.name} ({city.id})")
+        return city
+
+    @classmethod
+    async def _request(cls, url: str, params: dict, what: str, not_found_ok: bool = False) -> Optional[dict]:
+        params = {**params, "appid": config.WEATHER_API_KEY, "units": "metric"}
+        try:
+            session = await cls._get_session()
+            async with session.get(url, params=params) as response:
+                if response.status == 404 and not_found_ok:
+                    return None
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"Weather API error for {what}: {response.status} - {error_text[:200]}")
+                    raise WeatherServiceError(f"API returned status {response.status}")
+                return await response.json()
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout fetching weather for {what}")
+            raise WeatherServiceError("Request timed out")
+        except aiohttp.ClientError as e:
+            logger.error(f"Network error fetching weather for {what}: {str(e)}")
             raise WeatherServiceError(f"Network error: {str(e)}")
-        except (KeyError, IndexError) as e:
-            logger.error(f"Failed to parse weather data for {city}: {str(e)}")
+
+    @classmethod
+    def _location(cls, city_id: int) -> dict:
+        """Query parameters for a city: coordinates when the city list has them."""
+        city = get_city_index().get(city_id)
+        if city is None:
+            return {"id": city_id}
+        return {"lat": city.lat, "lon": city.lon}
+
+    @classmethod
+    async def _fetch_weather(cls, city_id: int) -> WeatherInfo:
+        data = await cls._request(cls.BASE_URL, cls._location(city_id), f"city {city_id}")
+        try:
+            weather_info = cls._parse_weather(data)
+        except (KeyError, IndexError, TypeError) as e:
+            logger.error(f"Failed to parse weather data for city {city_id}: {str(e)}")
             raise WeatherServiceError(f"Data parsing error: {str(e)}")
-        except Exception as e:
-            logger.error(f"Unexpected error fetching weather for {city}: {str(e)}")
-            raise WeatherServiceError(f"Unexpected error: {str(e)}")
+        cls._store(city_id, weather_info)
+        if "id" in data:
+            cls._group_ids[city_id] = data["id"]
+        logger.debug(f"Successfully fetched weather for city {city_id}: {weather_info.temperature}°C, {weather_info.description}")
+        return weather_info
+
+    @classmethod
+    def get_group_id(cls, city_id: int) -> Optional[int]:
+        return cls._group_ids.get(city_id)
+
+    @classmethod
+    async def get_weather_batch(cls, city_ids: list[int]) -> dict[int, WeatherInfo]:
+        """Refresh up to GROUP_MAX_IDS cities with a single group request.
+
+        Only cities already fetched once (so their station id is known) can be batched.
+        """
+        groups: dict[int, list[int]] = {}
+        for city_id in city_ids:
+            group_id = cls._group_ids.get(city_id)
+            if group_id is not None:
+                groups.setdefault(group_id, []).append(city_id)
+        if not groups:
+            return {}
+        if len(groups) > cls.GROUP_MAX_IDS:
+            raise WeatherServiceError(f"Group request limited to {cls.GROUP_MAX_IDS} cities")
+
+        data = await cls._request(cls.GROUP_URL, {"id": ",".join(str(group_id) for group_id in groups)}, "city group")
+        try:
+            result = {}
+            for item in data["list"]:
+                weather_info = cls._parse_weather(item)
+                for city_id in groups.get(item["id"], []):
+                    cls._store(city_id, weather_info)
+                    result[city_id] = weather_info
+        except (KeyError, IndexError, TypeError) as e:
+            logger.error(f"Failed to parse grouped weather data: {str(e)}")
+            raise WeatherServiceError(f"Data parsing error: {str(e)}")
+        logger.info(f"Fetched weather for {len(result)} cities in one group request")
+        return result
+
+    @classmethod
+    def _parse_weather(cls, data: dict) -> WeatherInfo:
+        return WeatherInfo(
+            temperature=data["main"]["temp"],
+            humidity=data["main"]["humidity"],
+            description=data["weather"][0]["description"],
+            is_outdoor_friendly=cls._is_outdoor_friendly(
+                data["weather"][0]["id"],
+                data["main"]["temp"]
+            ),
+            utc_offset=data.get("timezone", data.get("sys", {}).get("timezone"))
+        )
+
+    @classmethod
+    def get_cache_stats(cls) -> dict:
+        lookups = cls.stats.hits + cls.stats.misses + cls.stats.stale
+        return {
+            "size": len(cls.cache),
+            "inflight": len(cls._inflight),
+            "hits": cls.stats.hits,
+            "misses": cls.stats.misses,
+            "stale": cls.stats.stale,
+            "evictions": cls.stats.evictions,
+            "refresh_errors": cls.stats.refresh_errors,
+            "hit_rate": (cls.stats.hits + cls.stats.stale) / lookups if lookups else 0.0
+        }
     
     @classmethod
     def get_workout_adjustment(cls, weather: WeatherInfo) -> tuple[float, str]:
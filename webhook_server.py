@@ -0,0 +1,76 @@
+import hmac
+import logging
+from typing import Optional, Protocol
+
+from aiogram import Bot
+from aiogram.types import Update
+from aiohttp import web
+from pydantic import ValidationError
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class UpdateSink(Protocol):
+    def offer(self, update: Update) -> bool: ...
+    def health(self) -> dict: ...
+
+class WebhookServer:
+    """Serve Telegram updates from an embedded aiohttp server.
+
+    Updates are acknowledged with 200 as soon as the sink (the local update
+    queue or the shard router) accepts them and are handled in the
+    background. When the sink is full the update is refused with 429 and
+    Telegram redelivers it later.
+    """
+
+    def __init__(self, sink: UpdateSink, bot: Bot, path: str, secret: str):
+        self.sink = sink
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self._runner: Optional[web.AppRunner] = None
+        self._accepting = False
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/health", self.handle_health)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            logger.warning(f"Rejected webhook request with a bad secret token from {request.remote}")
+            return web.Response(status=401)
+        if not self._accepting:
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except (ValueError, ValidationError) as e:
+            logger.warning(f"Malformed webhook update: {str(e)}")
+            return web.Response(status=400)
+
+        if not self.sink.offer(update):
+            logger.warning(f"Update queue full, asking Telegram to retry update {update.update_id}")
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok" if self._accepting else "stopping", **self.sink.health()})
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._accepting = True
+        logger.info(f"Webhook server listening on {host}:{port}{self.path}")
+
+    def stop_accepting(self):
+        self._accepting = False
+
+    async def stop(self):
+        self._accepting = False
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        logger.info("Webhook server stopped")
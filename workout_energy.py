@@ -0,0 +1,182 @@
+import csv
+import logging
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from config import config
+from text_index import TrigramIndex, index_key
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ACTIVITIES_PATH = Path(__file__).parent / "data" / "activities.csv"
+
+# Standard MET to kcal conversion when height or age is unknown
+KCAL_PER_MET_KG_MINUTE = 3.5 / 200
+
+_INTENSITY_MODIFIERS = [
+    (re.compile(r"\b(?:очень\s+)?(?:легк\w*|медленн\w*|спокойн\w*|неспешн\w*|не\s*спеша|light|easy|slow\w*|gentle)\b"), 0.8, "низкая интенсивность"),
+    (re.compile(r"\b(?:умеренн\w*|moderate\w*)\b"), 1.0, "умеренная интенсивность"),
+    (re.compile(r"\b(?:интенсивн\w*|быстр\w*|тяжел\w*|усиленн\w*|жестк\w*|на\s+максимум\w*|hard|intense\w*|vigorous\w*|fast)\b"), 1.2, "высокая интенсивность"),
+]
+
+def detect_intensity(text: str) -> tuple[float, Optional[str]]:
+    """Return an intensity multiplier and its label from words like "легкий" or "интенсивно"."""
+    text = text.lower().replace("ё", "е")
+    for pattern, factor, label in _INTENSITY_MODIFIERS:
+        if pattern.search(text):
+            return factor, label
+    return 1.0, None
+
+def strip_intensity(text: str) -> str:
+    text = text.lower().replace("ё", "е")
+    for pattern, _, _ in _INTENSITY_MODIFIERS:
+        text = pattern.sub(" ", text)
+    return text
+
+@dataclass(slots=True)
+class Activity:
+    name: str
+    met: float
+
+@dataclass(slots=True)
+class WorkoutEstimate:
+    activity: Activity
+    met: float
+    calories_per_minute: float
+    calories: float
+    confidence: float
+    intensity_label: Optional[str] = None
+
+    @property
+    def explanation(self) -> str:
+        intensity = f", {self.intensity_label}" if self.intensity_label else ""
+        return f"Оценка на основе MET {self.met:g} для '{self.activity.name}'{intensity}"
+
+class WorkoutEnergyEngine:
+    """Local workout calorie estimates from a bundled MET table.
+
+    Activities and their Russian/English synonyms are matched with the same
+    trigram index as foods. Energy is MET times the user's resting rate from
+    the Mifflin-St Jeor formula used by UserProfile, which corrects MET for
+    body size and age; without height and age it falls back to the standard
+    MET * 3.5 * kg / 200.
+    """
+
+    def __init__(self, activities: list[Activity], aliases: list[tuple[str, int]]):
+        self.activities = activities
+        self.index = TrigramIndex(aliases)
+        self._max_alias_words = max((len(index_key(alias).split()) for alias, _ in aliases), default=1)
+
+    @classmethod
+    def from_csv(cls, path: Path = DEFAULT_ACTIVITIES_PATH) -> "WorkoutEnergyEngine":
+        activities: list[Activity] = []
+        aliases: list[tuple[str, int]] = []
+        with open(path, encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                activities.append(Activity(name=row["name"], met=float(row["met"])))
+                names = [row["name"]] + [s for s in row["synonyms"].split("|") if s]
+                aliases.extend((name, len(activities) - 1) for name in names)
+        logger.info(f"Loaded {len(activities)} activities with {len(aliases)} names from {path}")
+        return cls(activities, aliases)
+
+    def search(self, workout_type: str) -> Optional[tuple[Activity, float]]:
+        match = self.index.search(workout_type)
+        if match is None:
+            return None
+        activity_index, score = match
+        return self.activities[activity_index], score
+
+    def find_in_text(self, text: str) -> Optional[tuple[Activity, str]]:
+        """Find a known activity named anywhere in free text, longest phrase first.
+
+        Returns the activity and the text with the matched phrase removed.
+        """
+        words = index_key(text).split()
+        found = self._find_in_words(words)
+        if found is None:
+            return None
+        activity_index, start, size = found
+        return self.activities[activity_index], " ".join(words[:start] + words[start + size:])
+
+    def find_all_in_text(self, text: str) -> list[Activity]:
+        """All distinct known activities named in free text, longest phrases first."""
+        words = index_key(text).split()
+        activities: list[Activity] = []
+        while (found := self._find_in_words(words)) is not None:
+            activity_index, start, size = found
+            if self.activities[activity_index] not in activities:
+                activities.append(self.activities[activity_index])
+            del words[start:start + size]
+        return activities
+
+    def _find_in_words(self, words: list[str]) -> Optional[tuple[int, int, int]]:
+        for size in range(min(self._max_alias_words, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                activity_index = self.index.exact(" ".join(words[start:start + size]))
+                if activity_index is not None:
+                    return activity_index, start, size
+        return None
+
+    @staticmethod
+    def calories_per_minute(met: float, weight: float, height: Optional[float] = None, age: Optional[int] = None) -> float:
+        if height and age:
+            resting_per_minute = (10 * weight + 6.25 * height - 5 * age) / 1440
+            if resting_per_minute > 0:
+                return met * resting_per_minute
+        return met * KCAL_PER_MET_KG_MINUTE * weight
+
+    def estimate(
+        self,
+        workout_type: str,
+        minutes: float,
+        weight: float,
+        height: Optional[float] = None,
+        age: Optional[int] = None,
+        intensity: Optional[float] = None
+    ) -> Optional[WorkoutEstimate]:
+        # Some table rows already name an intensity ("легкий бег"); only
+        # apply the modifier on top of a base activity
+        exact = self.index.exact(index_key(workout_type))
+        if exact is not None:
+            return self.estimate_activity(self.activities[exact], minutes, weight, height, age, intensity or 1.0)
+
+        match = self.search(strip_intensity(workout_type))
+        if match is None:
+            return None
+        activity, confidence = match
+        intensity_label = None
+        if intensity is None:
+            intensity, intensity_label = detect_intensity(workout_type)
+        return self.estimate_activity(activity, minutes, weight, height, age, intensity, intensity_label, confidence)
+
+    def estimate_activity(
+        self,
+        activity: Activity,
+        minutes: float,
+        weight: float,
+        height: Optional[float] = None,
+        age: Optional[int] = None,
+        intensity: float = 1.0,
+        intensity_label: Optional[str] = None,
+        confidence: float = 1.0
+    ) -> WorkoutEstimate:
+        met = round(activity.met * intensity, 2)
+        per_minute = self.calories_per_minute(met, weight, height, age)
+        return WorkoutEstimate(
+            activity=activity,
+            met=met,
+            calories_per_minute=per_minute,
+            calories=per_minute * minutes,
+            confidence=confidence,
+            intensity_label=intensity_label
+        )
+
+_workout_engine: Optional[WorkoutEnergyEngine] = None
+
+def get_workout_engine() -> WorkoutEnergyEngine:
+    global _workout_engine
+    if _workout_engine is None:
+        _workout_engine = WorkoutEnergyEngine.from_csv(Path(config.ACTIVITIES_PATH) if config.ACTIVITIES_PATH else DEFAULT_ACTIVITIES_PATH)
+    return _workout_engine
@@ -0,0 +1,348 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from workout_energy import Activity, get_workout_engine
+
+# One pass over the lowercased text: h:mm clock durations, numbers (with a
+# comma or dot decimal part), range dashes and words. Units glued to
+# numbers ("30мин", "1ч30м") split into a number and a word token.
+_TOKEN = re.compile(r"(\d{1,2}:[0-5]\d)|(\d+(?:[.,]\d+)?)|([-–—~])|([a-zа-я]+)")
+
+CLOCK, NUMBER, DASH, WORD = range(4)
+
+_UNITS = {
+    **dict.fromkeys(["сек", "секунд", "секунда", "секунды", "секунду", "секунде",
+                     "sec", "secs", "second", "seconds"], 1 / 60),
+    **dict.fromkeys(["мин", "минут", "минута", "минуты", "минуту", "минуте", "минутка", "минутки", "минуток",
+                     "min", "mins", "minute", "minutes"], 1.0),
+    **dict.fromkeys(["ч", "час", "часа", "часов", "часу", "часик", "часика",
+                     "h", "hr", "hrs", "hour", "hours"], 60.0),
+}
+# Single letters are only units right after a number; "м" and "m" also mean
+# metres, so they count as minutes only after an hour part ("1ч 30м")
+_SHORT_UNITS = {"с": 1 / 60, "s": 1 / 60}
+_SHORT_MINUTES = {"м", "m"}
+# "час" on its own means one hour ("плавал час", "около часа")
+_BARE_HOUR = {"час", "часа", "часик", "hour"}
+# ...and followed by a number it is an hour and that many minutes ("час десять"),
+# while "часа два" is about two hours
+_HOUR_AND_MINUTES = {"час", "часик"}
+
+_NUMBER_WORDS = {
+    **dict.fromkeys(["один", "одна", "одну", "одного", "one"], 1),
+    **dict.fromkeys(["два", "две", "двух", "two"], 2),
+    **dict.fromkeys(["пару", "пара", "пары", "couple"], 2),
+    **dict.fromkeys(["три", "трех", "three"], 3),
+    **dict.fromkeys(["четыре", "четырех", "four"], 4),
+    **dict.fromkeys(["пять", "пяти", "five"], 5),
+    **dict.fromkeys(["шесть", "шести", "six"], 6),
+    **dict.fromkeys(["семь", "семи", "seven"], 7),
+    **dict.fromkeys(["восемь", "восьми", "eight"], 8),
+    **dict.fromkeys(["девять", "девяти", "nine"], 9),
+    **dict.fromkeys(["десять", "десяти", "ten"], 10),
+    **dict.fromkeys(["пятнадцать", "пятнадцати", "fifteen"], 15),
+    **dict.fromkeys(["двадцать", "двадцати", "twenty"], 20),
+    **dict.fromkeys(["тридцать", "тридцати", "thirty"], 30),
+    **dict.fromkeys(["сорок", "сорока", "forty"], 40),
+    **dict.fromkeys(["пятьдесят", "пятидесяти", "fifty"], 50),
+    **dict.fromkeys(["шестьдесят", "шестидесяти", "sixty"], 60),
+    **dict.fromkeys(["девяносто", "девяноста", "ninety"], 90),
+    **dict.fromkeys(["сто", "ста"], 100),
+    **dict.fromkeys(["полтора", "полторы", "полутора"], 1.5),
+    "пол": 0.5,
+    "четверть": 0.25,
+    "одиннадцать": 11, "двенадцать": 12, "тринадцать": 13, "четырнадцать": 14,
+    "шестнадцать": 16, "семнадцать": 17, "восемнадцать": 18, "девятнадцать": 19,
+    "семьдесят": 70, "восемьдесят": 80,
+}
+_TENS = {20, 30, 40, 50, 60, 70, 80, 90}
+# Whole durations written as one word
+_FUSED = {"полчаса": 30.0, "получаса": 30.0, "полчасика": 30.0, "полминуты": 0.5}
+
+_APPROXIMATE = {"около", "примерно", "приблизительно", "где", "почти", "порядка", "about", "around", "approximately", "~"}
+_MORE_THAN = {"небольшим", "лишним", "хвостиком"}
+_RANGE_WORDS = {"до", "или", "to", "or"}
+_VAGUE = {"несколько", "сколько", "some", "few"}
+# "3 подхода по 10 минут": the duration is per set
+_SETS = ("подход", "круг", "раунд", "сет", "серии", "серий", "интервал", "раз", "round", "set")
+
+# Duration confidence by how it was written
+EXPLICIT = 1.0
+WORDS = 0.95
+APPROXIMATE = 0.85
+VAGUE = 0.4
+# Several activities with a duration each ("бег 10 минут и плавание 20 минут"):
+# the total is right but no single activity is, so the AI should split it
+SEVERAL_ACTIVITIES = 0.5
+
+@dataclass(slots=True)
+class Duration:
+    minutes: float
+    confidence: float
+    # Separate places in the text the duration was summed from
+    parts: int = 1
+
+@dataclass(slots=True)
+class ParsedWorkout:
+    activity: Optional[Activity]
+    rest: str
+    minutes: Optional[float]
+    confidence: float
+
+    @property
+    def explanation(self) -> str:
+        return "Распознано по описанию" if self.confidence >= APPROXIMATE else "Примерная оценка длительности"
+
+def tokenize(text: str) -> list[tuple[int, str]]:
+    tokens = []
+    for match in _TOKEN.finditer(text.lower().replace("ё", "е")):
+        kind = match.lastindex - 1
+        tokens.append((kind, match.group(match.lastindex)))
+    return tokens
+
+class _DurationParser:
+    """Recursive-descent reader over the token list; see parse_duration."""
+
+    def __init__(self, tokens: list[tuple[int, str]]):
+        self.tokens = tokens
+        self.i = 0
+
+    def word(self, offset: int = 0) -> Optional[str]:
+        i = self.i + offset
+        if i < len(self.tokens) and self.tokens[i][0] == WORD:
+            return self.tokens[i][1]
+        return None
+
+    def kind(self, offset: int = 0) -> Optional[int]:
+        i = self.i + offset
+        return self.tokens[i][0] if i < len(self.tokens) else None
+
+    def at_range(self) -> bool:
+        if self.kind() == DASH:
+            return self.tokens[self.i][1] != "~"
+        return self.word() in _RANGE_WORDS
+
+    def number(self) -> Optional[tuple[float, bool]]:
+        """A number at the cursor: digits, or words like "двадцать пять" and "два с половиной".
+
+        Returns the value and whether it was spelled out.
+        """
+        kind = self.kind()
+        if kind == NUMBER:
+            value = float(self.tokens[self.i][1].replace(",", "."))
+            self.i += 1
+            spelled = False
+        elif kind == WORD and self.word() in _NUMBER_WORDS:
+            value = _NUMBER_WORDS[self.word()]
+            self.i += 1
+            if value in _TENS and self.word() in _NUMBER_WORDS and _NUMBER_WORDS[self.word()] < 10:
+                value += _NUMBER_WORDS[self.word()]
+                self.i += 1
+            spelled = True
+        else:
+            return None
+        if self.word() == "с" and self.word(1) == "половиной":
+            value += 0.5
+            self.i += 2
+        return value, spelled
+
+    def unit(self, after_number: bool, after_hours: bool) -> Optional[float]:
+        word = self.word()
+        if word is None:
+            return None
+        scale = _UNITS.get(word)
+        if scale is None and after_number:
+            scale = _SHORT_UNITS.get(word)
+            if scale is None and after_hours and word in _SHORT_MINUTES:
+                scale = 1.0
+        if scale is not None:
+            self.i += 1
+        return scale
+
+    def tail(self, duration: Duration, scale: float) -> Duration:
+        """Qualifiers after a unit: "с половиной", "с небольшим", "-полтора"."""
+        if self.word() == "с" and self.word(1) == "половиной":
+            self.i += 2
+            return Duration(duration.minutes + scale / 2, duration.confidence)
+        if self.word() == "с" and self.word(1) in _MORE_THAN:
+            self.i += 2
+            extra = max(5.0, round(duration.minutes * 0.15 / 5) * 5)
+            return Duration(duration.minutes + extra, min(duration.confidence, APPROXIMATE))
+        if self.at_range():
+            start = self.i
+            self.i += 1
+            upper = self.number()
+            if upper is not None and self.unit(True, False) is None:
+                return Duration((duration.minutes + upper[0] * scale) / 2, min(duration.confidence, APPROXIMATE))
+            self.i = start
+        return duration
+
+    def component(self, after_hours: bool) -> Optional[tuple[Duration, float]]:
+        """One "<number> <unit>" part at the cursor, with its unit scale."""
+        start = self.i
+        word = self.word()
+        if word in _FUSED:
+            self.i += 1
+            return Duration(_FUSED[word], WORDS), 60.0
+
+        approximate = False
+        if word == "от":
+            self.i += 1
+            approximate = True
+        lower = self.number()
+        if lower is not None:
+            value, spelled = lower
+            confidence = WORDS if spelled else EXPLICIT
+            if self.at_range():
+                self.i += 1
+                upper = self.number()
+                if upper is None:
+                    self.i = start
+                    return None
+                value = (value + upper[0]) / 2
+                approximate = True
+            scale = self.unit(True, after_hours)
+            if scale is None:
+                self.i = start
+                return None
+            if approximate:
+                confidence = APPROXIMATE
+            return self.tail(Duration(value * scale, confidence), scale), scale
+
+        # Abbreviations are not read without a number: the "ч" in "км/ч" is not an hour
+        scale = self.unit(False, after_hours) if word and len(word) >= 3 else None
+        if scale is None:
+            self.i = start
+            return None
+        # Unit first: "минут 10" is a rough estimate, "часа полтора" too
+        after_unit = self.i
+        inverted = self.number()
+        if inverted is not None and word in _HOUR_AND_MINUTES and 1 <= inverted[0] < 60:
+            minutes_unit = self.unit(True, True)
+            if minutes_unit is None or minutes_unit == 1.0:
+                return Duration(60.0 + inverted[0], WORDS), 1.0
+            # "час 30 секунд": the number belongs to the next part
+            self.i = after_unit
+            return Duration(60.0, WORDS), 60.0
+        if inverted is not None:
+            return Duration(inverted[0] * scale, APPROXIMATE), scale
+        if word in _BARE_HOUR:
+            return self.tail(Duration(60.0, WORDS), 60.0), 60.0
+        self.i = start
+        return None
+
+    def set_duration(self, duration: Duration, scale: float) -> Duration:
+        """Extend the duration of one set by a smaller unit right after it ("по 1 минуте 30 секунд")."""
+        start = self.i
+        following = self.component(after_hours=scale >= 60)
+        if following is None or following[1] >= scale:
+            self.i = start
+            return duration
+        return Duration(duration.minutes + following[0].minutes, min(duration.confidence, following[0].confidence))
+
+    def parse(self) -> Optional[Duration]:
+        total: Optional[Duration] = None
+        parts = 0
+        skipped = True
+        approximate = False
+        vague = False
+        repeats: Optional[float] = None
+        while self.i < len(self.tokens):
+            kind, value = self.tokens[self.i]
+            if kind == CLOCK and total is None:
+                hours, minutes = value.split(":")
+                total = Duration(int(hours) * 60 + int(minutes), APPROXIMATE)
+                self.i += 1
+                continue
+            if kind == WORD and value in _APPROXIMATE or kind == DASH and value == "~":
+                approximate = True
+                self.i += 1
+                continue
+            if kind == WORD and value in _VAGUE:
+                vague = True
+                self.i += 1
+                continue
+
+            # "3 подхода по 10 минут": the count applies to the duration after "по" only
+            start = self.i
+            count = self.number()
+            if count is not None and self.word() and self.word().startswith(_SETS):
+                self.i += 1
+                if self.word() == "по":
+                    self.i += 1
+                    repeats = count[0]
+                continue
+            self.i = start
+
+            part = self.component(after_hours=total is not None and total.minutes >= 60)
+            if part is None:
+                repeats = None
+                self.i += 1
+                skipped = True
+                continue
+            parts += skipped
+            skipped = False
+            duration, scale = part
+            if repeats is not None:
+                duration = Duration(self.set_duration(duration, scale).minutes * repeats, duration.confidence)
+                repeats = None
+            if total is None:
+                total = duration
+            else:
+                # Compound duration: "1 час 20 минут", "2 часа и 15 минут"
+                total = Duration(total.minutes + duration.minutes, min(total.confidence, duration.confidence))
+            while self.word() == "и":
+                self.i += 1
+                following = self.component(after_hours=True)
+                if following is None:
+                    break
+                total = Duration(total.minutes + following[0].minutes, min(total.confidence, following[0].confidence))
+
+        if total is None:
+            return None
+        confidence = total.confidence
+        if approximate:
+            confidence = min(confidence, APPROXIMATE)
+        if vague:
+            confidence = min(confidence, VAGUE)
+        return Duration(total.minutes, confidence, max(parts, 1))
+
+def parse_duration(text: str) -> Optional[Duration]:
+    """Total workout duration in minutes and how sure the reading is.
+
+    Understands digits and Russian number words ("полчаса", "полтора часа",
+    "два с половиной часа", "час с небольшим"), compound durations
+    ("1 час 20 минут", "1ч30м", "1:30", "час десять"), ranges ("30-40 минут",
+    "от 30 до 40 минут", "час-полтора", taken at the midpoint) and repeated
+    sets ("3 подхода по 10 минут", counted for that part only). Units must be whole words, so the "с"
+    in "3 сета" or the "h" inside a word is never read as seconds or hours.
+    """
+    return _DurationParser(tokenize(text)).parse()
+
+def parse_workout(text: str) -> ParsedWorkout:
+    """Recognise the activity and duration of a free-text workout description.
+
+    Confidence is the lower of the two: 1 for an activity named exactly as
+    in the activity table, the fuzzy match score otherwise; 1 for an
+    explicit duration, less for spelled-out, approximate, ranged or vague
+    ones, and 0 when no duration is given. Several different activities
+    with durations of their own are summed but kept below
+    WORKOUT_PARSER_MIN_CONFIDENCE, so the AI splits them.
+    """
+    engine = get_workout_engine()
+    found = engine.find_in_text(text)
+    if found is not None:
+        activity, rest = found
+        activity_confidence = 1.0
+    else:
+        match = engine.search(text)
+        activity, activity_confidence = match if match is not None else (None, 0.0)
+        rest = text
+    duration = parse_duration(text)
+    if duration is None:
+        return ParsedWorkout(activity, rest, None, 0.0)
+    confidence = min(activity_confidence, duration.confidence)
+    if found is not None and duration.parts > 1 and len(engine.find_all_in_text(text)) > 1:
+        confidence = min(confidence, SEVERAL_ACTIVITIES)
+    return ParsedWorkout(activity, rest, duration.minutes, confidence)